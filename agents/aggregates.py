@@ -0,0 +1,183 @@
+import threading
+
+import pandas as pd
+
+from agents.table_store import data_fingerprint
+
+
+def _purchase_month(ts: pd.Series) -> pd.Series:
+    return ts.dt.to_period("M").dt.to_timestamp()
+
+
+def _orders_rows(tables: dict, rows: pd.DataFrame) -> pd.DataFrame:
+    return rows.assign(purchase_month=_purchase_month(rows["order_purchase_timestamp"]))
+
+
+def _payments_with_month(tables: dict, rows: pd.DataFrame) -> pd.DataFrame:
+    orders = tables["orders"][["order_id", "order_purchase_timestamp"]]
+    joined = rows.merge(orders, on="order_id", how="inner")
+    return joined.assign(purchase_month=_purchase_month(joined["order_purchase_timestamp"]))
+
+
+# Each cube groups one source table (optionally enriched by `prepare`) by `by`
+# and keeps additive state only: a row count plus sums of `sum_columns`.
+# Means are derived when the view is read, so new rows can be folded in
+# without rescanning the table.
+CUBE_SPECS = {
+    "customers_by_state": {
+        "source": "customers", "by": ["customer_state"], "count": "customer_count", "sum_columns": [],
+    },
+    "customers_by_city": {
+        "source": "customers", "by": ["customer_state", "customer_city"], "count": "customer_count", "sum_columns": [],
+    },
+    "payments_by_type": {
+        "source": "payments", "by": ["payment_type"], "count": "payment_count", "sum_columns": ["payment_value"],
+    },
+    "payments_by_installments": {
+        "source": "payments", "by": ["payment_installments"], "count": "payment_count", "sum_columns": ["payment_value"],
+    },
+    "payments_by_month": {
+        "source": "payments", "prepare": _payments_with_month, "by": ["purchase_month"],
+        "count": "payment_count", "sum_columns": ["payment_value"],
+    },
+    "products_by_category": {
+        "source": "products", "by": ["product_category_name"], "count": "product_count",
+        "sum_columns": ["product_weight_g"],
+    },
+    "orders_by_month": {
+        "source": "orders", "prepare": _orders_rows, "by": ["purchase_month", "order_status"],
+        "count": "order_count", "sum_columns": [],
+    },
+}
+
+
+def _align_index(state: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+    """`state` with its categorical index levels recoded to those of `delta`, whose categories extend them."""
+    levels = state.index.to_frame(index=False)
+    new_levels = delta.index.to_frame(index=False)
+    for col in levels.columns:
+        dtype = new_levels[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype) and levels[col].dtype != dtype:
+            levels[col] = levels[col].astype(dtype)
+    index = pd.MultiIndex.from_frame(levels) if state.index.nlevels > 1 else pd.Index(levels.iloc[:, 0])
+    return state.set_axis(index)
+
+
+def _aggregate(spec: dict, tables: dict, rows: pd.DataFrame) -> pd.DataFrame:
+    if "prepare" in spec:
+        rows = spec["prepare"](tables, rows)
+    grouped = rows.groupby(spec["by"], observed=True, dropna=False)
+    state = grouped.size().to_frame(spec["count"])
+    for col in spec["sum_columns"]:
+        state[f"{col}_sum"] = grouped[col].sum(min_count=1).astype("float64")
+        state[f"{col}_n"] = grouped[col].count()
+    return state
+
+
+class AggregateCubes:
+    """
+    Materialized count/sum/mean aggregates over the main categorical dimensions
+    and purchase-month buckets, built once per data version and exposed to the
+    agents as small named views (e.g. `customers_by_state`).
+    """
+
+    def __init__(self, tables: dict, state: dict = None):
+        self._state = {} if state is None else state
+        self._views = None
+        self._lock = threading.Lock()
+        if state is not None:
+            return
+        for name, spec in CUBE_SPECS.items():
+            if not self._has_inputs(spec, tables):
+                continue
+            try:
+                self._state[name] = _aggregate(spec, tables, tables[spec["source"]])
+            except (KeyError, AttributeError, TypeError) as e:
+                print(f"Skipping aggregate view {name}: {e}")
+
+    @staticmethod
+    def _has_inputs(spec: dict, tables: dict) -> bool:
+        needed = {spec["source"]} | ({"orders"} if "prepare" in spec else set())
+        return all(tables.get(name) is not None for name in needed)
+
+    def update(self, table_name: str, new_rows: pd.DataFrame, tables: dict):
+        """Folds rows appended to `table_name` into every cube built from it."""
+        with self._lock:
+            for name, spec in CUBE_SPECS.items():
+                if spec["source"] != table_name or name not in self._state:
+                    continue
+                delta = _aggregate(spec, tables, new_rows)
+                self._state[name] = _align_index(self._state[name], delta).add(delta, fill_value=0)
+            self._views = None
+
+    def appended(self, tables: dict, changes: dict) -> "AggregateCubes":
+        """
+        Cubes for `tables`, which are these cubes' tables plus the rows in `changes`
+        (table name -> appended rows): a copy with the new rows folded in.
+        """
+        cubes = AggregateCubes(tables, state=dict(self._state))
+        for table_name, new_rows in changes.items():
+            cubes.update(table_name, new_rows, tables)
+        if "orders" in changes:
+            # New orders can match rows a cube joined to orders before, e.g.
+            # payments that arrived ahead of their order; rebuild those cubes.
+            for name, spec in CUBE_SPECS.items():
+                if name in cubes._state and "prepare" in spec and spec["source"] != "orders":
+                    cubes._state[name] = _aggregate(spec, tables, tables[spec["source"]])
+        return cubes
+
+    def _view(self, name: str) -> pd.DataFrame:
+        spec = CUBE_SPECS[name]
+        state = self._state[name]
+        view = state[[spec["count"]]].copy()
+        view[spec["count"]] = view[spec["count"]].astype("int64")
+        for col in spec["sum_columns"]:
+            view[f"total_{col}"] = state[f"{col}_sum"]
+            view[f"avg_{col}"] = state[f"{col}_sum"] / state[f"{col}_n"].where(state[f"{col}_n"] > 0)
+        return view.reset_index().sort_values(spec["by"], ignore_index=True)
+
+    def views(self) -> dict:
+        """All cubes as plain DataFrames keyed by view name."""
+        with self._lock:
+            if self._views is None:
+                self._views = {name: self._view(name) for name in self._state}
+            return self._views
+
+    def describe(self, sources: set = None) -> str:
+        """One line per view with its columns, for the agent prompts; optionally only views built from `sources`."""
+        return "\n".join(
+            f"{name}: {', '.join(df.columns)}" for name, df in self.views().items()
+            if sources is None or CUBE_SPECS[name]["source"] in sources
+        )
+
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def update_cubes(tables: dict, new_tables: dict, changes: dict):
+    """
+    Carries the cubes built for `tables` over to `new_tables` (the same tables
+    with the rows in `changes` appended) without rescanning them. Does nothing
+    when no cubes were built for `tables`; get_cubes() then builds them on use.
+    """
+    with _cubes_lock:
+        cubes = _cubes.get(data_fingerprint(tables))
+    if cubes is None:
+        return None
+    cubes = cubes.appended(new_tables, changes)
+    with _cubes_lock:
+        _cubes.clear()
+        _cubes[data_fingerprint(new_tables)] = cubes
+    return cubes
+
+
+def get_cubes(tables: dict) -> AggregateCubes:
+    """Returns the cubes for this data version, building them on first use."""
+    fingerprint = data_fingerprint(tables)
+    with _cubes_lock:
+        cubes = _cubes.get(fingerprint)
+        if cubes is None:
+            _cubes.clear()
+            cubes = _cubes[fingerprint] = AggregateCubes(tables)
+        return cubes
@@ -0,0 +1,88 @@
+import io
+import os
+import re
+from typing import NamedTuple
+
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+PLOT_DPI = int(os.getenv("PLOT_DPI", "100"))
+MAX_BARS = 30
+
+LINE_WORDS = {"trend", "line", "over", "time", "timeline", "daily", "weekly", "monthly", "yearly"}
+PIE_WORDS = {"pie", "share", "proportion"}
+
+
+class ChartSpec(NamedTuple):
+    kind: str  # "bar", "barh", "line" or "pie"
+    title: str
+
+    @property
+    def key(self) -> str:
+        return f"template|{self.kind}|{self.title}"
+
+
+def choose_chart(df: pd.DataFrame, question: str):
+    """
+    Picks a chart template for the two-column category/value results the agents
+    produce, from the data's types and the question's wording. Returns None for
+    any other shape; those are still plotted with LLM-written code.
+    """
+    if not {"category", "value"} <= set(df.columns) or df.empty or not is_numeric_dtype(df["value"]):
+        return None
+    words = set(re.findall(r"[a-z]+", question.lower()))
+    category = df["category"]
+    title = question.strip().rstrip("?.!")
+    title = title[:1].upper() + title[1:80]
+
+    if words & PIE_WORDS and len(df) <= 8 and (df["value"] >= 0).all():
+        return ChartSpec("pie", title)
+    if is_datetime64_any_dtype(category) or (is_numeric_dtype(category) and words & LINE_WORDS):
+        return ChartSpec("line", title)
+    if len(df) > 12 or category.astype(str).str.len().max() > 15:
+        return ChartSpec("barh", title)
+    return ChartSpec("bar", title)
+
+
+def render_chart(df: pd.DataFrame, spec: ChartSpec) -> io.BytesIO:
+    """
+    Draws `spec` on a standalone Figure (no pyplot state, so safe to call from
+    any thread) and returns the PNG.
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6), layout="constrained")
+    ax = fig.add_subplot()
+    data = df[["category", "value"]].dropna(subset=["value"])
+
+    if spec.kind == "line":
+        data = data.sort_values("category")
+        ax.plot(data["category"], data["value"], marker="o" if len(data) <= 40 else None)
+        ax.grid(True, alpha=0.3)
+        if is_datetime64_any_dtype(data["category"]):
+            fig.autofmt_xdate()
+    elif spec.kind == "pie":
+        ax.pie(data["value"], labels=data["category"].astype(str), autopct="%1.1f%%", startangle=90)
+        ax.axis("equal")
+    else:
+        if is_numeric_dtype(data["category"]):
+            data = data.nsmallest(MAX_BARS, "category") if len(data) > MAX_BARS else data.sort_values("category")
+        else:
+            data = data.nlargest(MAX_BARS, "value")
+        labels = data["category"].astype(str).tolist()
+        positions = range(len(data))
+        if spec.kind == "barh":
+            ax.barh(positions, data["value"])
+            ax.set_yticks(positions, labels)
+            ax.invert_yaxis()
+            ax.set_xlabel("Value")
+        else:
+            ax.bar(positions, data["value"])
+            ax.set_xticks(positions, labels, rotation=45 if max(map(len, labels), default=0) > 6 else 0, ha="right")
+            ax.set_ylabel("Value")
+
+    ax.set_title(spec.title)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=PLOT_DPI)
+    buf.seek(0)
+    return buf
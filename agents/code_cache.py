@@ -0,0 +1,132 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from agents.code_rewrite import REWRITER_VERSION
+from agents.result_cache import normalize_question
+
+CODE_CACHE_DIR = os.getenv("CODE_CACHE_DIR", ".cache/code")
+# Seconds a failed generation is remembered before the question is tried again.
+CODE_FAILURE_TTL_SECONDS = float(os.getenv("CODE_FAILURE_TTL_SECONDS", "3600"))
+# Entries and compiled code objects kept in memory; the files on disk are not bounded.
+MAX_MEMORY_ENTRIES = 1024
+
+
+def schema_hash(tables: dict) -> str:
+    """Hash of every table's column names and dtypes, i.e. what the code prompts describe."""
+    parts = []
+    for name in sorted(tables):
+        df = tables[name]
+        if df is None:
+            continue
+        parts.append(name + ":" + ",".join(f"{col}={df[col].dtype}" for col in df.columns))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+class CodeCache:
+    """
+    Persistent cache of LLM-generated pandas code per (agent, normalized question,
+    table schema, system prompt, rewriter version), so code generated under an
+    older prompt or rewrite rules is not reused. At temperature 0 the generated code is deterministic, so a hit
+    skips the code-generation call and only the exec step runs. Code that failed
+    to execute is stored as well, so known-bad generations are not retried for
+    `failure_ttl` seconds.
+    Entries and compiled code objects are memoized in-process, the most
+    recently used MAX_MEMORY_ENTRIES of each.
+    """
+
+    def __init__(self, cache_dir: str = CODE_CACHE_DIR, failure_ttl: float = CODE_FAILURE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.failure_ttl = failure_ttl
+        self.metrics = {"hits": 0, "misses": 0, "known_failures": 0}
+        self._entries = OrderedDict()
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, agent: str, question: str, tables: dict, prompt: str = "") -> str:
+        """`prompt` is the system prompt the code is generated with (see prompts.agent_prompt)."""
+        prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()[:16]
+        raw = f"{agent}\0{normalize_question(question)}\0{schema_hash(tables)}\0{prompt_hash}\0{REWRITER_VERSION}"
+        return f"{agent}-{hashlib.sha256(raw.encode()).hexdigest()[:24]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def lookup(self, key: str):
+        """Returns the stored entry ({"status": "ok"|"failed", "code", "error"}) or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                try:
+                    with open(self._path(key)) as fh:
+                        entry = json.load(fh)
+                    self._remember(self._entries, key, entry)
+                except (OSError, ValueError):
+                    entry = None
+            else:
+                self._entries.move_to_end(key)
+
+            if entry is not None and entry["status"] == "failed" and \
+                    time.time() - entry.get("failed_at", 0) > self.failure_ttl:
+                self._entries.pop(key, None)
+                with contextlib.suppress(OSError):
+                    os.remove(self._path(key))
+                entry = None
+
+            if entry is None:
+                self.metrics["misses"] += 1
+            elif entry["status"] == "failed":
+                self.metrics["known_failures"] += 1
+            else:
+                self.metrics["hits"] += 1
+            return entry
+
+    @staticmethod
+    def _remember(memo: OrderedDict, key, value):
+        memo[key] = value
+        while len(memo) > MAX_MEMORY_ENTRIES:
+            memo.popitem(last=False)
+
+    def _write(self, key: str, entry: dict):
+        with self._lock:
+            self._remember(self._entries, key, entry)
+            tmp_path = f"{self._path(key)}.tmp.{os.getpid()}"
+            with open(tmp_path, "w") as fh:
+                json.dump(entry, fh)
+            os.replace(tmp_path, self._path(key))
+
+    def store(self, key: str, code: str):
+        self._write(key, {"status": "ok", "code": code, "error": None})
+
+    def store_failure(self, key: str, code: str, error):
+        self._write(key, {"status": "failed", "code": code, "error": str(error), "failed_at": time.time()})
+
+    def compile(self, code: str):
+        """Returns the compiled code object for a snippet, compiling it once per process."""
+        with self._lock:
+            compiled = self._compiled.get(code)
+            if compiled is not None:
+                self._compiled.move_to_end(code)
+                return compiled
+        compiled = compile(code, "<generated>", "exec")
+        with self._lock:
+            self._remember(self._compiled, code, compiled)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._compiled.clear()
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+code_cache = CodeCache()
+
+__all__ = ["code_cache", "CodeCache", "schema_hash"]
@@ -0,0 +1,617 @@
+import ast
+import os
+from collections import Counter, defaultdict
+
+from pandas.api.types import is_numeric_dtype
+
+from agents.table_schema import TABLE_SCHEMAS
+from agents.timing import annotate
+
+# Part of every code cache key: bump it when a rule changes what cached code
+# does or whether it is accepted, so entries from the old rules are not reused.
+REWRITER_VERSION = 2
+
+# Generated code whose estimated run time exceeds this many seconds is rejected
+# before it runs.
+CODE_COST_BUDGET = float(os.getenv("CODE_COST_BUDGET", "30"))
+
+# Rough per-row costs in seconds, used only to rank plans against the budget.
+ROW_COSTS = {
+    "iterrows": 25e-6,      # a Python loop body plus a Series built per row
+    "itertuples": 2e-6,
+    "apply_rows": 15e-6,    # DataFrame.apply(..., axis=1)
+    "apply_values": 0.5e-6, # Series.apply / Series.map with a Python function
+    "merge": 0.2e-6,        # per input row of a hash join
+}
+
+# Tables whose merges onto order_items can be served from order_lines.
+FACT_JOINS = {"orders": "order_id", "products": "product_id", "customers": "customer_id"}
+
+_MERGE_KWARGS = {"on", "how", "left_on", "right_on"}
+_ARITHMETIC = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+_COMPARISONS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+# Methods that return a frame with the same columns as their receiver.
+_SAME_COLUMNS = {"copy", "dropna", "head", "tail", "sort_values", "sort_index", "query", "drop_duplicates",
+                 "nlargest", "nsmallest", "sample"}
+# Methods and accessors whose result for a row depends only on that row. A
+# filter calling anything else on the merged frame (max, mean, rank,
+# duplicated, transform, shift, ...) reads other rows, which a pushed-down
+# filter would no longer see, so it is left after the merge.
+_ROWWISE_METHODS = {"isin", "between", "isna", "isnull", "notna", "notnull", "astype", "abs", "round",
+                    "contains", "startswith", "endswith", "match", "fullmatch", "lower", "upper", "strip",
+                    "len", "normalize", "floor", "ceil"}
+_ROWWISE_ATTRS = {"str", "dt", "year", "month", "day", "hour", "minute", "quarter", "dayofweek", "weekday", "date"}
+_MISSING = object()
+
+
+class CodeBudgetError(ValueError):
+    """Generated code is predicted to exceed the cost budget."""
+
+
+def _literal(node, default=_MISSING):
+    if node is None:
+        return default
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return _MISSING
+
+
+def _short(node) -> str:
+    text = node if isinstance(node, str) else ast.unparse(node)
+    return text if len(text) <= 120 else text[:117] + "..."
+
+
+def _merge_parts(node):
+    """(left, right, keywords) of `a.merge(b, ...)` or `pd.merge(a, b, ...)`, else None."""
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute) or node.func.attr != "merge":
+        return None
+    keywords = {kw.arg: kw.value for kw in node.keywords}
+    if None in keywords:
+        return None
+    if isinstance(node.func.value, ast.Name) and node.func.value.id == "pd":
+        if len(node.args) != 2:
+            return None
+        return node.args[0], node.args[1], keywords
+    if len(node.args) != 1:
+        return None
+    return node.func.value, node.args[0], keywords
+
+
+def _set_merge_sides(node, left, right):
+    if isinstance(node.func.value, ast.Name) and node.func.value.id == "pd":
+        node.args = [left, right]
+    else:
+        node.func.value, node.args = left, [right]
+
+
+def _join_key(keywords: dict):
+    on = _literal(keywords.get("on"), None)
+    if on is None:
+        left_on, right_on = _literal(keywords.get("left_on"), None), _literal(keywords.get("right_on"), None)
+        on = left_on if left_on == right_on else None
+    if isinstance(on, list) and len(on) == 1:
+        on = on[0]
+    return on if isinstance(on, str) else None
+
+
+def _references(node, name: str) -> bool:
+    return any(isinstance(child, ast.Name) and child.id == name for child in ast.walk(node))
+
+
+def _column(node, name: str):
+    """`col` when `node` is `name['col']`, else None."""
+    if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == name
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+        return node.slice.value
+    return None
+
+
+class _Usage(ast.NodeVisitor):
+    """Which names the code rebinds, and which columns of which frames it writes to."""
+
+    def __init__(self):
+        self.stores = Counter()
+        self.written_columns = defaultdict(set)
+        self.mutated = set()
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, (ast.Store, ast.Del)):
+            self.stores[node.id] += 1
+
+    def _target(self, node):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name):
+            column = _column(node, node.value.id)
+            if column is None:
+                self.mutated.add(node.value.id)
+            else:
+                self.written_columns[node.value.id].add(column)
+        elif isinstance(node, (ast.Subscript, ast.Attribute)):
+            root = node.value
+            while isinstance(root, (ast.Subscript, ast.Attribute)):
+                root = root.value
+            if isinstance(root, ast.Name):
+                self.mutated.add(root.id)
+
+    def visit_Subscript(self, node):
+        if isinstance(node.ctx, (ast.Store, ast.Del)):
+            self._target(node)
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node):
+        if isinstance(node.ctx, (ast.Store, ast.Del)):
+            self._target(node)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        inplace = any(kw.arg == "inplace" and _literal(kw.value, False) is True for kw in node.keywords)
+        if isinstance(node.func, ast.Attribute) and (inplace or node.func.attr in ("pop", "insert", "update")):
+            root = node.func.value
+            while isinstance(root, (ast.Subscript, ast.Attribute)):
+                root = root.value
+            if isinstance(root, ast.Name):
+                self.mutated.add(root.id)
+        self.generic_visit(node)
+
+    def untouched(self, name: str) -> bool:
+        return self.stores[name] == 0 and name not in self.mutated and not self.written_columns[name]
+
+
+class CodeRewriter:
+    """
+    Static pass over LLM-generated pandas code, run before it is executed:
+
+    * merge chains rooted at `order_items` that order_lines already contains are
+      replaced by a column selection of order_lines;
+    * `m = a.merge(b, ...)` followed by `r = m[mask]` filters `a` (or `b`, for
+      inner joins) before the merge when the mask only reads that side's
+      columns, row by row (no aggregates such as `m["x"].max()`);
+    * `df.apply(lambda row: ..., axis=1)` and `s.apply(lambda x: ...)` over
+      numeric columns with arithmetic or comparison bodies become vectorized
+      expressions;
+    * the remaining row-wise work (iterrows/itertuples loops, row-wise apply,
+      merges) is costed from the table row counts, and code predicted to exceed
+      `budget` seconds is rejected with CodeBudgetError.
+
+    Every rewrite is recorded in `rewrites` and counted on the current stage
+    (`rewrites`, next to `estimated_seconds`). Rewritten filters renumber the index of the
+    filtered frame; values and row order are unchanged.
+    """
+
+    def __init__(self, frames: dict, fact=None, budget: float = CODE_COST_BUDGET):
+        self.frames = frames
+        self.fact = fact
+        self.budget = budget
+        self.rewrites = []
+
+    def _log(self, rule: str, before, after):
+        self.rewrites.append(f"{rule}: {_short(before)}  ->  {_short(after)}")
+        annotate(rewrites=1)
+
+    # -- order_lines reuse ------------------------------------------------
+
+    def _fact_chain(self, node, usage):
+        """The tables merged onto order_items by `node`, in merge order, or None."""
+        if isinstance(node, ast.Name) and node.id in ("order_items", "ORDER_ITEMS"):
+            return [] if usage.untouched(node.id) else None
+        parts = _merge_parts(node)
+        if parts is None:
+            return None
+        left, right, keywords = parts
+        chain = self._fact_chain(left, usage)
+        if chain is None or not isinstance(right, ast.Name) or not usage.untouched(right.id):
+            return None
+        source = right.id.lower()
+        if right.id not in (source, source.upper()) or source not in FACT_JOINS or source in chain:
+            return None
+        if set(keywords) - _MERGE_KWARGS or _join_key(keywords) != FACT_JOINS[source]:
+            return None
+        if source == "customers" and "orders" not in chain:
+            return None
+        how = _literal(keywords.get("how"), "inner")
+        info = self.fact.joins.get(source)
+        if info is None or not info["exact"] or how not in ("left", "inner") or (how == "inner" and not info["complete"]):
+            return None
+        return chain + [source]
+
+    def _fact_columns(self, chain):
+        columns = list(self.frames["order_items"].columns)
+        for source in chain:
+            added = [col for col in self.frames[source].columns if col != FACT_JOINS[source]]
+            if set(added) & set(columns):
+                return None
+            columns += added
+        if not set(columns) <= set(self.fact.frame.columns):
+            return None
+        return columns
+
+    def _reuse_order_lines(self, tree, usage):
+        # Only a fact table in order_items row order gives the rows in the order the merge would.
+        if self.fact is None or not self.fact.source_order or not usage.untouched("order_lines"):
+            return tree
+        rewriter = self
+
+        class Transformer(ast.NodeTransformer):
+            def visit_Call(self, node):
+                chain = rewriter._fact_chain(node, usage)
+                columns = rewriter._fact_columns(chain) if chain else None
+                if not columns:
+                    return self.generic_visit(node)
+                replacement = ast.Subscript(
+                    value=ast.Name(id="order_lines", ctx=ast.Load()),
+                    slice=ast.List(elts=[ast.Constant(col) for col in columns], ctx=ast.Load()),
+                    ctx=ast.Load(),
+                )
+                rewriter._log("reuse order_lines", node, replacement)
+                return replacement
+
+        return Transformer().visit(tree)
+
+    # -- filter pushdown --------------------------------------------------
+
+    def _mask_columns(self, mask, name: str):
+        """
+        Columns `mask` reads from `name`, or None if it uses `name` any other
+        way, including any method that does not work row by row.
+        """
+        nodes = list(ast.walk(mask))
+        if any(isinstance(node, ast.Lambda) for node in nodes):
+            return None
+        for node in nodes:
+            if isinstance(node, ast.Call) and _references(node, name):
+                arguments = [*node.args, *(kw.value for kw in node.keywords)]
+                if not (isinstance(node.func, ast.Attribute) and node.func.attr in _ROWWISE_METHODS):
+                    return None
+                if any(_references(argument, name) for argument in arguments):
+                    return None
+            elif (isinstance(node, ast.Attribute) and _references(node.value, name)
+                  and node.attr not in _ROWWISE_ATTRS | _ROWWISE_METHODS):
+                return None
+        references = [_column(node, name) for node in nodes]
+        columns = {column for column in references if column is not None}
+        uses = sum(isinstance(node, ast.Name) and node.id == name for node in nodes)
+        return columns if uses == sum(column is not None for column in references) else None
+
+    def _push_filters(self, tree, usage):
+        body = tree.body
+        i = 0
+        while i < len(body) - 1:
+            if self._push_filter(body, i, tree, usage):
+                del body[i + 1]
+            i += 1
+        return tree
+
+    def _push_filter(self, body, i, tree, usage) -> bool:
+        first, second = body[i], body[i + 1]
+        if not (isinstance(first, ast.Assign) and len(first.targets) == 1 and isinstance(first.targets[0], ast.Name)):
+            return False
+        if not (isinstance(second, ast.Assign) and len(second.targets) == 1 and isinstance(second.targets[0], ast.Name)):
+            return False
+        merged, target = first.targets[0].id, second.targets[0].id
+        parts = _merge_parts(first.value)
+        if parts is None or usage.stores[merged] != 1 + (target == merged):
+            return False
+        left, right, keywords = parts
+        if not (isinstance(left, ast.Name) and isinstance(right, ast.Name)):
+            return False
+        if not (usage.untouched(left.id) and usage.untouched(right.id)) or left.id not in self.frames or right.id not in self.frames:
+            return False
+        key, how = _join_key(keywords), _literal(keywords.get("how"), "inner")
+        if set(keywords) - _MERGE_KWARGS or key is None or how not in ("inner", "left"):
+            return False
+
+        filtered = second.value
+        if isinstance(filtered, ast.Subscript) and isinstance(filtered.value, ast.Attribute) and filtered.value.attr == "loc":
+            frame, mask = filtered.value.value, filtered.slice
+        elif isinstance(filtered, ast.Subscript):
+            frame, mask = filtered.value, filtered.slice
+        else:
+            return False
+        if not (isinstance(frame, ast.Name) and frame.id == merged) or isinstance(mask, (ast.Constant, ast.List, ast.Tuple, ast.Slice)):
+            return False
+        columns = self._mask_columns(mask, merged)
+        if not columns:
+            return False
+        # `merged` may only be read by the filter (or, when rebound by it, afterwards).
+        loads = sum(isinstance(n, ast.Name) and n.id == merged and isinstance(n.ctx, ast.Load) for n in ast.walk(tree))
+        if loads != sum(isinstance(n, ast.Name) and n.id == merged for n in ast.walk(second.value)) and target != merged:
+            return False
+
+        left_columns, right_columns = set(self.frames[left.id].columns), set(self.frames[right.id].columns)
+        if (left_columns & right_columns) - {key}:
+            return False
+        if columns <= left_columns:
+            side = left
+        elif columns <= right_columns and how == "inner":
+            side = right
+        else:
+            return False
+
+        class Rename(ast.NodeTransformer):
+            def visit_Name(self, node):
+                return ast.Name(id=side.id, ctx=node.ctx) if node.id == merged else node
+
+        before = _short(ast.Module(body=[first, second], type_ignores=[])).replace("\n", "; ")
+        pushed = ast.Subscript(value=ast.Name(id=side.id, ctx=ast.Load()), slice=Rename().visit(mask), ctx=ast.Load())
+        merge = first.value
+        _set_merge_sides(merge, pushed if side is left else left, pushed if side is right else right)
+        body[i] = ast.copy_location(ast.Assign(targets=[ast.Name(id=target, ctx=ast.Store())], value=merge), first)
+        self._log("push filter before merge", before, body[i])
+        return True
+
+    # -- apply vectorization ----------------------------------------------
+
+    def _schema(self, node, env: dict):
+        """Column -> dtype of the frame `node` evaluates to, when statically known."""
+        if isinstance(node, ast.Name):
+            return env.get(node.id)
+        parts = _merge_parts(node)
+        if parts is not None:
+            left, right = self._schema(parts[0], env), self._schema(parts[1], env)
+            key = _join_key(parts[2])
+            if left is None or right is None or (set(left) & set(right)) - {key}:
+                return None
+            return {**left, **right}
+        if isinstance(node, ast.Subscript):
+            if isinstance(node.value, ast.Attribute) and node.value.attr in ("loc", "iloc"):
+                return None if isinstance(node.slice, ast.Tuple) else self._schema(node.value.value, env)
+            if isinstance(node.slice, ast.Constant):
+                return None
+            if isinstance(node.slice, ast.List):
+                names = _literal(node.slice)
+                schema = self._schema(node.value, env)
+                if schema is None or names is _MISSING or not set(names) <= set(schema):
+                    return None
+                return {col: schema[col] for col in names}
+            return self._schema(node.value, env)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in _SAME_COLUMNS:
+            return self._schema(node.func.value, env)
+        return None
+
+    @staticmethod
+    def _vector_expr(body, substitute):
+        """`body` with the lambda parameter replaced through `substitute`, or None if it is not vectorizable."""
+        def convert(node):
+            replaced = substitute(node)
+            if replaced is not _MISSING:
+                return replaced
+            if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+                return node
+            if isinstance(node, ast.BinOp) and isinstance(node.op, _ARITHMETIC):
+                left, right = convert(node.left), convert(node.right)
+                return None if left is None or right is None else ast.BinOp(left=left, op=node.op, right=right)
+            if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+                operand = convert(node.operand)
+                return None if operand is None else ast.UnaryOp(op=node.op, operand=operand)
+            if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not) and isinstance(node.operand, ast.Compare):
+                operand = convert(node.operand)
+                return None if operand is None else ast.UnaryOp(op=ast.Invert(), operand=operand)
+            if isinstance(node, ast.Compare) and len(node.ops) == 1 and isinstance(node.ops[0], _COMPARISONS):
+                left, right = convert(node.left), convert(node.comparators[0])
+                return None if left is None or right is None else ast.Compare(left=left, ops=node.ops, comparators=[right])
+            if isinstance(node, ast.BoolOp) and all(isinstance(v, ast.Compare) or (isinstance(v, ast.UnaryOp) and isinstance(v.op, ast.Not)) for v in node.values):
+                values = [convert(v) for v in node.values]
+                if None in values:
+                    return None
+                op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+                expr = values[0]
+                for value in values[1:]:
+                    expr = ast.BinOp(left=expr, op=op, right=value)
+                return expr
+            return None
+
+        return convert(body)
+
+    def _vectorize_apply(self, node, env: dict):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in ("apply", "map")):
+            return None
+        if len(node.args) != 1 or not isinstance(node.args[0], ast.Lambda):
+            return None
+        func = node.args[0]
+        if len(func.args.args) != 1 or func.args.vararg or func.args.kwarg or func.args.kwonlyargs or func.args.defaults:
+            return None
+        param, receiver = func.args.args[0].arg, node.func.value
+        keywords = {kw.arg: _literal(kw.value) for kw in node.keywords}
+        used = set()
+
+        if node.func.attr == "apply" and keywords in ({"axis": 1}, {"axis": "columns"}):
+            if not (isinstance(receiver, ast.Name) or (isinstance(receiver, ast.Subscript) and isinstance(receiver.value, ast.Name)
+                                                       and isinstance(receiver.slice, ast.List))):
+                return None
+            schema = self._schema(receiver, env)
+            if schema is None:
+                return None
+
+            def substitute(n):
+                column = _column(n, param)
+                if column is None and isinstance(n, ast.Attribute) and isinstance(n.value, ast.Name) and n.value.id == param:
+                    column = n.attr
+                if column is not None:
+                    if column not in schema or not is_numeric_dtype(schema[column]):
+                        return None
+                    used.add(column)
+                    return ast.Subscript(value=receiver, slice=ast.Constant(column), ctx=ast.Load())
+                if isinstance(n, ast.Name) and n.id == param:
+                    return None
+                return _MISSING
+
+            expr = self._vector_expr(func.body, substitute)
+            if expr is None or not used:
+                return None
+            return ast.Call(func=ast.Attribute(value=expr, attr="rename", ctx=ast.Load()), args=[ast.Constant(None)], keywords=[])
+
+        if keywords or not isinstance(receiver, ast.Subscript) or not isinstance(receiver.value, ast.Name):
+            return None
+        if not (isinstance(receiver.slice, ast.Constant) and isinstance(receiver.slice.value, str)):
+            return None
+        schema = self._schema(receiver.value, env)
+        if schema is None or receiver.slice.value not in schema or not is_numeric_dtype(schema[receiver.slice.value]):
+            return None
+
+        def substitute(n):
+            if isinstance(n, ast.Name) and n.id == param:
+                used.add(param)
+                return receiver
+            return _MISSING
+
+        expr = self._vector_expr(func.body, substitute)
+        return expr if expr is not None and used else None
+
+    def _vectorize(self, tree, usage):
+        env = {}
+        for name, df in self.frames.items():
+            if usage.stores[name] == 0 and name not in usage.mutated:
+                env[name] = {col: dtype for col, dtype in df.dtypes.items() if col not in usage.written_columns[name]}
+        rewriter = self
+
+        class Transformer(ast.NodeTransformer):
+            def visit_Call(self, node):
+                node = self.generic_visit(node)
+                vectorized = rewriter._vectorize_apply(node, env)
+                if vectorized is None:
+                    return node
+                rewriter._log("vectorize apply", node, vectorized)
+                return vectorized
+
+        transformer = Transformer()
+        for i, statement in enumerate(tree.body):
+            tree.body[i] = transformer.visit(statement)
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name):
+                name = statement.targets[0].id
+                if usage.stores[name] == 1 and name not in usage.mutated:
+                    schema = self._schema(statement.value, env)
+                    if schema is not None:
+                        env[name] = {col: dtype for col, dtype in schema.items() if col not in usage.written_columns[name]}
+        return tree
+
+    # -- cost estimate ----------------------------------------------------
+
+    def _rows(self, node, env: dict):
+        """Upper bound on the rows of the frame `node` evaluates to, when known."""
+        if isinstance(node, ast.Name):
+            return env.get(node.id)
+        parts = _merge_parts(node)
+        if parts is not None:
+            left, right = self._rows(parts[0], env), self._rows(parts[1], env)
+            if left is None or right is None:
+                return left or right
+            return left * right if _literal(parts[2].get("how")) == "cross" else max(left, right)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            rows = self._rows(node.func.value, env)
+            count = _literal(node.args[0]) if node.args else 5
+            if node.func.attr in ("head", "tail", "nlargest", "nsmallest") and isinstance(count, int) and rows is not None:
+                return min(rows, count)
+            return rows
+        if isinstance(node, (ast.Attribute, ast.Subscript)):
+            return self._rows(node.value, env)
+        return None
+
+    def _loop_rows(self, node, env: dict):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            kind = node.func.attr
+            if kind in ("iterrows", "itertuples"):
+                return self._rows(node.func.value, env), ROW_COSTS["itertuples" if kind == "itertuples" else "iterrows"]
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "range" and len(node.args) == 1:
+            arg = node.args[0]
+            if isinstance(arg, ast.Call) and isinstance(arg.func, ast.Name) and arg.func.id == "len" and arg.args:
+                return self._rows(arg.args[0], env), ROW_COSTS["iterrows"]
+        if isinstance(node, ast.Attribute) and node.attr == "index":
+            return self._rows(node.value, env), ROW_COSTS["iterrows"]
+        return None, 0.0
+
+    def estimate_cost(self, tree) -> tuple:
+        """(estimated seconds, description of the most expensive step) for `tree`."""
+        env = {name: len(df) for name, df in self.frames.items()}
+        worst = [0.0, ""]
+        total = [0.0]
+
+        def charge(seconds, what):
+            total[0] += seconds
+            if seconds > worst[0]:
+                worst[:] = [seconds, what]
+
+        def visit(node, multiplier):
+            if isinstance(node, ast.For):
+                rows, per_row = self._loop_rows(node.iter, env)
+                visit(node.iter, multiplier)
+                inner = multiplier * (rows or 1)
+                if rows:
+                    charge(inner * per_row, f"loop over {rows:,} rows" + (" inside another loop" if multiplier > 1 else ""))
+                for child in node.body + node.orelse:
+                    visit(child, inner)
+                return
+            if isinstance(node, (ast.ListComp, ast.SetComp, ast.GeneratorExp, ast.DictComp)):
+                inner = multiplier
+                for generator in node.generators:
+                    rows, per_row = self._loop_rows(generator.iter, env)
+                    visit(generator.iter, inner)
+                    inner *= rows or 1
+                    if rows:
+                        charge(inner * per_row, f"comprehension over {rows:,} rows")
+                    for condition in generator.ifs:
+                        visit(condition, inner)
+                for element in (node.key, node.value) if isinstance(node, ast.DictComp) else (node.elt,):
+                    visit(element, inner)
+                return
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+                attr = node.func.attr
+                keywords = {kw.arg: _literal(kw.value) for kw in node.keywords}
+                rows = self._rows(node.func.value, env)
+                if attr == "apply" and keywords.get("axis") in (1, "columns") and rows:
+                    charge(multiplier * rows * ROW_COSTS["apply_rows"], f"row-wise apply over {rows:,} rows")
+                elif attr in ("apply", "map") and node.args and isinstance(node.args[0], ast.Lambda) and rows:
+                    charge(multiplier * rows * ROW_COSTS["apply_values"], f"element-wise {attr} over {rows:,} rows")
+                parts = _merge_parts(node)
+                if parts is not None:
+                    left, right = self._rows(parts[0], env) or 0, self._rows(parts[1], env) or 0
+                    if _literal(parts[2].get("how")) == "cross":
+                        charge(multiplier * left * right * ROW_COSTS["merge"], f"cross join of {left:,} x {right:,} rows")
+                    else:
+                        charge(multiplier * (left + right) * ROW_COSTS["merge"], f"merge of {left:,} and {right:,} rows")
+            for child in ast.iter_child_nodes(node):
+                visit(child, multiplier)
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                env[node.targets[0].id] = self._rows(node.value, env)
+
+        for statement in tree.body:
+            visit(statement, 1)
+        return total[0], worst[1]
+
+    def rewrite(self, code: str) -> str:
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return code  # exec reports the syntax error as before
+        usage = _Usage()
+        usage.visit(tree)
+        tree = self._reuse_order_lines(tree, usage)
+        tree = self._push_filters(tree, usage)
+        tree = self._vectorize(tree, usage)
+        ast.fix_missing_locations(tree)
+
+        seconds, worst = self.estimate_cost(tree)
+        annotate(estimated_seconds=round(seconds, 3))
+        if seconds > self.budget:
+            annotate(over_budget=1)
+            raise CodeBudgetError(
+                f"The generated query is estimated to take {seconds:.0f}s ({worst}), over the {self.budget:g}s budget. "
+                "Try a narrower question."
+            )
+        return ast.unparse(tree) if self.rewrites else code
+
+
+def query_frames(tables: dict, cubes, fact) -> dict:
+    """The frames generated code can reference by name (see sandbox.code_namespace)."""
+    frames = {}
+    for name in TABLE_SCHEMAS:
+        if tables.get(name) is not None:
+            frames[name] = frames[name.upper()] = tables[name]
+    frames.update(cubes.views())
+    if fact is not None:
+        frames["order_lines"] = frames["ORDER_LINES"] = fact.frame
+    return frames
+
+
+def optimize_code(code: str, tables: dict, cubes, fact, budget: float = CODE_COST_BUDGET) -> str:
+    """Rewrites generated pandas code (see CodeRewriter); raises CodeBudgetError for plans over budget."""
+    return CodeRewriter(query_frames(tables, cubes, fact), fact, budget).rewrite(code)
@@ -0,0 +1,74 @@
+import pandas as pd
+from agents.shared_llm import llm
+from agents.shared_tables import table_views
+from agents.code_cache import code_cache
+from agents.aggregates import get_cubes
+from agents.fact_table import get_order_lines
+from agents.sql_engine import engine_for, handle_sql_query, sql_relations
+from agents.sandbox import code_failure, run_generated_code
+from agents.lazy_result import LazyResult
+from agents.prompts import agent_messages, agent_prompt, record_usage
+from agents.timing import stage
+from agents.tools_registry import AgentError
+
+def run_domain_agent(agent: dict, user_input: str, tables: dict = None):
+    """
+    Answers a question for one domain agent (see the AGENT spec in each
+    *_agent module): SQL when that engine is selected, otherwise pandas code
+    from the code cache or the LLM, run in the sandbox. Returns (answer, df);
+    raises AgentError with the message to show when there is no answer.
+    """
+    name = agent["name"]
+    if not tables:
+        raise AgentError("No data available.")
+
+    tables = table_views(tables)
+    cubes = get_cubes(tables)
+    fact = get_order_lines(tables)
+
+    if tables.get(agent["requires"]) is None:
+        raise AgentError(agent["missing"])
+
+    if engine_for(name) == "sql":
+        sql_result = handle_sql_query(name, agent["domain"], user_input, sql_relations(tables, cubes, fact))
+        if sql_result is not None:
+            return sql_result
+
+    system_prompt = agent_prompt(agent, tables, cubes, fact)
+    cache_key = code_cache.make_key(name, user_input, tables, system_prompt)
+    cached = code_cache.lookup(cache_key)
+    if cached and cached["status"] == "failed":
+        raise AgentError(f"Error processing {name} query: {cached['error']}")
+
+    code = None
+    try:
+        if cached:
+            code = cached["code"]
+        else:
+            with stage("codegen"):
+                response = llm.invoke(agent_messages(agent, user_input, tables, cubes, fact))
+            record_usage(name, response)
+            code = response.content.strip().replace("```python", "").replace("```", "").strip()
+
+        result = run_generated_code(code, tables, cubes, fact)
+
+        if result is None:
+            code_cache.store_failure(cache_key, code, "No result generated from the query.")
+            raise AgentError("No result generated from the query.")
+        if not cached:
+            code_cache.store(cache_key, code)
+
+        if not isinstance(result, (pd.Series, pd.DataFrame, LazyResult)):
+            return str(result), None
+
+        df_result = LazyResult.from_result(result)
+        answer = f"Found {len(df_result)} records matching your {name} query."
+        return answer, df_result
+
+    except AgentError:
+        raise
+    except Exception as e:
+        # Only failures of the code itself are remembered; a busy sandbox is retried next time.
+        if code is not None and code_failure(e):
+            code_cache.store_failure(cache_key, code, e)
+        raise AgentError(f"Error processing {name} query: {str(e)}") from e
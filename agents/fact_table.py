@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from agents.table_schema import align_categoricals
+from agents.table_store import data_fingerprint
+
+FACT_SOURCES = {"order_items", "orders", "products", "customers", "payments"}
+# Tables whose appended rows only touch the lines of the orders they name.
+ORDER_KEYED = ("order_items", "orders", "payments")
+INDEX_KEYS = ["order_id", "customer_id", "product_id"]
+
+
+def _payments_per_order(payments: pd.DataFrame) -> pd.DataFrame:
+    """One row per order, so joining payments never multiplies order lines."""
+    ordered = payments.sort_values(["order_id", "payment_sequential"])
+    grouped = ordered.groupby("order_id", observed=True)
+    return pd.DataFrame({
+        "payment_type": grouped["payment_type"].first(),
+        "payment_installments": grouped["payment_installments"].max(),
+        "payment_count": grouped.size(),
+        "order_payment_value": grouped["payment_value"].sum(),
+    }).reset_index()
+
+
+def build_order_lines(tables: dict) -> pd.DataFrame:
+    """
+    Denormalizes order_items with their order, product, customer and per-order
+    payment totals: one row per order line.
+    """
+    lines = tables["order_items"]
+    if tables.get("orders") is not None:
+        lines = lines.merge(tables["orders"], on="order_id", how="left")
+    if tables.get("products") is not None:
+        products = tables["products"].drop_duplicates("product_id")
+        lines = lines.merge(products, on="product_id", how="left")
+    if tables.get("customers") is not None and "customer_id" in lines.columns:
+        customers = tables["customers"].drop_duplicates("customer_id")
+        lines = lines.merge(customers, on="customer_id", how="left")
+    if tables.get("payments") is not None:
+        lines = lines.merge(_payments_per_order(tables["payments"]), on="order_id", how="left")
+    return lines
+
+
+def _join_info(tables: dict, frame: pd.DataFrame) -> dict:
+    """
+    For each table joined into order_lines: its key, whether every order line
+    found a match ("complete") and whether the join equals a plain merge with the
+    table as loaded ("exact"; products and customers are de-duplicated first).
+    """
+    info = {}
+    for source, key in (("orders", "order_id"), ("products", "product_id"), ("customers", "customer_id")):
+        table = tables.get(source)
+        if table is None or key not in frame.columns:
+            continue
+        info[source] = {
+            "key": key,
+            "complete": bool(frame[key].isin(table[key]).all()),
+            "exact": source == "orders" or bool(table[key].is_unique),
+        }
+    return info
+
+
+def _line_dtypes(tables: dict) -> pd.Series:
+    """The dtypes order_lines has when every line finds its order, product and customer."""
+    return build_order_lines({name: None if df is None else df.iloc[:0] for name, df in tables.items()}).dtypes
+
+
+class FactTable:
+    """
+    The order-line fact table plus hash indexes (value -> row positions) on the
+    ID keys. `source_order` is True when row i is the line of order_items row i,
+    as a plain left merge would give; the code rewriter only substitutes
+    order_lines for a merge then.
+    """
+
+    def __init__(self, tables: dict, frame: pd.DataFrame = None):
+        self.frame = build_order_lines(tables) if frame is None else frame
+        self.source_order = len(self.frame) == len(tables["order_items"])
+        self.joins = _join_info(tables, self.frame)
+        self.indexes = {
+            key: self.frame.groupby(key, observed=True, sort=False).indices
+            for key in INDEX_KEYS if key in self.frame.columns
+        }
+
+    def appended(self, tables: dict, changes: dict) -> "FactTable":
+        """
+        The FactTable for `tables`, which are this one's tables plus the rows in
+        `changes` (table name -> appended rows). Only the lines of the orders
+        those rows belong to are rebuilt; the others are kept as they are. The
+        lines stay in order_items order, so the result equals a full rebuild.
+        """
+        if not set(changes) <= set(ORDER_KEYED) or not self.source_order:
+            return FactTable(tables)
+        touched = pd.concat([rows["order_id"].astype("object") for rows in changes.values()]).dropna().unique()
+        subset = dict(tables)
+        for name in ORDER_KEYED:
+            if tables.get(name) is not None:
+                subset[name] = tables[name][tables[name]["order_id"].isin(touched)]
+        fresh = build_order_lines(subset)
+        kept_mask = ~self.frame["order_id"].isin(touched).to_numpy()
+        kept = self.frame[kept_mask]
+        if not fresh.columns.equals(kept.columns) or len(kept) + len(fresh) != len(tables["order_items"]):
+            return FactTable(tables)
+        kept, fresh = align_categoricals(kept, fresh)
+        frame = pd.concat([kept, fresh], ignore_index=True)
+        # Lines kept from before their order arrived widened its integer columns
+        # to float; a full rebuild narrows them again once every line has an order.
+        narrowed = {
+            col: dtype for col, dtype in _line_dtypes(tables).items()
+            if frame[col].dtype != dtype and not isinstance(dtype, pd.CategoricalDtype) and frame[col].notna().all()
+        }
+        if narrowed:
+            frame = frame.astype(narrowed)
+        # Lines of orders that already had lines move back to their order_items positions.
+        positions = np.concatenate([np.flatnonzero(kept_mask),
+                                    np.flatnonzero(tables["order_items"]["order_id"].isin(touched).to_numpy())])
+        if len(positions) > 1 and not (np.diff(positions) > 0).all():
+            frame = frame.take(np.argsort(positions, kind="stable")).reset_index(drop=True)
+        return FactTable(tables, frame)
+
+    def lookup(self, key: str, values) -> pd.DataFrame:
+        """Order lines whose `key` equals `values` (a scalar or a list), without scanning the frame."""
+        index = self.indexes[key]
+        if np.isscalar(values):
+            values = [values]
+        positions = [index[value] for value in values if value in index]
+        if not positions:
+            return self.frame.iloc[0:0]
+        return self.frame.iloc[np.sort(np.concatenate(positions))]
+
+
+_facts = {}
+_facts_lock = threading.Lock()
+
+
+def update_order_lines(tables: dict, new_tables: dict, changes: dict):
+    """
+    Carries the FactTable built for `tables` over to `new_tables` (the same
+    tables with the rows in `changes` appended), rebuilding only the lines of
+    the orders that changed. Does nothing when none was built for `tables`.
+    """
+    with _facts_lock:
+        fact = _facts.get(data_fingerprint(tables))
+    if fact is None:
+        return None
+    fact = fact.appended(new_tables, changes)
+    with _facts_lock:
+        _facts.clear()
+        _facts[data_fingerprint(new_tables)] = fact
+    return fact
+
+
+def get_order_lines(tables: dict):
+    """Returns the FactTable for this data version, or None when order_items is missing."""
+    if tables.get("order_items") is None:
+        return None
+    fingerprint = data_fingerprint(tables)
+    with _facts_lock:
+        fact = _facts.get(fingerprint)
+        if fact is None:
+            _facts.clear()
+            fact = _facts[fingerprint] = FactTable(tables)
+        return fact
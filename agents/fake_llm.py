@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for the Azure chat model. Every call waits `latency`
+    seconds and then answers with `responder(messages)`, which may return
+    either a string or a complete AIMessage (e.g. one carrying tool calls).
+    Streamed replies arrive word by word.
+    """
+
+    responder: Callable[[List[BaseMessage]], Any]
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> ChatResult:
+        self.calls += 1
+        reply = self.responder(messages)
+        message = reply if isinstance(reply, AIMessage) else AIMessage(content=str(reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        message = self._respond(messages).generations[0].message
+        if message.tool_calls:
+            tool_call_chunks = [{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                                for i, call in enumerate(message.tool_calls)]
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content, tool_call_chunks=tool_call_chunks))
+            return
+        for word in re.findall(r"\s*\S+\s*", message.content) or [message.content]:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+            await asyncio.sleep(0)
+
+    def bind_tools(self, tools, **kwargs: Any):
+        # The responder decides when to emit tool calls, so binding is a no-op.
+        return self
+
+
+def scripted_reply(messages):
+    """Answers each kind of prompt in the chain the way the real model would, for offline runs."""
+    first = str(messages[0].content)
+    if "intent classifier" in first:
+        return '{"show_data": true, "show_plot": true}'
+    if "data retrieval assistant" in first:
+        if isinstance(messages[-1], ToolMessage):
+            return AIMessage(content=messages[-1].content)
+        question = messages[1].content
+        return AIMessage(content="", tool_calls=[{"name": "order_query_tool", "args": {"query": question}, "id": "call_0"}])
+    if "pandas code" in first:
+        return "result = orders.groupby('order_status', observed=True).size()"
+    if "visualization expert" in first or "data analyst" in first:
+        return "sns.barplot(data=df, x='category', y='value')\nplt.title('Orders by status')"
+    return "There are three order statuses; most orders were delivered."
+
+
+def message_key(messages: List[BaseMessage]) -> str:
+    """Stable hash of a prompt (roles, contents and tool calls), used to match recorded replies."""
+    parts = [
+        {"type": m.type, "content": m.content, "tool_calls": getattr(m, "tool_calls", None) or [],
+         "tool_call_id": getattr(m, "tool_call_id", None)}
+        for m in messages
+    ]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+_record_lock = threading.Lock()
+
+
+def record_reply(path: str, messages: List[BaseMessage], reply: AIMessage):
+    """Appends one prompt/reply pair to a JSONL recording that ReplayChatModel can serve."""
+    entry = {"key": message_key(messages), "content": reply.content, "tool_calls": reply.tool_calls}
+    with _record_lock:
+        with open(path, "a") as fh:
+            fh.write(json.dumps(entry, default=str) + "\n")
+
+
+class ReplayChatModel(FakeChatModel):
+    """
+    Serves the replies recorded (with LLM_RECORD_FILE) for exactly the same
+    prompts, so a captured session can be re-run offline and deterministically.
+    Prompts that were never recorded raise KeyError.
+    """
+
+    path: str
+    replies: Dict[str, dict] = {}
+    responder: Callable[[List[BaseMessage]], Any] = None
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.replies = {}
+        if os.path.exists(self.path):
+            with open(self.path) as fh:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.replies[entry["key"]] = entry
+        self.responder = self._replay
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-chat"
+
+    def _replay(self, messages: List[BaseMessage]) -> AIMessage:
+        entry = self.replies.get(message_key(messages))
+        if entry is None:
+            raise KeyError(f"No recorded reply for this prompt in {self.path}.")
+        return AIMessage(content=entry["content"], tool_calls=entry.get("tool_calls") or [])
+
+
+__all__ = ["FakeChatModel", "ReplayChatModel", "scripted_reply", "message_key", "record_reply"]
@@ -1,26 +1,19 @@
+import asyncio
 import pandas as pd
 import json
 import re
-from langchain.agents import AgentExecutor
-from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
-from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import SystemMessage
 
 from agents.shared_llm import llm
 from agents.tools_registry import get_tools
 from agents.shared_dataframe import get_stored_dataframe
+from agents.shared_tables import track_reads
+from agents.table_store import base_fingerprint, table_checksums
+from agents.router import route_question
+from agents.metrics import trace_question
+from agents.timing import stage, timed
 
-def run_agent_chain(question: str, tables: dict):
-    """
-    Runs a two-step agent chain:
-    1. Intelligently classifies the user's display intent (plot, data, both).
-    2. Retrieves the data and generates a summary.
-    """
-
-    show_plot_intent = False
-    show_data_intent = True
-
+def _classification_messages(question: str):
     classification_prompt = f"""
 You are an expert intent classifier. Your task is to analyze the user's query and determine which UI components to display based on its semantic meaning.
 
@@ -34,54 +27,300 @@ Analyze the user's query: "{question}"
 
 Return ONLY a valid JSON object with two keys: "show_data" (boolean) and "show_plot" (boolean).
 """
+    return [SystemMessage(content=classification_prompt)]
+
+def _parse_intent(content: str):
+    """Returns (show_plot, show_data) from the classifier's reply."""
+    show_plot_intent, show_data_intent = False, True
+    cleaned_json = re.search(r'\{.*\}', content, re.DOTALL)
+    if cleaned_json:
+        parsed_intent = json.loads(cleaned_json.group(0))
+        show_plot_intent = parsed_intent.get("show_plot", False)
+        show_data_intent = parsed_intent.get("show_data", True)
+    return show_plot_intent, show_data_intent
+
+def _classify_intent(question: str):
     try:
-        intent_llm_call = llm.invoke([SystemMessage(content=classification_prompt)])
-        cleaned_json = re.search(r'\{.*\}', intent_llm_call.content, re.DOTALL)
-        if cleaned_json:
-            parsed_intent = json.loads(cleaned_json.group(0))
-            show_plot_intent = parsed_intent.get("show_plot", False)
-            show_data_intent = parsed_intent.get("show_data", True)
+        with stage("intent"):
+            return _parse_intent(llm.invoke(_classification_messages(question)).content)
     except Exception as e:
         print(f"Intent classification failed, falling back to default behavior. Error: {e}")
-        show_plot_intent = False
-        show_data_intent = True
+        return False, True
+
+async def _aclassify_intent(question: str):
+    try:
+        with stage("intent"):
+            return _parse_intent((await llm.ainvoke(_classification_messages(question))).content)
+    except Exception as e:
+        print(f"Intent classification failed, falling back to default behavior. Error: {e}")
+        return False, True
+
+def _build_agent_executor(tables: dict, session_id: str = None):
+    # The langchain agent machinery is slow to import and only needed when the
+    # router is not confident, so it is loaded on first use.
+    from langchain.agents import AgentExecutor
+    from langchain.agents.format_scratchpad.openai_tools import format_to_openai_tool_messages
+    from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
-    tools = get_tools(tables)
+    tools = get_tools(tables, session_id)
     data_prompt = ChatPromptTemplate.from_messages([
         ("system", "You are a data retrieval assistant. Your ONLY job is to use a tool to get the data that answers the user's question. If the user asks for a plot or graph, focus on getting the necessary underlying data for it. Your final answer MUST be only the raw, unmodified JSON string from the tool."),
         ("user", "{input}"),
         MessagesPlaceholder(variable_name="agent_scratchpad"),
     ])
-    
+
     llm_with_tools = llm.bind_tools(tools)
     agent = ({"input": lambda x: x["input"], "agent_scratchpad": lambda x: format_to_openai_tool_messages(x["intermediate_steps"]),} | data_prompt | llm_with_tools | OpenAIToolsAgentOutputParser())
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=False, handle_parsing_errors=True)
-    
-    result = agent_executor.invoke({ "input": question })
+    return AgentExecutor(agent=agent, tools=tools, verbose=False, handle_parsing_errors=True)
+
+def _retrieve(question: str, tables: dict, route, session_id: str = None):
+    """Calls the routed tool directly when the router is confident, otherwise runs the tool-calling agent."""
+    with stage("retrieve"):
+        if route.tool_confident:
+            tools = {t.name: t for t in get_tools(tables, session_id)}
+            return tools[route.tool].invoke({"query": question})
+        result = _build_agent_executor(tables, session_id).invoke({ "input": question })
+        return result.get("output", "Could not find an answer.")
 
-    final_output_str = result.get("output", "Could not find an answer.")
-    df, answer = None, final_output_str
+async def _aretrieve(question: str, tables: dict, route, session_id: str = None):
+    with stage("retrieve"):
+        if route.tool_confident:
+            tools = {t.name: t for t in get_tools(tables, session_id)}
+            return await tools[route.tool].ainvoke({"query": question})
+        result = await _build_agent_executor(tables, session_id).ainvoke({ "input": question })
+        return result.get("output", "Could not find an answer.")
 
+async def _aintent(question: str, route):
+    if route.intent_confident:
+        return route.show_plot, route.show_data
+    return await _aclassify_intent(question)
+
+def _parse_tool_output(final_output_str: str, session_id: str = None):
+    """
+    Returns (df, answer, failed) from the tool JSON the agent passed through.
+    Output that is not a tool's JSON (e.g. the agent gave up) counts as failed.
+    """
+    df, answer, failed = None, final_output_str, True
     try:
         parsed_output = json.loads(final_output_str)
-        if isinstance(parsed_output, dict):
+        if isinstance(parsed_output, dict) and "answer" in parsed_output:
             query_id = parsed_output.get("query_id")
-            answer = parsed_output.get("answer", final_output_str)
-            if query_id: df = get_stored_dataframe(query_id)
+            answer = parsed_output["answer"]
+            failed = bool(parsed_output.get("error"))
+            if query_id: df = get_stored_dataframe(query_id, session_id)
     except (json.JSONDecodeError, TypeError): pass
+    return df, answer, failed
 
-    final_summary = ""
+def _summary_messages(question: str, df, answer):
     if df is not None:
         summary_prompt_text = f"A user asked: '{question}'\nIn response, a data table with {len(df)} rows was found. Here are the first 3 rows:\n{df.head(3).to_string()}\n\nWrite a concise, 2-3 line summary. IMPORTANT: Start by stating the total number of records found. Then, add a brief insight."
-        final_summary = llm.invoke([SystemMessage(content=summary_prompt_text)]).content
     else:
         summary_prompt_text = f"A user asked: '{question}'\nThe direct answer is: {answer}\nRephrase this into a friendly, complete sentence."
-        final_summary = llm.invoke([SystemMessage(content=summary_prompt_text)]).content
+    return [SystemMessage(content=summary_prompt_text)]
+
+def _lookup_cache(question: str, tables: dict, cache):
+    """
+    Looks the question up for the loaded data. Appending rows to a table keeps
+    the fingerprint; an entry is then only invalid if its answer read that table.
+    Returns (fingerprint, table checksums, cached result or None).
+    """
+    if cache is None:
+        return None, None, None
+    with stage("cache_lookup") as span:
+        fingerprint, checksums = base_fingerprint(tables), table_checksums(tables)
+        cached = cache.get(question, fingerprint, checksums)
+        span.set(hit=cached is not None)
+    return fingerprint, checksums, cached
 
+def _finish(question, df, answer, summary, show_plot_intent, show_data_intent):
     return {
         "answer": answer,
         "data": df,
-        "summary": final_summary,
+        "summary": summary,
         "show_data": show_data_intent and (df is not None),
         "plot": show_plot_intent and (df is not None),
-    }
\ No newline at end of file
+    }
+
+def _store(question, response, failed, cache, fingerprint, checksums, reads):
+    """Caches a response unless its tool failed. Writes to disk, so the async chains run it in a thread."""
+    if cache is not None and not failed:
+        # Without any recorded reads (e.g. no code ran), depend on every table.
+        depends_on = {name: checksums[name] for name in reads if name in checksums} if reads else checksums
+        response["cache_key"] = cache.put(question, fingerprint, response, depends_on)
+
+def run_agent_chain(question: str, tables: dict, cache=None, session_id: str = None):
+    """
+    Runs a two-step agent chain:
+    1. Intelligently classifies the user's display intent (plot, data, both).
+    2. Retrieves the data and generates a summary.
+    Common question shapes are routed locally (see agents.router), skipping the
+    intent and tool-selection LLM calls. When a ResultCache is given, repeated questions are answered from it
+    without any LLM calls until a table the answer was computed from changes. Intermediate result
+    frames are kept in the bounded result store under `session_id`. Every
+    stage is traced (see agents.metrics) when a trace is collected or exported.
+    """
+    with trace_question(question):
+        return _run_agent_chain(question, tables, cache, session_id)
+
+def _run_agent_chain(question: str, tables: dict, cache, session_id: str):
+    fingerprint, checksums, cached = _lookup_cache(question, tables, cache)
+    if cached is not None:
+        return cached
+
+    with stage("routing"):
+        route = route_question(question)
+    if route.intent_confident:
+        show_plot_intent, show_data_intent = route.show_plot, route.show_data
+    else:
+        show_plot_intent, show_data_intent = _classify_intent(question)
+
+    with track_reads() as reads:
+        df, answer, failed = _parse_tool_output(_retrieve(question, tables, route, session_id), session_id)
+
+    with stage("summary", rows_in=len(df) if df is not None else 0):
+        final_summary = llm.invoke(_summary_messages(question, df, answer)).content
+
+    response = _finish(question, df, answer, final_summary, show_plot_intent, show_data_intent)
+    _store(question, response, failed, cache, fingerprint, checksums, reads)
+    return response
+
+async def arun_agent_chain(question: str, tables: dict, cache=None, render_plot: bool = False, session_id: str = None):
+    """
+    Async version of run_agent_chain. Intent classification runs concurrently
+    with tool-based retrieval, and, with `render_plot`, plot generation runs
+    concurrently with the summary. The rendered chart (or an error string) is
+    returned under "plot_image", so end-to-end latency approaches the longest
+    single LLM call rather than the sum of all of them.
+    """
+    with trace_question(question):
+        return await _arun_agent_chain(question, tables, cache, render_plot, session_id)
+
+async def _arun_agent_chain(question: str, tables: dict, cache, render_plot: bool, session_id: str):
+    fingerprint, checksums, cached = await asyncio.to_thread(_lookup_cache, question, tables, cache)
+    if cached is not None:
+        if render_plot and cached.get("plot"):
+            cached["plot_image"] = await asyncio.to_thread(cache.get_plot, cached["cache_key"])
+        return cached
+
+    with stage("routing"):
+        route = route_question(question)
+    with track_reads() as reads:
+        (show_plot_intent, show_data_intent), output = await asyncio.gather(
+            _aintent(question, route), _aretrieve(question, tables, route, session_id),
+        )
+    df, answer, failed = _parse_tool_output(output, session_id)
+
+    summary_call = timed("summary", llm.ainvoke(_summary_messages(question, df, answer)), rows_in=len(df) if df is not None else 0)
+    plot_image = None
+    if render_plot and show_plot_intent and df is not None and not df.empty:
+        from agents.plot_agent import agenerate_plot_from_llm, enrich_datetime_columns
+        summary_message, plot_image = await asyncio.gather(
+            summary_call, agenerate_plot_from_llm(enrich_datetime_columns(df.to_frame()), question)
+        )
+    else:
+        summary_message = await summary_call
+
+    response = _finish(question, df, answer, summary_message.content, show_plot_intent, show_data_intent)
+    await asyncio.to_thread(_store_with_plot, question, response, failed, plot_image, cache, fingerprint, checksums, reads)
+    return response
+
+def _store_with_plot(question, response, failed, plot_image, cache, fingerprint, checksums, reads):
+    _store(question, response, failed, cache, fingerprint, checksums, reads)
+    _attach_plot(response, plot_image, cache)
+
+def _attach_plot(response: dict, plot_image, cache):
+    if plot_image is not None:
+        response["plot_image"] = plot_image
+        if cache is not None and response.get("cache_key") and not isinstance(plot_image, str):
+            cache.put_plot(response["cache_key"], plot_image)
+
+async def astream_agent_chain(question: str, tables: dict, cache=None, render_plot: bool = False, session_id: str = None):
+    """
+    Streaming version of arun_agent_chain, for rendering each part of the
+    answer as soon as it is ready. Yields event dicts, keyed by "event":
+    - "intent" (show_plot, show_data) once display intent is decided
+    - "data" (data, answer) once retrieval finishes; either may come first
+    - "token" (text) for each piece of the summary as the LLM writes it
+    - "plot" (image: BytesIO or an error string) when the chart is drawn,
+      possibly while the summary is still streaming
+    - "done" (response) with what arun_agent_chain would have returned
+    Cached answers yield the same events at once, the summary as one token.
+    The caller must exhaust the generator from a single task.
+    """
+    with trace_question(question):
+        async for event in _astream_agent_chain(question, tables, cache, render_plot, session_id):
+            yield event
+
+async def _astream_agent_chain(question: str, tables: dict, cache, render_plot: bool, session_id: str):
+    fingerprint, checksums, cached = await asyncio.to_thread(_lookup_cache, question, tables, cache)
+    if cached is not None:
+        yield {"event": "intent", "show_plot": cached["plot"], "show_data": cached["show_data"]}
+        yield {"event": "data", "data": cached["data"], "answer": cached["answer"]}
+        yield {"event": "token", "text": cached["summary"]}
+        if render_plot and cached.get("plot"):
+            cached["plot_image"] = await asyncio.to_thread(cache.get_plot, cached["cache_key"])
+            if cached["plot_image"] is not None:
+                yield {"event": "plot", "image": cached["plot_image"]}
+        yield {"event": "done", "response": cached}
+        return
+
+    with stage("routing"):
+        route = route_question(question)
+    with track_reads() as reads:
+        intent = asyncio.ensure_future(_aintent(question, route))
+        retrieval = asyncio.ensure_future(_aretrieve(question, tables, route, session_id))
+        try:
+            pending = {intent, retrieval}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if intent in done:
+                    show_plot_intent, show_data_intent = intent.result()
+                    yield {"event": "intent", "show_plot": show_plot_intent, "show_data": show_data_intent}
+                if retrieval in done:
+                    df, answer, failed = _parse_tool_output(retrieval.result(), session_id)
+                    yield {"event": "data", "data": df, "answer": answer}
+        finally:
+            intent.cancel()
+            retrieval.cancel()
+
+    # The summary streams while the chart is drawn; both report to one queue,
+    # so the chart is sent the moment it is ready, between summary tokens.
+    events = asyncio.Queue()
+    summary_parts = []
+
+    async def summarize():
+        with stage("summary", rows_in=len(df) if df is not None else 0):
+            async for chunk in llm.astream(_summary_messages(question, df, answer)):
+                if chunk.content:
+                    summary_parts.append(chunk.content)
+                    events.put_nowait({"event": "token", "text": chunk.content})
+
+    tasks = [asyncio.ensure_future(summarize())]
+    if render_plot and show_plot_intent and df is not None and not df.empty:
+        from agents.plot_agent import agenerate_plot_from_llm, enrich_datetime_columns
+        tasks.append(asyncio.ensure_future(agenerate_plot_from_llm(enrich_datetime_columns(df.to_frame()), question)))
+    for task in tasks:
+        task.add_done_callback(events.put_nowait)
+
+    plot_image = None
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await events.get()
+            if not isinstance(item, asyncio.Future):
+                yield item
+                continue
+            remaining -= 1
+            if item is not tasks[0]:
+                plot_image = item.result()
+                yield {"event": "plot", "image": plot_image}
+            else:
+                item.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    response = _finish(question, df, answer, "".join(summary_parts), show_plot_intent, show_data_intent)
+    await asyncio.to_thread(_store_with_plot, question, response, failed, plot_image, cache, fingerprint, checksums, reads)
+    yield {"event": "done", "response": response}
@@ -0,0 +1,121 @@
+import contextlib
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+from agents.aggregates import get_cubes, update_cubes
+from agents.fact_table import get_order_lines, update_order_lines
+from agents.sandbox import refresh_sandbox
+from agents.shared_tables import attach_tables, replace_tables
+from agents.table_store import DATA_DIR, STORE_DIR, append_to_store, load_tables, map_appended, table_versions
+
+# New rows land here as `<table>*.csv` files with the table's columns, e.g.
+# data/deltas/orders-2026-10-17T13.csv. Applied files are moved to `applied/`.
+DELTA_DIR = os.getenv("DELTA_DIR", os.path.join(DATA_DIR, "deltas"))
+# Seconds between checks for new delta files in the app; 0 disables the watcher.
+INGEST_INTERVAL = int(os.getenv("INGEST_INTERVAL", "0"))
+
+# Tables that take appended rows, in the order their deltas are applied.
+APPENDABLE = ("orders", "order_items", "payments")
+
+_DELTA_FILE = re.compile(rf"^({'|'.join(APPENDABLE)})(?:[-_.].*)?\.csv$")
+
+
+def pending_deltas(delta_dir: str = DELTA_DIR) -> dict:
+    """The delta files waiting in `delta_dir`, by table, in name order."""
+    try:
+        names = sorted(os.listdir(delta_dir))
+    except OSError:
+        return {}
+    pending = {}
+    for name in names:
+        match = _DELTA_FILE.match(name)
+        if match:
+            pending.setdefault(match.group(1), []).append(os.path.join(delta_dir, name))
+    return {table: pending[table] for table in APPENDABLE if table in pending}
+
+
+def ingest_deltas(delta_dir: str = DELTA_DIR, data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> dict:
+    """
+    Appends the pending delta files to the table store (see append_to_store) and
+    moves them to `<delta_dir>/applied`. Returns the rows appended per table.
+    """
+    pending = pending_deltas(delta_dir)
+    if not pending:
+        return {}
+    appended = append_to_store(pending, data_dir, store_dir)
+    applied_dir = os.path.join(delta_dir, "applied")
+    os.makedirs(applied_dir, exist_ok=True)
+    for paths in pending.values():
+        for path in paths:
+            # Another worker may have applied and moved the file first.
+            with contextlib.suppress(FileNotFoundError):
+                shutil.move(path, os.path.join(applied_dir, os.path.basename(path)))
+    return appended
+
+
+def refresh_tables(data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> dict:
+    """
+    Brings this process's attached tables up to date with the store, in place.
+    Only tables that were appended to are remapped; their new rows are folded
+    into the aggregate cubes and the order-line fact table, and the sandbox
+    workers are restarted on the new version. A table rebuilt from a changed
+    CSV reloads everything instead, and the cubes and fact table are rebuilt
+    before the new tables are swapped in. Returns the rows appended per table.
+    """
+    tables = attach_tables(data_dir, store_dir)
+    mapped = map_appended(tables, store_dir)
+    if mapped is None:
+        print("Source CSVs changed, reloading every table.")
+        updated = load_tables(data_dir, store_dir)
+        changes = {name: df for name, df in updated.items() if df is not None}
+        # Build the new version's cubes and fact table here, not on the next question.
+        get_cubes(updated)
+        get_order_lines(updated)
+    else:
+        updated, changes = mapped
+        if not changes:
+            return {}
+        update_cubes(tables, updated, changes)
+        update_order_lines(tables, updated, changes)
+    replace_tables(tables, updated)
+    refresh_sandbox()
+    return {name: len(rows) for name, rows in changes.items()}
+
+
+def _watch(interval: float, data_dir: str, store_dir: str, delta_dir: str):
+    while True:
+        time.sleep(interval)
+        try:
+            ingest_deltas(delta_dir, data_dir, store_dir)
+            appended = refresh_tables(data_dir, store_dir)
+            if appended:
+                print(f"Appended rows: {appended}; table versions: {table_versions(attach_tables(data_dir, store_dir))}")
+        except Exception as e:
+            print(f"Delta ingestion failed, retrying in {interval:g}s. Error: {e}")
+
+
+def start_ingest_watcher(interval: float = INGEST_INTERVAL, data_dir: str = DATA_DIR,
+                         store_dir: str = STORE_DIR, delta_dir: str = DELTA_DIR):
+    """
+    Checks for delta files every `interval` seconds from a daemon thread, appends
+    them and refreshes the attached tables. Every app worker on a host can run
+    one: the store lock lets a single worker append each file, and the others
+    pick the new rows up from the store.
+    """
+    thread = threading.Thread(target=_watch, args=(interval, data_dir, store_dir, delta_dir),
+                              daemon=True, name="ingest-watcher")
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    delta_dir = sys.argv[1] if len(sys.argv) > 1 else DELTA_DIR
+    appended = ingest_deltas(delta_dir)
+    if not appended:
+        print(f"No new delta files in {delta_dir}.")
+    for name, rows in appended.items():
+        print(f"{name}: {rows} rows appended")
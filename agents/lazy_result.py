@@ -0,0 +1,188 @@
+import threading
+
+import pandas as pd
+
+from agents.table_schema import KEY_COLUMNS, table_memory
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - Parquet-backed results need pyarrow
+    pa = pq = None
+
+PREVIEW_ROWS = 50
+CHUNK_ROWS = 50_000
+
+
+def _frame_bytes(df: pd.DataFrame) -> int:
+    """table_memory() with the shared key columns counted as codes, index included (a Series result's keys)."""
+    index = df.index
+    if isinstance(index, pd.CategoricalIndex) and index.name in KEY_COLUMNS:
+        index_bytes = index.codes.nbytes
+    else:
+        index_bytes = index.memory_usage(deep=True)
+    return table_memory(df, set(KEY_COLUMNS)) - int(index.memory_usage()) + int(index_bytes)
+
+
+class LazyResult:
+    """
+    A query result that is read in slices rather than copied up front. It knows
+    its row count, keeps a small preview, and pages or streams further rows on
+    demand, either from the frame the agent code produced or from a Parquet file
+    (cached and spilled results). Series results are turned into columns, and
+    two-column results are named category/value, one slice at a time.
+    """
+
+    def __init__(self, source, index_as_column: bool = False, columns: list = None):
+        self._source = source  # DataFrame, Series or pq.ParquetFile
+        self._index_as_column = index_as_column
+        self._columns = columns
+        self._preview = None
+        self._nbytes = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_result(cls, result):
+        """
+        Wraps an agent's `result` (DataFrame, Series, or a LazyResult from the
+        sandbox) the way the agents present it.
+        """
+        lazy = result if isinstance(result, LazyResult) else cls(result, index_as_column=isinstance(result, pd.Series))
+        if len(lazy.columns) == 2:
+            lazy._columns = ['category', 'value']
+        return lazy
+
+    @classmethod
+    def from_parquet(cls, path: str):
+        """A result backed by a Parquet file; only the row groups that are read get loaded."""
+        return cls(pq.ParquetFile(path))
+
+    @property
+    def _on_disk(self) -> bool:
+        return pq is not None and isinstance(self._source, pq.ParquetFile)
+
+    def _present(self, part, start: int = 0):
+        if self._on_disk:
+            part = part.set_axis(pd.RangeIndex(start, start + len(part)), axis=0)
+        if self._index_as_column:
+            part = part.reset_index()
+        if self._columns is not None:
+            part = part.set_axis(self._columns, axis=1)
+        return part
+
+    def _read_rows(self, start: int, stop: int) -> pd.DataFrame:
+        meta = self._source.metadata
+        groups, first_row, offset = [], None, 0
+        for i in range(meta.num_row_groups):
+            rows = meta.row_group(i).num_rows
+            if offset + rows > start and offset < stop:
+                groups.append(i)
+                first_row = offset if first_row is None else first_row
+            offset += rows
+        if not groups:
+            return self._source.schema_arrow.empty_table().to_pandas()
+        with self._lock:
+            table = self._source.read_row_groups(groups)
+        return table.slice(start - first_row, stop - start).to_pandas()
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        """Rows [start, stop) as a DataFrame."""
+        start, stop = max(start, 0), max(min(stop, len(self)), 0)
+        if self._on_disk:
+            part = self._read_rows(start, stop) if stop > start else self._source.schema_arrow.empty_table().to_pandas()
+        else:
+            part = self._source.iloc[start:stop]
+        return self._present(part, start)
+
+    def __len__(self) -> int:
+        return self._source.metadata.num_rows if self._on_disk else len(self._source)
+
+    @property
+    def columns(self) -> pd.Index:
+        return self.slice(0, 0).columns
+
+    @property
+    def shape(self) -> tuple:
+        return len(self), len(self.columns)
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0 or len(self.columns) == 0
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the result; Parquet-backed results hold none. Key columns
+        share their categories with the tables, so only their codes count.
+        """
+        if self._nbytes is None:
+            self._nbytes = 0 if self._on_disk else _frame_bytes(pd.DataFrame(self._source))
+        return self._nbytes
+
+    @property
+    def preview(self) -> pd.DataFrame:
+        if self._preview is None:
+            self._preview = self.slice(0, PREVIEW_ROWS)
+        return self._preview
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self.preview.head(n) if n <= PREVIEW_ROWS else self.slice(0, n)
+
+    def page(self, number: int, size: int = PREVIEW_ROWS) -> pd.DataFrame:
+        """The `number`-th (0-based) page of `size` rows."""
+        return self.slice(number * size, (number + 1) * size)
+
+    def num_pages(self, size: int = PREVIEW_ROWS) -> int:
+        return max(-(-len(self) // size), 1)
+
+    def iter_chunks(self, chunk_rows: int = CHUNK_ROWS):
+        """Yields the result as consecutive DataFrames of at most `chunk_rows` rows."""
+        if not self._on_disk:
+            for start in range(0, len(self), chunk_rows):
+                yield self.slice(start, start + chunk_rows)
+            return
+        start = 0
+        for batch in self._source.iter_batches(batch_size=chunk_rows):
+            part = batch.to_pandas()
+            yield self._present(part, start)
+            start += len(part)
+
+    def iter_csv(self, chunk_rows: int = CHUNK_ROWS):
+        """Yields the result as CSV text, one chunk at a time, header first."""
+        for i, chunk in enumerate(self.iter_chunks(chunk_rows)):
+            yield chunk.to_csv(index=False, header=i == 0)
+
+    def write_csv(self, path_or_buf, chunk_rows: int = CHUNK_ROWS):
+        """Streams the result as CSV to a path or writable text buffer."""
+        if isinstance(path_or_buf, str):
+            with open(path_or_buf, "w", newline="") as fh:
+                return self.write_csv(fh, chunk_rows)
+        for text in self.iter_csv(chunk_rows):
+            path_or_buf.write(text)
+
+    def to_parquet(self, path: str, chunk_rows: int = CHUNK_ROWS):
+        """Streams the result to a Parquet file, one row group per chunk (the index is not written)."""
+        writer = None
+        try:
+            for chunk in self.iter_chunks(chunk_rows):
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+            if writer is None:
+                self.slice(0, 0).to_parquet(path, index=False)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def to_frame(self) -> pd.DataFrame:
+        """Materializes the whole result. Avoid for large results; prefer slices and chunks."""
+        if self._on_disk:
+            with self._lock:
+                return self._present(self._source.read().to_pandas())
+        return self._present(self._source)
+
+    def __repr__(self) -> str:
+        return f"LazyResult({len(self):,} rows x {len(self.columns)} columns)"
@@ -0,0 +1,314 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from typing import Any, AsyncIterator, List, Optional
+
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import PrivateAttr
+
+from agents.fake_llm import FakeChatModel, ReplayChatModel, record_reply, scripted_reply
+from agents.timing import annotate
+
+load_dotenv()
+
+# "azure" (default), "openai" (any OpenAI-compatible endpoint: OPENAI_BASE_URL,
+# OPENAI_API_KEY, OPENAI_MODEL), "fake" (scripted offline replies after
+# LLM_FAKE_LATENCY seconds) or "replay" (replies recorded in LLM_REPLAY_FILE).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "azure")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+# Seconds after which a still-running call is duplicated and the first reply
+# wins; 0 disables hedging.
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+LLM_REPLAY_FILE = os.getenv("LLM_REPLAY_FILE", "llm_replay.jsonl")
+LLM_RECORD_FILE = os.getenv("LLM_RECORD_FILE")
+
+REMOTE_BACKENDS = ("azure", "openai")
+LATENCY_WINDOW = 1000
+
+
+def _http_clients(http: str) -> dict:
+    """A pooled keep-alive httpx client for sync ("sync") or async ("async") calls."""
+    import httpx
+
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+    if http == "async":
+        return {"http_async_client": httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)}
+    return {"http_client": httpx.Client(limits=limits, timeout=LLM_TIMEOUT)}
+
+
+def build_chat_model(backend: str = LLM_BACKEND, http: str = "sync") -> BaseChatModel:
+    """Creates the underlying chat model for `backend`; remote ones get a pooled HTTP client of kind `http`."""
+    common = {"temperature": 0, "max_tokens": 2000, "timeout": LLM_TIMEOUT, "max_retries": LLM_MAX_RETRIES}
+    if backend == "azure":
+        from langchain_openai import AzureChatOpenAI
+
+        return AzureChatOpenAI(
+            openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+            deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+            openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+            openai_api_type="azure",
+            **common, **_http_clients(http),
+        )
+    if backend == "openai":
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            api_key=os.getenv("OPENAI_API_KEY", "not-needed"),
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            **common, **_http_clients(http),
+        )
+    if backend == "fake":
+        return FakeChatModel(responder=scripted_reply, latency=LLM_FAKE_LATENCY)
+    if backend == "replay":
+        return ReplayChatModel(path=LLM_REPLAY_FILE, latency=LLM_FAKE_LATENCY)
+    raise ValueError(f"Unknown LLM_BACKEND {backend!r}; expected azure, openai, fake or replay.")
+
+
+class ManagedChatModel(BaseChatModel):
+    """
+    The chat model every agent shares. The backend is created on first use,
+    not at import. At most `max_concurrency` provider requests are in flight
+    at a time. Calls can be hedged: a duplicate request after `hedge_after`
+    seconds, first reply wins. The duplicate takes a second slot, is skipped
+    when none is free, and keeps the slot until both requests have finished.
+    Calls are optionally recorded for replay and feed per-call latency and
+    token metrics. Streamed calls (`astream`) are bounded and measured the
+    same way but never hedged, since a duplicate would only delay the first
+    token. Remote backends keep one pooled HTTP client for sync calls and
+    one per event loop for async calls, since async connections cannot
+    outlive the loop that opened them (the service runs one long-lived loop;
+    scripts and benchmarks may start several).
+    """
+
+    backend: str = LLM_BACKEND
+    max_concurrency: int = LLM_MAX_CONCURRENCY
+    hedge_after: float = LLM_HEDGE_AFTER
+    record_file: Optional[str] = LLM_RECORD_FILE
+
+    _model: Any = PrivateAttr(default=None)
+    _installed: bool = PrivateAttr(default=False)
+    _loop_models: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _limit: Any = PrivateAttr(default=None)
+    _loop_limits: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _hedge_pool: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _metrics: Any = PrivateAttr(default=None)
+    _latencies: Any = PrivateAttr(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._limit = threading.BoundedSemaphore(self.max_concurrency)
+        self.reset_stats()
+
+    @property
+    def _llm_type(self) -> str:
+        return f"managed-{self.backend}"
+
+    def use(self, model: BaseChatModel = None, backend: str = None):
+        """Switches every agent to `model`, or to a fresh model of `backend`."""
+        with self._lock:
+            if backend is not None:
+                self.backend = backend
+            self._model = model
+            self._installed = model is not None
+            self._loop_models = weakref.WeakKeyDictionary()
+
+    @property
+    def model(self) -> BaseChatModel:
+        with self._lock:
+            if self._model is None:
+                self._model = build_chat_model(self.backend, http="sync")
+            return self._model
+
+    def _async_model(self) -> BaseChatModel:
+        model = self.model
+        if self._installed or self.backend not in REMOTE_BACKENDS:
+            return model
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._loop_models:
+                self._loop_models[loop] = build_chat_model(self.backend, http="async")
+            return self._loop_models[loop]
+
+    def _async_limit(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._loop_limits:
+                self._loop_limits[loop] = asyncio.Semaphore(self.max_concurrency)
+            return self._loop_limits[loop]
+
+    def bind_tools(self, tools, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def reset_stats(self):
+        with self._lock:
+            self._metrics = {"calls": 0, "errors": 0, "hedged": 0, "hedge_wins": 0, "in_flight": 0,
+                             "max_in_flight": 0, "input_tokens": 0, "output_tokens": 0}
+            self._latencies.clear()
+
+    def _begin(self):
+        with self._lock:
+            self._metrics["in_flight"] += 1
+            self._metrics["max_in_flight"] = max(self._metrics["max_in_flight"], self._metrics["in_flight"])
+        return time.perf_counter()
+
+    def _end(self, started: float, messages: List[BaseMessage], result: Optional[ChatResult]):
+        elapsed = time.perf_counter() - started
+        usage = {}
+        if result is not None and result.generations:
+            usage = getattr(result.generations[0].message, "usage_metadata", None) or {}
+        with self._lock:
+            self._metrics["in_flight"] -= 1
+            self._metrics["calls"] += 1
+            self._metrics["errors"] += result is None
+            self._metrics["input_tokens"] += usage.get("input_tokens", 0)
+            self._metrics["output_tokens"] += usage.get("output_tokens", 0)
+            self._latencies.append(elapsed)
+        annotate(llm_calls=1, input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0))
+        if result is not None and self.record_file:
+            record_reply(self.record_file, messages, result.generations[0].message)
+
+    def _call(self, model, messages, stop, kwargs) -> ChatResult:
+        return model._generate(messages, stop=stop, **kwargs)
+
+    def _hedged(self, model, messages, stop, kwargs) -> ChatResult:
+        with self._lock:
+            if self._hedge_pool is None:
+                # Room for a first call and a duplicate per slot, so a new call never queues behind a loser.
+                self._hedge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2 * self.max_concurrency,
+                                                                         thread_name_prefix="llm-hedge")
+        first = self._hedge_pool.submit(self._call, model, messages, stop, kwargs)
+        try:
+            return first.result(timeout=self.hedge_after)
+        except concurrent.futures.TimeoutError:
+            pass
+        if not self._limit.acquire(blocking=False):
+            return first.result()
+        with self._lock:
+            self._metrics["hedged"] += 1
+        second = self._hedge_pool.submit(self._call, model, messages, stop, kwargs)
+        _when_all_done([first, second], self._limit.release)
+        done, _ = concurrent.futures.wait([first, second], return_when=concurrent.futures.FIRST_COMPLETED)
+        winner = done.pop()
+        if winner is second:
+            with self._lock:
+                self._metrics["hedge_wins"] += 1
+        return winner.result()
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        model = self.model
+        with self._limit:
+            started, result = self._begin(), None
+            try:
+                if self.hedge_after > 0:
+                    result = self._hedged(model, messages, stop, kwargs)
+                else:
+                    result = self._call(model, messages, stop, kwargs)
+                return result
+            finally:
+                self._end(started, messages, result)
+
+    async def _ahedged(self, model, messages, stop, kwargs) -> ChatResult:
+        first = asyncio.ensure_future(model._agenerate(messages, stop=stop, **kwargs))
+        done, _ = await asyncio.wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        limit = self._async_limit()
+        if limit.locked():
+            return await first
+        await limit.acquire()
+        with self._lock:
+            self._metrics["hedged"] += 1
+        second = asyncio.ensure_future(model._agenerate(messages, stop=stop, **kwargs))
+        _when_all_done([first, second], limit.release)
+        done, pending = await asyncio.wait([first, second], return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        winner = done.pop()
+        if winner is second:
+            with self._lock:
+                self._metrics["hedge_wins"] += 1
+        return winner.result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager=None, **kwargs: Any) -> ChatResult:
+        model = self._async_model()
+        async with self._async_limit():
+            started, result = self._begin(), None
+            try:
+                if self.hedge_after > 0:
+                    result = await self._ahedged(model, messages, stop, kwargs)
+                else:
+                    result = await model._agenerate(messages, stop=stop, **kwargs)
+                return result
+            finally:
+                self._end(started, messages, result)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        model = self._async_model()
+        async with self._async_limit():
+            started, result, merged = self._begin(), None, None
+            try:
+                if type(model)._astream is not BaseChatModel._astream or type(model)._stream is not BaseChatModel._stream:
+                    chunks = model._astream(messages, stop=stop, **kwargs)
+                else:
+                    # Models without streaming answer in a single chunk.
+                    chunks = _single_chunk(await model._agenerate(messages, stop=stop, **kwargs))
+                async for chunk in chunks:
+                    merged = chunk if merged is None else merged + chunk
+                    yield chunk
+                if merged is not None:
+                    result = ChatResult(generations=[ChatGeneration(message=merged.message)])
+            finally:
+                self._end(started, messages, result)
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            report = dict(self._metrics, backend=self._model._llm_type if self._installed else self.backend)
+        if latencies:
+            pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+            report.update(latency_ms_p50=round(pick(0.5), 1), latency_ms_p95=round(pick(0.95), 1),
+                          latency_ms_max=round(latencies[-1] * 1000, 1))
+        return report
+
+
+def _when_all_done(futures: list, callback):
+    """Calls `callback()` once every future (concurrent or asyncio) has finished, e.g. to free a hedge's slot."""
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+async def _single_chunk(result: ChatResult):
+    message = result.generations[0].message
+    yield ChatGenerationChunk(message=AIMessageChunk(content=message.content,
+                                                     usage_metadata=getattr(message, "usage_metadata", None)))
+
+
+__all__ = ["build_chat_model", "ManagedChatModel"]
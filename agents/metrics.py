@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agents.timing import NO_SPAN, Trace, collect_stages, current_trace, stage
+
+# Comma-separated exporters every finished question trace is sent to:
+# "json" appends it to TRACE_LOG_FILE, "prometheus" aggregates it into the
+# metrics served on METRICS_PORT. Empty (the default) disables tracing unless
+# the caller collects the trace itself (see agents.timing.collect_stages).
+TRACE_EXPORTERS = [name.strip() for name in os.getenv("TRACE_EXPORTERS", "").split(",") if name.strip()]
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", ".cache/traces.jsonl")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Numeric span attributes exported as per-stage counters.
+COUNTED_ATTRS = ("llm_calls", "input_tokens", "output_tokens", "rows_in", "rows_out", "result_bytes")
+
+
+class JsonTraceExporter:
+    """Appends each trace, with all its spans, as one JSON line to a local log."""
+
+    def __init__(self, path: str = TRACE_LOG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), default=str)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as fh:
+                fh.write(line + "\n")
+
+
+class PrometheusExporter:
+    """
+    Aggregates spans into per-stage duration histograms, error counts and
+    COUNTED_ATTRS counters, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._durations = {}  # stage -> [bucket counts..., count, sum]
+        self._counters = {}   # (metric, stage) -> value
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        with self._lock:
+            for span in list(trace.spans):
+                seconds = span.duration or 0.0
+                histogram = self._durations.setdefault(span.name, [0] * len(self.buckets) + [0, 0.0])
+                for i, bound in enumerate(self.buckets):
+                    histogram[i] += seconds <= bound
+                histogram[-2] += 1
+                histogram[-1] += seconds
+                if "error" in span.attrs:
+                    self._count("qa_stage_errors_total", span.name, 1)
+                for attr in COUNTED_ATTRS:
+                    value = span.attrs.get(attr)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        self._count(f"qa_{attr}_total", span.name, value)
+
+    def _count(self, metric: str, name: str, value):
+        self._counters[(metric, name)] = self._counters.get((metric, name), 0) + value
+
+    def render(self) -> str:
+        lines = ["# HELP qa_stage_duration_seconds Time spent per question pipeline stage.",
+                 "# TYPE qa_stage_duration_seconds histogram"]
+        with self._lock:
+            for name, histogram in sorted(self._durations.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'qa_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'qa_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'qa_stage_duration_seconds_count{{stage="{name}"}} {histogram[-2]}')
+                lines.append(f'qa_stage_duration_seconds_sum{{stage="{name}"}} {histogram[-1]:.6f}')
+            for metric in sorted({metric for metric, _ in self._counters}):
+                lines.append(f"# TYPE {metric} counter")
+                for (name_metric, name), value in sorted(self._counters.items()):
+                    if name_metric == metric:
+                        lines.append(f'{metric}{{stage="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+_exporters = []
+_prometheus = None
+_exporters_lock = threading.Lock()
+
+
+def register_exporter(exporter):
+    """Adds an exporter: any object with an `export(trace)` method."""
+    with _exporters_lock:
+        _exporters.append(exporter)
+
+
+def prometheus_exporter() -> PrometheusExporter:
+    """The process-wide Prometheus aggregator, registered as an exporter on first use."""
+    global _prometheus
+    with _exporters_lock:
+        if _prometheus is None:
+            _prometheus = PrometheusExporter()
+            _exporters.append(_prometheus)
+        return _prometheus
+
+
+for _name in TRACE_EXPORTERS:
+    if _name == "json":
+        register_exporter(JsonTraceExporter())
+    elif _name == "prometheus":
+        prometheus_exporter()
+    else:
+        print(f"Unknown trace exporter {_name!r} ignored; use 'json' or 'prometheus'.")
+
+
+def export_trace(trace: Trace):
+    for exporter in list(_exporters):
+        try:
+            exporter.export(trace)
+        except Exception as e:
+            print(f"Trace exporter {type(exporter).__name__} failed. Error: {e}")
+
+
+@contextmanager
+def trace_question(question: str):
+    """
+    Runs one question as the root "question" span. The spans go into the trace
+    the caller is collecting, or into a new one when exporters are registered,
+    and the trace is exported when the question finishes.
+    """
+    trace = current_trace()
+    if trace is None and not _exporters:
+        yield NO_SPAN
+        return
+    with nullcontext(trace) if trace is not None else collect_stages() as trace:
+        try:
+            with stage("question", question=question) as span:
+                yield span
+        finally:
+            export_trace(trace)
+
+
+def metrics_text() -> str:
+    return prometheus_exporter().render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = METRICS_PORT):
+    """Serves the Prometheus metrics at http://0.0.0.0:<port>/metrics from a daemon thread."""
+    prometheus_exporter()
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    print(f"Serving metrics at http://0.0.0.0:{server.server_port}/metrics")
+    return server
@@ -1,19 +1,41 @@
-import io
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
+import asyncio
 import pandas as pd
 from langchain.schema import SystemMessage, HumanMessage
 from agents.shared_llm import llm
-import contextlib
-
-def generate_plot_from_llm(df: pd.DataFrame, question: str):
-    try:
-        df = df.copy()
-        df.columns = df.columns.str.lower().str.replace('[^0-9a-zA-Z_]', '', regex=True)
-
-        if len(df) > 50 and len(df.columns) > 3:
-            system_prompt = f"""
+from agents.fact_table import FACT_SOURCES, get_order_lines
+from agents.sandbox import render_plot_code
+from agents.chart_templates import choose_chart, render_chart
+from agents.plot_cache import plot_cache
+from agents.plot_reduce import reduce_for_chart
+from agents.result_cache import normalize_question
+from agents.table_schema import TIME_FEATURE_SUFFIXES, time_features
+from agents.table_store import base_fingerprint
+from agents.prompts import cached_block, track_prompt
+from agents.timing import stage, timed
+
+def enrich_datetime_columns(df):
+    """
+    Adds year, month, week, day-of-week and date columns for plotting. Parts
+    already derived at load time (see TIME_FEATURE_SUFFIXES) are reused, so
+    a frame selected from orders only gains columns for its other timestamps.
+    """
+    if not isinstance(df, pd.DataFrame): return df
+    derived = {}
+    for col in df.select_dtypes(include=["datetime64[ns]"]).columns:
+        if col.endswith("_date") and col[:-len("_date")] in df.columns:
+            continue
+        missing = [f"{col}{suffix}" for suffix in TIME_FEATURE_SUFFIXES if f"{col}{suffix}" not in df.columns]
+        if missing:
+            features = time_features(df[col])
+            derived.update({name: features[name] for name in missing})
+    return df.assign(**derived) if derived else df
+
+def _clean_columns(df: pd.DataFrame) -> pd.DataFrame:
+    return df.set_axis(df.columns.str.lower().str.replace('[^0-9a-zA-Z_]', '', regex=True), axis=1)
+
+def _plot_messages(df: pd.DataFrame, question: str):
+    if len(df) > 50 and len(df.columns) > 3:
+        system_prompt = f"""
 You are an expert Python data analyst. You have been given a raw pandas DataFrame named `df`.
 Your task is to write a single Python script that first **aggregates** this raw data into a meaningful summary, and then **plots** that summary using seaborn/matplotlib.
 
@@ -27,8 +49,8 @@ RULES:
 4. Do NOT use `plt.show()`.
 5. Return ONLY the complete, executable Python script.
 """
-        else: 
-            system_prompt = f"""
+    else: 
+        system_prompt = f"""
 You are a Python data visualization expert. Your only job is to write a single, clean block of seaborn/matplotlib code to create a plot from the given (already aggregated) pandas DataFrame `df`.
 The user's request is: "{question}"
 The available columns in `df` are: {', '.join(df.columns)}
@@ -39,37 +61,89 @@ RULES:
 - If x-axis labels are long, rotate them with `plt.xticks(rotation=45, ha='right')`.
 - Return ONLY the Python code.
 """
-        
-        messages = [SystemMessage(content=system_prompt)]
-        response = llm.invoke(messages).content.strip().replace("```python", "").replace("```", "").strip()
-        code = response
-
-        plt.clf(); plt.close("all")
-        local_vars = {"df": df, "plt": plt, "sns": sns, "np": np, "pd": pd}
-        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
-            exec(code, {}, local_vars)
-
-        fig = plt.gcf()
-        if not fig.axes or all(not ax.has_data() for ax in fig.axes):
-            return "{\"error\":\"Generated code did not produce a plot.\"}"
-
-        buf = io.BytesIO()
-        plt.tight_layout()
-        fig.savefig(buf, format="png", bbox_inches="tight", dpi=120)
-        buf.seek(0)
-        plt.close("all")
-        return buf
+    return [SystemMessage(content=system_prompt)]
 
+def _clean_code(content: str) -> str:
+    return content.strip().replace("```python", "").replace("```", "").strip()
+
+def _template_plot(df: pd.DataFrame, chart):
+    try:
+        return render_chart(df, chart)
     except Exception as e:
-        plt.close("all")
-        return f"{{\"error\":\"Could not generate valid plot code. Details: {e}\"}}"
+        print(f"Chart template {chart.kind} failed, falling back to LLM plot code. Error: {e}")
+        return None
+
+def _plot_key(df: pd.DataFrame, question: str, chart):
+    return plot_cache.make_key(df, chart.key if chart else f"llm|{normalize_question(question)}")
+
+def _remember_plot(key, image, span):
+    if not isinstance(image, str):
+        plot_cache.put(key, image)
+        span.set(result_bytes=image.getbuffer().nbytes)
+    return image
+
+def _prepare(df: pd.DataFrame, question: str, span):
+    df = _clean_columns(df)
+    chart = choose_chart(df, question)
+    if chart is not None:
+        df = reduce_for_chart(df, chart.kind)
+    span.set(rows_out=len(df), chart=chart.kind if chart else "llm")
+    return df, chart
+
+def generate_plot_from_llm(df: pd.DataFrame, question: str):
+    """
+    Renders a chart for `df`: from the plot cache when the same data was drawn
+    the same way before, from a chart template for category/value results, and
+    otherwise from LLM-written plotting code.
+    """
+    with stage("plot", rows_in=len(df)) as span:
+        try:
+            df, chart = _prepare(df, question, span)
+            key = _plot_key(df, question, chart)
+            cached = plot_cache.get(key)
+            span.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+            with stage("plot_render"):
+                image = _template_plot(df, chart) if chart else None
+            if image is not None:
+                return _remember_plot(key, image, span)
+            with stage("plot_codegen"):
+                code = _clean_code(llm.invoke(_plot_messages(df, question)).content)
+        except Exception as e:
+            return f"{{\"error\":\"Could not generate valid plot code. Details: {e}\"}}"
+        with stage("plot_render"):
+            return _remember_plot(key, render_plot_code(df, code), span)
+
+async def agenerate_plot_from_llm(df: pd.DataFrame, question: str):
+    """Async generate_plot_from_llm: awaits the LLM call and renders in a worker thread."""
+    with stage("plot", rows_in=len(df)) as span:
+        try:
+            df, chart = _prepare(df, question, span)
+            key = await asyncio.to_thread(_plot_key, df, question, chart)
+            cached = plot_cache.get(key)
+            span.set(cached=cached is not None)
+            if cached is not None:
+                return cached
+            image = await timed("plot_render", asyncio.to_thread(_template_plot, df, chart)) if chart else None
+            if image is not None:
+                return _remember_plot(key, image, span)
+            code = _clean_code((await timed("plot_codegen", llm.ainvoke(_plot_messages(df, question)))).content)
+        except Exception as e:
+            return f"{{\"error\":\"Could not generate valid plot code. Details: {e}\"}}"
+        return _remember_plot(key, await timed("plot_render", asyncio.to_thread(render_plot_code, df, code)), span)
+
+def _table_samples(tables: dict) -> str:
+    table_info = ""
+    for name, df in tables.items():
+        sample = df.head(2).to_string(index=False) if not df.empty else "Empty"
+        table_info += f"{name}:\n  Columns: {', '.join(df.columns)}\n  Sample:\n{sample}\n\n"
+    return table_info
 
 def intelligent_table_selection(question: str, tables: dict):
     try:
-        table_info = ""
-        for name, df in tables.items():
-            sample = df.head(2).to_string(index=False) if not df.empty else "Empty"
-            table_info += f"{name}:\n  Columns: {', '.join(df.columns)}\n  Sample:\n{sample}\n\n"
+        # Only the first rows are sampled, so appended rows never change the block.
+        table_info = cached_block(base_fingerprint(tables), "table-samples", lambda: _table_samples(tables))
 
         messages = [
             SystemMessage(content=(
@@ -84,6 +158,7 @@ def intelligent_table_selection(question: str, tables: dict):
             HumanMessage(content=f"User question: {question}")
         ]
 
+        track_prompt("plot-table-selection", messages)
         response = llm.invoke(messages).content.strip()
 
         primary_table = None
@@ -99,7 +174,11 @@ def intelligent_table_selection(question: str, tables: dict):
         if not primary_table or primary_table not in tables:
             return None, None
 
-        df = tables[primary_table].copy()
+        fact = get_order_lines(tables) if join_tables else None
+        if fact is not None and {primary_table, *join_tables} <= FACT_SOURCES:
+            return fact.frame.copy(deep=False), primary_table
+
+        df = tables[primary_table].copy(deep=False)
 
         for join_table in join_tables:
             if join_table not in tables:
@@ -0,0 +1,98 @@
+import hashlib
+import io
+import os
+import threading
+
+import pandas as pd
+
+PLOT_CACHE_DIR = os.getenv("PLOT_CACHE_DIR", ".cache/plots")
+
+
+def frame_hash(df: pd.DataFrame):
+    """Content hash of a frame's columns, dtypes and values, or None if a value is unhashable."""
+    digest = hashlib.sha256("|".join(f"{col}={dtype}" for col, dtype in df.dtypes.astype(str).items()).encode())
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    except TypeError:
+        return None
+    return digest.hexdigest()[:24]
+
+
+class PlotCache:
+    """
+    Content-addressed cache of rendered chart PNGs, keyed by the plotted data's
+    hash and the chart spec (a template, or the question the LLM plots for).
+    Identical data drawn the same way is served from disk without rendering or
+    an LLM call, whichever question produced it. Files are evicted
+    least-recently-used beyond `max_entries`.
+    """
+
+    def __init__(self, cache_dir: str = PLOT_CACHE_DIR, max_entries: int = 500):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, df: pd.DataFrame, spec: str):
+        data_hash = frame_hash(df)
+        if data_hash is None:
+            return None
+        return hashlib.sha256(f"{data_hash}\0{spec}".encode()).hexdigest()[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, key: str):
+        """Returns the cached PNG as a BytesIO, or None."""
+        if key is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as fh:
+                image = io.BytesIO(fh.read())
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self.metrics["misses"] += 1
+            return None
+        with self._lock:
+            self.metrics["hits"] += 1
+        return image
+
+    def put(self, key: str, image: io.BytesIO):
+        if key is None:
+            return
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(image.getvalue())
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            files = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".png"):
+                    try:
+                        files.append((os.stat(os.path.join(self.cache_dir, name)).st_mtime, name))
+                    except OSError:
+                        pass
+            if len(files) <= self.max_entries:
+                return
+            for _, name in sorted(files)[:len(files) - self.max_entries]:
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    os.remove(path)
+                    self.metrics["evictions"] += 1
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".png"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.metrics)
+
+
+plot_cache = PlotCache()
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "1000"))
+PLOT_TOP_N = int(os.getenv("PLOT_TOP_N", "50"))
+OTHER_LABEL = "Other"
+
+CI_FUNCTIONS = ("barplot", "lineplot", "pointplot", "relplot", "catplot")
+REG_FUNCTIONS = ("regplot", "lmplot")
+
+
+def _as_float(values: pd.Series) -> np.ndarray:
+    if is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype="datetime64[ns]").astype("int64").astype(float)
+    return values.to_numpy(dtype=float)
+
+
+def _is_axis(values: pd.Series) -> bool:
+    return is_datetime64_any_dtype(values) or (is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: positions of `n_out` points of the series
+    (x sorted ascending) that keep its visual shape, peaks and dips included.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    out = np.empty(n_out, dtype=int)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def downsample(df: pd.DataFrame, x: str, ys: list, max_points: int = PLOT_MAX_POINTS) -> pd.DataFrame:
+    """Sorts by `x` and keeps the rows LTTB picks for any of the `ys` columns."""
+    data = df.dropna(subset=[x, *ys]).sort_values(x)
+    if len(data) <= max_points:
+        return data
+    xs = _as_float(data[x])
+    keep = np.unique(np.concatenate([lttb_indices(xs, _as_float(data[y]), max_points // len(ys)) for y in ys]))
+    return data.iloc[keep]
+
+
+def bucket_times(df: pd.DataFrame, x: str, max_points: int = PLOT_MAX_POINTS) -> pd.Series:
+    """
+    `df[x]` coarsened until it has at most `max_points` distinct values: to
+    days, then to months (built from the `_year`/`_month` columns that
+    enrich_datetime_columns adds, when present).
+    """
+    times = df[x]
+    if times.nunique() <= max_points:
+        return times
+    days = times.dt.normalize()
+    if days.nunique() <= max_points:
+        return days
+    year, month = f"{x}_year", f"{x}_month"
+    if year in df.columns and month in df.columns:
+        return pd.to_datetime(pd.DataFrame({"year": df[year], "month": df[month], "day": 1}), errors="coerce")
+    return times.dt.to_period("M").dt.to_timestamp()
+
+
+def top_n_other(df: pd.DataFrame, x: str, y: str, estimator="mean", n: int = PLOT_TOP_N) -> pd.DataFrame:
+    """
+    One row per category of `x` with `y` aggregated by `estimator`: the `n`
+    largest in their original order, then the remaining rows aggregated
+    together as "Other".
+    """
+    grouped = df.groupby(x, observed=True, sort=False)[y].agg(estimator)
+    if len(grouped) <= n + 1:
+        return grouped.reset_index()
+    top = grouped[grouped.index.isin(grouped.nlargest(n).index)]
+    other = df.loc[~df[x].isin(top.index), y].agg(estimator)
+    return pd.DataFrame({x: [*top.index.astype(str), OTHER_LABEL], y: [*top.to_numpy(), other]})
+
+
+def reduce_for_chart(df: pd.DataFrame, kind: str) -> pd.DataFrame:
+    """
+    Shrinks a category/value result drawn by a chart template: a line over
+    more than PLOT_MAX_POINTS points is downsampled with LTTB, and bars over
+    more than PLOT_TOP_N categories keep the largest ones. Only results that
+    are already aggregated (one row per category) are reduced; repeated
+    categories mean raw rows, which are drawn as they are. Frames plotted by
+    LLM-written code are never reduced here, since that code may aggregate
+    them; their seaborn calls are reduced by FastSeaborn instead.
+    """
+    if len(df) <= min(PLOT_MAX_POINTS, PLOT_TOP_N) or not df["category"].is_unique:
+        return df
+    if kind == "line":
+        return downsample(df, "category", ["value"]) if len(df) > PLOT_MAX_POINTS else df
+    if kind in ("bar", "barh"):
+        return df.nlargest(PLOT_TOP_N, "value")
+    return df
+
+
+def _plain_call(data, x, y, kwargs) -> bool:
+    """A call over a frame's x/y columns, without semantic mappings that a reduction would merge."""
+    return (isinstance(data, pd.DataFrame) and len(data) > PLOT_MAX_POINTS
+            and isinstance(x, str) and isinstance(y, str) and x in data.columns and y in data.columns
+            and is_numeric_dtype(data[y]) and kwargs.get("estimator", "mean") in ("mean", "sum", "median")
+            and all(kwargs.get(key) is None for key in ("hue", "style", "size", "units", "weights", "order")))
+
+
+class FastSeaborn:
+    """
+    seaborn as seen by LLM-written plot code. Confidence intervals, which
+    seaborn bootstraps over every row, are off unless the code asks for them,
+    and plain lineplot/barplot calls over more than PLOT_MAX_POINTS rows are
+    aggregated first: lines are bucketed in time and downsampled with LTTB,
+    bars are cut to the top PLOT_TOP_N categories plus "Other".
+    """
+
+    def __init__(self, sns):
+        self._sns = sns
+
+    def __getattr__(self, name):
+        attr = getattr(self._sns, name)
+        if name in CI_FUNCTIONS:
+            return lambda *args, **kwargs: attr(*args, **{"errorbar": None, **kwargs})
+        if name in REG_FUNCTIONS:
+            return lambda *args, **kwargs: attr(*args, **{"ci": None, **kwargs})
+        return attr
+
+    def lineplot(self, data=None, *, x=None, y=None, **kwargs):
+        kwargs.setdefault("errorbar", None)
+        if _plain_call(data, x, y, kwargs) and _is_axis(data[x]):
+            estimator = kwargs.get("estimator", "mean")
+            # Bucketing changes what a sum adds up, so only averages are taken over coarser times.
+            bucket = is_datetime64_any_dtype(data[x]) and estimator != "sum"
+            keys = bucket_times(data, x) if bucket else data[x]
+            data = data[y].groupby(keys.rename(x)).agg(estimator).reset_index()
+            data = downsample(data, x, [y])
+        return self._sns.lineplot(data=data, x=x, y=y, **kwargs)
+
+    def barplot(self, data=None, *, x=None, y=None, **kwargs):
+        kwargs.setdefault("errorbar", None)
+        if _plain_call(data, x, y, kwargs) and not _is_axis(data[x]) and data[x].nunique() > PLOT_TOP_N + 1:
+            data = top_n_other(data, x, y, kwargs.get("estimator", "mean"))
+        return self._sns.barplot(data=data, x=x, y=y, **kwargs)
@@ -0,0 +1,205 @@
+import os
+import threading
+from collections import OrderedDict
+
+from langchain.schema import SystemMessage, HumanMessage
+
+from agents.code_cache import schema_hash
+from agents.table_schema import TABLE_SCHEMAS
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - token counts fall back to an estimate
+    tiktoken = None
+
+PROMPT_TOKEN_ENCODING = os.getenv("PROMPT_TOKEN_ENCODING", "cl100k_base")
+MAX_PROMPT_BLOCKS = 64
+
+# Identical for every agent and data version, so it leads every prompt and the
+# provider can serve it from its prompt cache.
+COMMON_PROMPT = f"""
+You are a data analyst for an e-commerce dataset. You write Python pandas code that answers the user's question.
+The code should be executable and return a pandas DataFrame or Series.
+
+RULES:
+1. Use the provided DataFrame variable names: {', '.join(f'`{name}`' for name in TABLE_SCHEMAS)}, `order_lines` and the aggregate view names listed below.
+2. **DO NOT** use a variable named `df` in the code you write.
+3. Your code **MUST** end by assigning the final result to a variable named `result`.
+4. Return only the code, no explanations.
+5. When you need data from multiple tables, use `order_lines` instead of merging them yourself; merge only for columns it lacks. To fetch the lines of specific IDs use `find_order_lines(key, values)` with key 'order_id', 'customer_id' or 'product_id'.
+6. ID, state, city, status, category and payment-type columns are pandas categoricals: pass `observed=True` to `groupby()` and `pivot_table()`, and drop zero counts after `value_counts()`.
+7. The tables are copy-on-write views: assign with `.loc[mask, column] = value` or `df[column] = ...`, never chained (`df[column][mask] = value`), which changes nothing.
+
+CRITICAL INSTRUCTION: Analyze the user's entire query. If the query contains words like 'plot', 'graph', 'chart', 'visualize', or 'draw', your primary goal is to produce a DataFrame that is aggregated and ready for plotting. If the query does NOT ask for a plot, then you should return the detailed, un-aggregated data as requested.
+"""
+
+
+def _fallback_count(text: str) -> int:
+    return max(len(text) // 4, 1)
+
+
+class PromptAssembler:
+    """
+    Builds the agent prompts from blocks that are rendered once per table
+    schema: the shared rules first, then the schema block trimmed to the
+    agent's tables, then the agent's specialty, so every request re-sends a
+    byte-identical prefix that provider-side prompt caching can reuse. Counts
+    the prompt tokens of each request next to what the untrimmed prompt would
+    have cost, and the cached prompt tokens the provider reports.
+
+    The token encoding may have to be downloaded, so it is loaded on a
+    background thread on first use; tokens are estimated until it is ready,
+    and blocks counted before then are recounted on their next use.
+    """
+
+    def __init__(self, encoding: str = PROMPT_TOKEN_ENCODING):
+        self.encoding = encoding
+        self.metrics = {}
+        self._blocks = OrderedDict()  # (fingerprint, name) -> (text, tokens, exact)
+        self._encoder = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def _load_encoder(self):
+        try:
+            self._encoder = tiktoken.get_encoding(self.encoding).encode
+        except Exception as e:
+            print(f"Token encoding {self.encoding} unavailable, estimating prompt tokens. Error: {e}")
+
+    def count_tokens(self, text: str) -> int:
+        encoder = self._encoder
+        if encoder is None:
+            with self._lock:
+                start, self._loading = not self._loading and tiktoken is not None, True
+            if start:
+                threading.Thread(target=self._load_encoder, daemon=True, name="token-encoding").start()
+            return _fallback_count(text)
+        return len(encoder(text))
+
+    def block(self, fingerprint: str, name: str, build) -> tuple:
+        """(text, tokens) of a prompt block, rendered by `build()` once per `fingerprint`."""
+        key = (fingerprint, name)
+        with self._lock:
+            cached = self._blocks.get(key)
+            if cached is not None:
+                self._blocks.move_to_end(key)
+        if cached is not None and (cached[2] or self._encoder is None):
+            return cached[:2]
+        text = build() if cached is None else cached[0]
+        exact = self._encoder is not None
+        tokens = self.count_tokens(text)
+        with self._lock:
+            self._blocks[key] = (text, tokens, exact)
+            self._blocks.move_to_end(key)
+            while len(self._blocks) > MAX_PROMPT_BLOCKS:
+                self._blocks.popitem(last=False)
+        return text, tokens
+
+    def _record(self, name: str, **counts):
+        with self._lock:
+            entry = self.metrics.setdefault(name, {
+                "requests": 0, "prompt_tokens": 0, "full_prompt_tokens": 0,
+                "provider_prompt_tokens": 0, "cached_prompt_tokens": 0,
+            })
+            for key, value in counts.items():
+                entry[key] += value
+
+    def track(self, name: str, tokens: int, full_tokens: int = None):
+        """Records one request's prompt tokens (and those of the untrimmed prompt it replaces)."""
+        self._record(name, requests=1, prompt_tokens=tokens, full_prompt_tokens=tokens if full_tokens is None else full_tokens)
+
+    def record_usage(self, name: str, response):
+        """Adds the prompt and cached-prompt tokens the provider reports on an LLM response, if any."""
+        usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        details = usage.get("prompt_tokens_details") or {}
+        self._record(name, provider_prompt_tokens=usage.get("prompt_tokens") or 0,
+                     cached_prompt_tokens=details.get("cached_tokens") or 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            report = {}
+            for name, entry in self.metrics.items():
+                full = entry["full_prompt_tokens"]
+                saved = (1 - entry["prompt_tokens"] / full) * 100 if full else 0.0
+                report[name] = {**entry, "saved_pct": round(saved, 1)}
+            return report
+
+
+def _schema_block(tables: dict, cubes, fact, names: list, compact: bool = True) -> str:
+    shown = [name for name in names if tables.get(name) is not None]
+    lines = [f"{name.upper()} table columns: {', '.join(tables[name].columns)}" for name in shown]
+    if fact is not None:
+        # Name the listed tables whose columns order_lines carries instead of repeating them.
+        covered = [name for name in shown if compact and set(tables[name].columns) <= set(fact.frame.columns)]
+        listed = {col for name in covered for col in tables[name].columns}
+        rest = ', '.join(col for col in fact.frame.columns if col not in listed)
+        columns = f"all {', '.join(name.upper() for name in covered)} columns, plus {rest}" if covered else rest
+        lines.append(
+            "ORDER_LINES table columns (pre-joined, one row per order item with its order, product, customer "
+            f"and per-order payment totals): {columns}"
+        )
+    others = [name for name in TABLE_SCHEMAS if name not in names and tables.get(name) is not None]
+    if others:
+        lines.append(f"Also available: {', '.join(f'`{name}`' for name in others)} (most of their columns are in ORDER_LINES).")
+    lines.append("")
+    lines.append("PRECOMPUTED AGGREGATE VIEWS (already grouped, one small DataFrame each; prefer them over grouping the raw tables whenever they answer the question):")
+    lines.append(cubes.describe(sources=set(names)))
+    return "\n".join(lines)
+
+
+def _agent_block(agent: dict) -> str:
+    return (
+        f"You specialize in e-commerce {agent['domain']}. Your task is to write Python pandas code to answer "
+        f"the user's question about {agent['subject']}. If it asks for a plot: for example, {agent['example']}"
+    )
+
+
+_assembler = PromptAssembler()
+
+
+def _agent_blocks(agent: dict, tables: dict, cubes, fact) -> tuple:
+    # The blocks list columns only, so rows appended to a table keep them valid.
+    fingerprint = schema_hash(tables)
+    name = agent["name"]
+    common = _assembler.block(fingerprint, "common", lambda: COMMON_PROMPT)
+    schema = _assembler.block(fingerprint, f"schema:{name}", lambda: _schema_block(tables, cubes, fact, agent["tables"]))
+    specialty = _assembler.block(fingerprint, f"agent:{name}", lambda: _agent_block(agent))
+    return common, schema, specialty
+
+
+def agent_prompt(agent: dict, tables: dict, cubes, fact) -> str:
+    """The system prompt of a domain agent (the AGENT spec of its module); its code cache entries are keyed by it."""
+    (common, _), (schema, _), (specialty, _) = _agent_blocks(agent, tables, cubes, fact)
+    return f"{common}\n{schema}\n\n{specialty}\n"
+
+
+def agent_messages(agent: dict, user_input: str, tables: dict, cubes, fact) -> list:
+    """System and human messages for one domain agent's pandas-code request."""
+    (_, common_tokens), (_, schema_tokens), (_, specialty_tokens) = _agent_blocks(agent, tables, cubes, fact)
+    _, full_schema_tokens = _assembler.block(schema_hash(tables), "schema:all",
+                                             lambda: _schema_block(tables, cubes, fact, list(TABLE_SCHEMAS), compact=False))
+
+    question = f"Question: {user_input}"
+    question_tokens = _assembler.count_tokens(question)
+    stable_tokens = common_tokens + specialty_tokens + question_tokens
+    _assembler.track(agent["name"], stable_tokens + schema_tokens, stable_tokens + full_schema_tokens)
+    return [SystemMessage(content=agent_prompt(agent, tables, cubes, fact)), HumanMessage(content=question)]
+
+
+def cached_block(fingerprint: str, name: str, build) -> str:
+    """A prompt block rendered by `build()` once per `fingerprint`, e.g. the schema or data version it shows."""
+    return _assembler.block(fingerprint, name, build)[0]
+
+
+def track_prompt(name: str, messages: list):
+    """Counts the prompt tokens of messages assembled outside agent_messages."""
+    _assembler.track(name, sum(_assembler.count_tokens(message.content) for message in messages))
+
+
+def record_usage(name: str, response):
+    _assembler.record_usage(name, response)
+
+
+def prompt_stats() -> dict:
+    """Per agent: requests, prompt tokens sent, tokens the untrimmed prompts would have used, and provider-cached tokens."""
+    return _assembler.stats()
@@ -0,0 +1,219 @@
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from agents.lazy_result import LazyResult
+
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", ".cache/results")
+
+_META_FILE = "meta.json"
+_DATA_FILE = "result.parquet"
+_PLOT_FILE = "plot.png"
+
+
+def normalize_question(question: str) -> str:
+    """Lower-cases a question and strips punctuation and repeated whitespace."""
+    text = re.sub(r"[^\w\s]", " ", question.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_cache_key(question: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{normalize_question(question)}\0{fingerprint}".encode()).hexdigest()[:32]
+
+
+def local_embedder(model_name: str = "all-MiniLM-L6-v2"):
+    """
+    Returns an embedding function backed by a local sentence-transformers model,
+    for near-duplicate matching without any network calls.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    return lambda text: model.encode(text, normalize_embeddings=True)
+
+
+class ResultCache:
+    """
+    Persistent cache of run_agent_chain results, keyed by the normalized question
+    and the data fingerprint. Each entry is a directory holding the JSON metadata
+    (intent, answer, summary), the result frame as Parquet and the rendered plot.
+    An entry can also record the checksums of the tables its answer was computed
+    from; it is then invalidated only when one of those tables changes, e.g.
+    when rows are appended to it (see agents.ingest), not when any table does.
+
+    Entries are evicted least-recently-used beyond `max_entries` and expire after
+    `ttl_seconds`. When `embed_fn` is given, a miss on the exact key falls back to
+    the most similar cached question for the same data version, if its cosine
+    similarity reaches `similarity_threshold`.
+    """
+
+    def __init__(self, cache_dir: str = RESULT_CACHE_DIR, max_entries: int = 500,
+                 ttl_seconds: float = 24 * 3600, embed_fn=None, similarity_threshold: float = 0.92):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.metrics = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                        "invalidations": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            try:
+                with open(os.path.join(self.cache_dir, key, _META_FILE)) as fh:
+                    entries.append((key, json.load(fh)))
+            except (OSError, ValueError):
+                continue
+        for key, meta in sorted(entries, key=lambda item: item[1].get("last_access", 0)):
+            self._entries[key] = meta
+
+    def _path(self, key: str, name: str = "") -> str:
+        return os.path.join(self.cache_dir, key, name)
+
+    def _drop(self, key: str):
+        self._entries.pop(key, None)
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def _expired(self, meta: dict) -> bool:
+        return self.ttl_seconds is not None and time.time() - meta["created_at"] > self.ttl_seconds
+
+    @staticmethod
+    def _stale(meta: dict, checksums: dict) -> bool:
+        if checksums is None:
+            return False
+        depends_on = meta.get("depends_on")
+        if depends_on is None:
+            return True
+        return any(checksums.get(name) != checksum for name, checksum in depends_on.items())
+
+    def _find_similar(self, question: str, fingerprint: str):
+        vector = np.asarray(self.embed_fn(normalize_question(question)), dtype=np.float32)
+        best_key, best_score = None, self.similarity_threshold
+        for key, meta in self._entries.items():
+            if meta.get("fingerprint") != fingerprint or not meta.get("embedding"):
+                continue
+            other = np.asarray(meta["embedding"], dtype=np.float32)
+            score = float(vector @ other / (np.linalg.norm(vector) * np.linalg.norm(other) or 1.0))
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, question: str, fingerprint: str, checksums: dict = None):
+        """
+        Returns the cached result dict (with its `cache_key`), or None on a miss.
+        With `checksums` (table name -> current checksum), an entry computed from
+        an older version of one of its tables is dropped.
+        """
+        key = make_cache_key(question, fingerprint)
+        with self._lock:
+            semantic = False
+            if key not in self._entries and self.embed_fn is not None:
+                key = self._find_similar(question, fingerprint) or key
+                semantic = key in self._entries
+
+            meta = self._entries.get(key)
+            if meta is not None and self._expired(meta):
+                self._drop(key)
+                self.metrics["expirations"] += 1
+                meta = None
+            if meta is not None and self._stale(meta, checksums):
+                self._drop(key)
+                self.metrics["invalidations"] += 1
+                meta = None
+            if meta is None:
+                self.metrics["misses"] += 1
+                return None
+
+            data = None
+            if meta.get("has_data"):
+                try:
+                    data = LazyResult.from_parquet(self._path(key, _DATA_FILE))
+                except (OSError, ValueError) as e:
+                    print(f"Result cache entry {key} is unreadable, dropping it. Error: {e}")
+                    self._drop(key)
+                    self.metrics["misses"] += 1
+                    return None
+
+            meta["last_access"] = time.time()
+            self._entries.move_to_end(key)
+            self.metrics["semantic_hits" if semantic else "hits"] += 1
+
+        result = dict(meta["result"])
+        result["data"] = data
+        result["cache_key"] = key
+        return result
+
+    def put(self, question: str, fingerprint: str, result: dict, depends_on: dict = None) -> str:
+        """Stores a run_agent_chain result, computed from the tables in `depends_on` (name -> checksum), and returns its cache key."""
+        key = make_cache_key(question, fingerprint)
+        data = result.get("data")
+        meta = {
+            "question": question,
+            "fingerprint": fingerprint,
+            "depends_on": depends_on,
+            "created_at": time.time(),
+            "last_access": time.time(),
+            "has_data": isinstance(data, (pd.DataFrame, LazyResult)),
+            "result": {k: v for k, v in result.items() if k not in ("data", "cache_key")},
+        }
+        if self.embed_fn is not None:
+            meta["embedding"] = [float(x) for x in self.embed_fn(normalize_question(question))]
+
+        with self._lock:
+            os.makedirs(self._path(key), exist_ok=True)
+            if meta["has_data"]:
+                try:
+                    data = data if isinstance(data, LazyResult) else LazyResult(data)
+                    data.to_parquet(self._path(key, _DATA_FILE))
+                except Exception as e:
+                    print(f"Result frame could not be cached as Parquet. Error: {e}")
+                    shutil.rmtree(self._path(key), ignore_errors=True)
+                    return key
+            with open(self._path(key, _META_FILE), "w") as fh:
+                json.dump(meta, fh)
+
+            self._entries[key] = meta
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.metrics["evictions"] += 1
+        return key
+
+    def get_plot(self, key: str):
+        """Returns the cached PNG for an entry as a BytesIO, or None."""
+        try:
+            with open(self._path(key, _PLOT_FILE), "rb") as fh:
+                return io.BytesIO(fh.read())
+        except OSError:
+            return None
+
+    def put_plot(self, key: str, image: io.BytesIO):
+        if key not in self._entries:
+            return
+        with open(self._path(key, _PLOT_FILE), "wb") as fh:
+            fh.write(image.getvalue())
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        lookups = self.metrics["hits"] + self.metrics["semantic_hits"] + self.metrics["misses"]
+        hit_rate = (self.metrics["hits"] + self.metrics["semantic_hits"]) / lookups if lookups else 0.0
+        return {**self.metrics, "entries": len(self._entries), "hit_rate": round(hit_rate, 3)}
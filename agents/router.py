@@ -0,0 +1,160 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+LABELED_QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), "router_questions.json")
+
+# Below this confidence the question is sent through the LLM agent instead.
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.8"))
+
+# Strong single-word signals for each tool, added on top of the classifier's
+# log-probabilities. Tokens are matched after _tokenize's plural stripping.
+TOOL_KEYWORDS = {
+    "customer_query_tool": {"customer", "city", "cities", "zip", "demographic", "live"},
+    "order_query_tool": {"order", "status", "canceled", "cancelled", "purchase", "purchased", "revenue", "month", "monthly", "year", "busiest"},
+    "payment_query_tool": {"payment", "paid", "pay", "credit", "debit", "voucher", "boleto", "wallet", "installment", "method"},
+    "product_query_tool": {"product", "category", "categorie", "weight", "heavier", "dimension", "length", "width", "height", "selling"},
+    "logistics_query_tool": {"delivery", "deliverie", "delivered", "shipping", "shipped", "ship", "late", "fulfillment", "seller", "carrier", "estimated", "logistic"},
+}
+KEYWORD_WEIGHT = 2.5
+
+PLOT_WORDS = {"plot", "graph", "chart", "visualize", "visualise", "draw", "histogram", "trend"}
+BOTH_PATTERN = re.compile(r"\b(and also|along with|as well as|with a (chart|graph|plot))\b|\b(data|table|list)\b.*\b(plot|graph|chart)\b")
+SIMPLE_PATTERN = re.compile(r"^(how many|how much|what is the (average|total|count|number|mean|median|percentage)|which( \w+){1,2} (has|is)|what was|percentage of|is there|are there)\b")
+
+
+class Route(NamedTuple):
+    tool: str
+    confidence: float
+    show_data: bool
+    show_plot: bool
+    intent_confident: bool
+
+    @property
+    def tool_confident(self) -> bool:
+        return self.confidence >= ROUTER_CONFIDENCE
+
+
+def _tokenize(text: str):
+    tokens = re.findall(r"[a-z]+", text.lower())
+    return [t[:-1] if len(t) > 3 and t.endswith("s") and not t.endswith("ss") else t for t in tokens]
+
+
+class QuestionRouter:
+    """
+    Picks a data tool and the show_data/show_plot intent for a question without
+    calling the LLM: a multinomial naive Bayes classifier trained on the labeled
+    question set, boosted by per-tool keywords, plus regex rules for intent.
+    """
+
+    def __init__(self, labeled: list):
+        self.tools = sorted(TOOL_KEYWORDS)
+        self._word_counts = {tool: Counter() for tool in self.tools}
+        self._doc_counts = Counter()
+        for item in labeled:
+            self._doc_counts[item["tool"]] += 1
+            self._word_counts[item["tool"]].update(_tokenize(item["question"]))
+        self._vocab = set().union(*self._word_counts.values())
+        self._totals = {tool: sum(counts.values()) for tool, counts in self._word_counts.items()}
+
+    def _tool_scores(self, tokens: list) -> dict:
+        n_docs = sum(self._doc_counts.values())
+        vocab_size = len(self._vocab) + 1
+        scores = {}
+        for tool in self.tools:
+            score = math.log((self._doc_counts[tool] + 1) / (n_docs + len(self.tools)))
+            counts, total = self._word_counts[tool], self._totals[tool]
+            for token in tokens:
+                score += math.log((counts[token] + 1) / (total + vocab_size))
+                if token in TOOL_KEYWORDS[tool]:
+                    score += KEYWORD_WEIGHT
+            scores[tool] = score
+        return scores
+
+    @staticmethod
+    def classify_intent(question: str):
+        """Returns (show_data, show_plot, confident) from surface patterns alone."""
+        text = question.lower().strip()
+        wants_plot = bool(PLOT_WORDS & set(_tokenize(text)))
+        if wants_plot and BOTH_PATTERN.search(text):
+            return True, True, True
+        if wants_plot:
+            return False, True, True
+        if SIMPLE_PATTERN.search(text):
+            return False, False, True
+        if re.match(r"^(list|show|give|top|which \w+ (placed|with)|\w+ by )", text) or " by " in text or " per " in text:
+            return True, False, True
+        return True, False, False
+
+    def route(self, question: str) -> Route:
+        scores = self._tool_scores(_tokenize(question))
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        normalizer = sum(math.exp(score - top) for score in scores.values())
+        show_data, show_plot, intent_confident = self.classify_intent(question)
+        return Route(best, 1.0 / normalizer, show_data, show_plot, intent_confident)
+
+
+def load_labeled_questions(path: str = LABELED_QUESTIONS_PATH) -> list:
+    with open(path) as fh:
+        return json.load(fh)
+
+
+_router = None
+
+
+def route_question(question: str) -> Route:
+    """Routes a question with the router trained on the bundled labeled set."""
+    global _router
+    if _router is None:
+        _router = QuestionRouter(load_labeled_questions())
+    return _router.route(question)
+
+
+def evaluate_router(labeled: list = None, threshold: float = ROUTER_CONFIDENCE) -> dict:
+    """
+    Leave-one-out accuracy of the router on a labeled question set. `coverage`
+    is the share of questions answered without the LLM at `threshold`, and the
+    `fast_path_*` accuracies are measured on that share only.
+    """
+    labeled = labeled if labeled is not None else load_labeled_questions()
+    stats = defaultdict(int)
+    confusion = defaultdict(Counter)
+    for i, item in enumerate(labeled):
+        router = QuestionRouter(labeled[:i] + labeled[i + 1:])
+        route = router.route(item["question"])
+        tool_ok = route.tool == item["tool"]
+        intent_ok = (route.show_data, route.show_plot) == (item["show_data"], item["show_plot"])
+        confusion[item["tool"]][route.tool] += 1
+        stats["tool_correct"] += tool_ok
+        stats["intent_correct"] += intent_ok
+        if route.confidence >= threshold:
+            stats["fast_path"] += 1
+            stats["fast_path_tool_correct"] += tool_ok
+        if route.intent_confident:
+            stats["intent_fast_path"] += 1
+            stats["intent_fast_path_correct"] += intent_ok
+
+    total = len(labeled)
+    return {
+        "questions": total,
+        "tool_accuracy": stats["tool_correct"] / total,
+        "intent_accuracy": stats["intent_correct"] / total,
+        "coverage": stats["fast_path"] / total,
+        "fast_path_tool_accuracy": stats["fast_path_tool_correct"] / max(stats["fast_path"], 1),
+        "intent_coverage": stats["intent_fast_path"] / total,
+        "fast_path_intent_accuracy": stats["intent_fast_path_correct"] / max(stats["intent_fast_path"], 1),
+        "confusion": {tool: dict(counts) for tool, counts in confusion.items()},
+    }
+
+
+if __name__ == "__main__":
+    report = evaluate_router()
+    confusion = report.pop("confusion")
+    for name, value in report.items():
+        print(f"{name:>26}: {value:.3f}" if isinstance(value, float) else f"{name:>26}: {value}")
+    for tool, counts in confusion.items():
+        print(f"{tool:>26}: {counts}")
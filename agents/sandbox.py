@@ -0,0 +1,504 @@
+import atexit
+import contextlib
+import io
+import math
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import uuid
+import warnings
+import weakref
+
+import pandas as pd
+
+from agents.aggregates import get_cubes
+from agents.chart_templates import PLOT_DPI
+from agents.code_cache import code_cache
+from agents.code_rewrite import optimize_code
+from agents.fact_table import get_order_lines
+from agents.lazy_result import LazyResult
+from agents.plot_reduce import FastSeaborn
+from agents.shared_tables import attach_tables, note_reads, table_views, tables_read
+from agents.table_schema import TABLE_SCHEMAS
+from agents.table_store import DATA_DIR, STORE_DIR, data_fingerprint
+from agents.timing import stage
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - frames fall back to pickle
+    pa = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - no rlimits on Windows; only the wall-clock limit applies
+    resource = None
+
+# Number of worker processes started by start_sandbox(); 0 keeps every exec in-process.
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", str(min(2, os.cpu_count() or 1))))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "30"))
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "30"))
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))
+SANDBOX_WARMUP_TIMEOUT = float(os.getenv("SANDBOX_WARMUP_TIMEOUT", "300"))
+# Results longer than this many rows are written to Parquet by the worker and
+# read back lazily instead of being shipped whole (None: the system temp dir).
+SANDBOX_INLINE_ROWS = int(os.getenv("SANDBOX_INLINE_ROWS", "10000"))
+SANDBOX_RESULT_DIR = os.getenv("SANDBOX_RESULT_DIR")
+
+# pyplot keeps one global "current figure", so only one LLM-written plot may
+# render at a time per process. Workers are separate processes and render in
+# parallel; chart templates use standalone Figures and need no lock.
+_pyplot_lock = threading.Lock()
+
+
+class SandboxError(RuntimeError):
+    """Generated code was stopped by a sandbox limit, or its worker died."""
+
+
+class SandboxUnavailable(SandboxError):
+    """
+    Every worker stayed busy for the whole wait. This depends on load, not on
+    the code, so the same code may succeed when retried.
+    """
+
+
+class SandboxTimeout(SandboxError):
+    """Generated code ran past the wall-clock limit; its worker was killed."""
+
+
+def code_failure(error: Exception) -> bool:
+    """
+    Whether `error` came from the generated code itself, so running it again
+    would fail the same way. Timeouts, CPU and memory limits and crashed
+    workers count; only a busy pool (or the host running out of memory for
+    in-process code) does not.
+    """
+    return not isinstance(error, (SandboxUnavailable, MemoryError))
+
+
+def code_namespace(tables: dict, cubes, fact) -> dict:
+    """The variables generated pandas code runs against: tables, aggregate views and order_lines."""
+    views = table_views(tables)
+    local_vars = {'pd': pd}
+    for name in TABLE_SCHEMAS:
+        local_vars[name] = local_vars[name.upper()] = views.get(name)
+    local_vars.update(table_views(cubes.views()))
+    if fact is not None:
+        order_lines = fact.frame.copy(deep=False)
+        local_vars.update({'order_lines': order_lines, 'ORDER_LINES': order_lines, 'find_order_lines': fact.lookup})
+    return local_vars
+
+
+def _exec_query(code: str, tables: dict, cubes, fact):
+    local_vars = code_namespace(tables, cubes, fact)
+    exec(code_cache.compile(code), {'pd': pd}, local_vars)
+    return local_vars.get('result')
+
+
+def _render_plot(df: pd.DataFrame, code: str):
+    """Executes plotting code against `df` and returns the PNG as a BytesIO, or an error string."""
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import seaborn as sns
+
+    with _pyplot_lock:
+        existing = set(plt.get_fignums())
+        try:
+            plt.figure(figsize=(10, 6))
+            local_vars = {"df": df, "plt": plt, "sns": FastSeaborn(sns), "np": np, "pd": pd}
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                exec(code, {}, local_vars)
+
+            fig = plt.gcf()
+            if not fig.axes or all(not ax.has_data() for ax in fig.axes):
+                return "{\"error\":\"Generated code did not produce a plot.\"}"
+
+            # One layout pass; bbox_inches="tight" would draw the figure twice.
+            buf = io.BytesIO()
+            fig.tight_layout()
+            fig.savefig(buf, format="png", dpi=PLOT_DPI)
+            buf.seek(0)
+            return buf
+
+        except Exception as e:
+            return f"{{\"error\":\"Could not generate valid plot code. Details: {e}\"}}"
+        finally:
+            for number in set(plt.get_fignums()) - existing:
+                plt.close(number)
+
+
+def _encode_frame(df: pd.DataFrame):
+    """Arrow IPC stream bytes, or a pickle for frames Arrow cannot represent (e.g. mixed object columns)."""
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df)
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return "arrow", sink.getvalue().to_pybytes()
+        except (pa.ArrowException, TypeError, ValueError):
+            pass
+    return "pickle", pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_frame(encoding: str, payload: bytes) -> pd.DataFrame:
+    if encoding == "arrow":
+        return pa.ipc.open_stream(payload).read_all().to_pandas()
+    return pickle.loads(payload)
+
+
+def _encode_result(result, path: str = None):
+    """
+    The reply for a query's `result`. Frames longer than SANDBOX_INLINE_ROWS are
+    written to the Parquet file `path` (their index as columns), when given.
+    """
+    if result is None:
+        return ("none",)
+    if isinstance(result, pd.Series):
+        result = result.reset_index()
+    if isinstance(result, pd.DataFrame):
+        # A few rows of a key column would otherwise ship the key's full shared dictionary.
+        trimmed = {
+            col: result[col].cat.remove_unused_categories()
+            for col, dtype in result.dtypes.items()
+            if isinstance(dtype, pd.CategoricalDtype) and len(dtype.categories) > len(result)
+        }
+        result = result.assign(**trimmed) if trimmed else result
+        if path is not None and len(result) > SANDBOX_INLINE_ROWS:
+            try:
+                flat = result if isinstance(result.index, pd.RangeIndex) else result.reset_index()
+                LazyResult(flat).to_parquet(path)
+                return ("parquet", path)
+            except (pa.ArrowException, TypeError, ValueError):
+                _remove_file(path)  # e.g. mixed object columns; shipped inline below
+        return ("frame", *_encode_frame(result))
+    return ("value", str(result))
+
+
+_result_dir = None
+_result_dir_lock = threading.Lock()
+
+
+def _results_dir() -> str:
+    """The process-wide directory workers write large results to, removed at exit."""
+    global _result_dir
+    with _result_dir_lock:
+        if _result_dir is None:
+            _result_dir = tempfile.mkdtemp(prefix="sandbox-results-", dir=SANDBOX_RESULT_DIR)
+            atexit.register(shutil.rmtree, _result_dir, True)
+        return _result_dir
+
+
+def _remove_file(path: str):
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+
+def _parquet_result(path: str) -> LazyResult:
+    """A LazyResult over a worker's result file; the file is removed once the result is collected."""
+    lazy = LazyResult.from_parquet(path)
+    weakref.finalize(lazy, _remove_file, path)
+    return lazy
+
+
+def _vm_bytes() -> int:
+    with open("/proc/self/statm") as fh:
+        return int(fh.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _apply_limits(cpu_seconds: int, memory_mb: int):
+    """Caps the next job's CPU time and address-space growth relative to what the worker already uses."""
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime) + cpu_seconds
+    if hard == resource.RLIM_INFINITY or soft <= hard:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        soft = _vm_bytes() + memory_mb * 1024 * 1024
+        if hard == resource.RLIM_INFINITY or soft <= hard:
+            resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+    except (OSError, ValueError):
+        pass
+
+
+def _worker_main(conn, data_dir: str, store_dir: str, cpu_seconds: int, memory_mb: int):
+    """Worker loop: attach the tables once, then execute jobs until the pipe closes."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import matplotlib
+    matplotlib.use("Agg")
+    try:
+        tables = attach_tables(data_dir, store_dir)
+        cubes, fact = get_cubes(tables), get_order_lines(tables)
+    except Exception as e:
+        conn.send(("failed", str(e)))
+        return
+    conn.send(("ready", data_fingerprint(tables)))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        _apply_limits(cpu_seconds, memory_mb)
+        try:
+            if job[0] == "query":
+                reply = _encode_result(_exec_query(job[1], tables, cubes, fact), job[2])
+            else:
+                plot = _render_plot(_decode_frame(*job[1]), job[2])
+                reply = ("value", plot) if isinstance(plot, str) else ("png", plot.getvalue())
+        except MemoryError:
+            reply = ("error", f"Generated code exceeded the {memory_mb} MB memory limit.")
+        except Exception as e:
+            reply = ("error", str(e))
+        conn.send(reply)
+
+
+class _Worker:
+    def __init__(self, ctx, args: tuple):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, *args), daemon=True)
+        self.process.start()
+        child.close()
+
+    def wait_ready(self, timeout: float) -> str:
+        if not self.conn.poll(timeout):
+            raise SandboxError("Sandbox worker did not start in time.")
+        try:
+            status, detail = self.conn.recv()
+        except EOFError:
+            raise SandboxError(f"Sandbox worker exited during start-up (exit code {self.process.exitcode}).")
+        if status != "ready":
+            raise SandboxError(f"Sandbox worker could not attach the tables: {detail}")
+        return detail
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pre-warmed worker processes that execute LLM-generated code. Each worker
+    attaches the memory-mapped tables (plus aggregate views and the order-line
+    fact table) once at start-up, so a job ships only the code and gets the result
+    back as Arrow IPC, or, past SANDBOX_INLINE_ROWS rows, as a Parquet file the
+    caller reads lazily. Every job runs under a wall-clock timeout and per-job CPU
+    and address-space limits; a worker that hits one is killed and replaced in the
+    background, so a runaway snippet costs at most `timeout` seconds.
+    """
+
+    def __init__(self, workers: int = SANDBOX_WORKERS, data_dir: str = DATA_DIR, store_dir: str = STORE_DIR,
+                 timeout: float = SANDBOX_TIMEOUT, cpu_seconds: int = SANDBOX_CPU_SECONDS,
+                 memory_mb: int = SANDBOX_MEMORY_MB):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.metrics = {"jobs": 0, "timeouts": 0, "crashes": 0, "replacements": 0}
+        self._metrics_lock = threading.Lock()
+        self.result_dir = _results_dir() if pa is not None else None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._args = (data_dir, store_dir, cpu_seconds, memory_mb)
+        self._idle = queue.Queue()
+        self._closed = False
+
+        started = [_Worker(self._ctx, self._args) for _ in range(workers)]
+        try:
+            fingerprints = {worker.wait_ready(SANDBOX_WARMUP_TIMEOUT) for worker in started}
+        except SandboxError:
+            for worker in started:
+                worker.kill()
+            raise
+        self.fingerprint = fingerprints.pop()
+        for worker in started:
+            self._idle.put(worker)
+
+    def _count(self, name: str):
+        with self._metrics_lock:
+            self.metrics[name] += 1
+
+    def stats(self) -> dict:
+        with self._metrics_lock:
+            return dict(self.metrics)
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        self._count("replacements")
+
+        def spawn():
+            if self._closed:
+                return
+            fresh = _Worker(self._ctx, self._args)
+            try:
+                fresh.wait_ready(SANDBOX_WARMUP_TIMEOUT)
+                self._idle.put(fresh)
+            except SandboxError as e:
+                warnings.warn(f"Could not replace a sandbox worker; the pool runs one short. Error: {e}", RuntimeWarning)
+                fresh.kill()
+
+        threading.Thread(target=spawn, daemon=True).start()
+
+    def _run(self, job: tuple):
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise SandboxUnavailable("All sandbox workers are busy.")
+        self._count("jobs")
+        try:
+            worker.conn.send(job)
+            if not worker.conn.poll(self.timeout):
+                self._count("timeouts")
+                self._replace(worker)
+                raise SandboxTimeout(f"Generated code exceeded the {self.timeout:g}s time limit.")
+            reply = worker.conn.recv()
+        except (EOFError, OSError):
+            self._count("crashes")
+            worker.process.join(1)
+            cpu_limited = worker.process.exitcode == -getattr(signal, "SIGXCPU", 0)
+            self._replace(worker)
+            if cpu_limited:
+                raise SandboxError("Generated code exceeded the CPU time limit.")
+            raise SandboxError(f"Generated code crashed its worker (exit code {worker.process.exitcode}).")
+        self._idle.put(worker)
+        if reply[0] == "error":
+            raise SandboxError(reply[1])
+        return reply
+
+    def run_query(self, code: str):
+        """
+        Executes agent code; returns `result` (a Series comes back reset to a
+        DataFrame, a long frame as a Parquet-backed LazyResult, scalars as str).
+        """
+        path = os.path.join(self.result_dir, f"{uuid.uuid4().hex}.parquet") if self.result_dir else None
+        try:
+            reply = self._run(("query", code, path))
+        except SandboxError:
+            if path is not None:
+                _remove_file(path)
+            raise
+        if reply[0] == "parquet":
+            return _parquet_result(reply[1])
+        if reply[0] == "frame":
+            return _decode_frame(reply[1], reply[2])
+        return reply[1] if reply[0] == "value" else None
+
+    def render_plot(self, df: pd.DataFrame, code: str):
+        reply = self._run(("plot", _encode_frame(df), code))
+        return io.BytesIO(reply[1]) if reply[0] == "png" else reply[1]
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with contextlib.suppress(OSError):
+                worker.conn.send(None)
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start_sandbox(workers: int = SANDBOX_WORKERS, **kwargs):
+    """Starts the process-wide SandboxPool (idempotent). Returns None when `workers` is 0 or start-up fails."""
+    global _pool
+    with _pool_lock:
+        if _pool is None and workers > 0:
+            try:
+                _pool = SandboxPool(workers, **kwargs)
+                atexit.register(_pool.close)
+            except (SandboxError, OSError) as e:
+                warnings.warn(f"Sandbox unavailable, running generated code in-process. Error: {e}", RuntimeWarning, stacklevel=2)
+        return _pool
+
+
+def refresh_sandbox():
+    """
+    Replaces the running pool with one whose workers attach the current store,
+    e.g. after rows were appended to it (see agents.ingest). Until the new
+    workers are ready, code for the new data version runs in-process.
+    """
+    global _pool
+    with _pool_lock:
+        old = _pool
+    if old is None:
+        return None
+    try:
+        fresh = SandboxPool(old.workers, *old._args[:2], timeout=old.timeout, cpu_seconds=old._args[2], memory_mb=old.memory_mb)
+    except (SandboxError, OSError) as e:
+        warnings.warn(f"Could not refresh the sandbox workers, keeping the old ones. Error: {e}", RuntimeWarning, stacklevel=2)
+        return old
+    atexit.register(fresh.close)
+    with _pool_lock:
+        _pool = fresh
+    old.close()
+    return fresh
+
+
+def stop_sandbox():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def sandbox_stats() -> dict:
+    pool = _pool
+    return pool.stats() if pool is not None else {}
+
+
+def _rows_read(code: str, tables: dict, fact) -> int:
+    """Rows of the tables (and order_lines) the code refers to by name."""
+    names = set(re.findall(r"[A-Za-z_]\w*", code))
+    rows = sum(len(df) for name, df in tables.items() if df is not None and (name in names or name.upper() in names))
+    if fact is not None and names & {"order_lines", "ORDER_LINES", "find_order_lines"}:
+        rows += len(fact.frame)
+    return rows
+
+
+def run_generated_code(code: str, tables: dict, cubes, fact):
+    """
+    Runs agent code and returns its `result`. The code is first optimized and
+    costed (see agents.code_rewrite), then run in the sandbox pool when one is
+    running on the same data version, otherwise in-process. In-process code has
+    no time, CPU or memory limit; only the rewriter's cost budget bounds it.
+    """
+    with stage("exec") as span:
+        code = optimize_code(code, tables, cubes, fact)
+        note_reads(tables_read(code, tables))
+        pool = _pool
+        if pool is not None and data_fingerprint(tables) == pool.fingerprint:
+            result = pool.run_query(code)
+        else:
+            result = _exec_query(code, tables, cubes, fact)
+        if span:
+            span.set(rows_in=_rows_read(code, tables, fact),
+                     rows_out=len(result) if isinstance(result, (pd.Series, pd.DataFrame, LazyResult)) else int(result is not None))
+        return result
+
+
+def render_plot_code(df: pd.DataFrame, code: str):
+    """Renders plotting code to a PNG BytesIO (or an error string), in the sandbox when one is running."""
+    pool = _pool
+    if pool is None:
+        return _render_plot(df, code)
+    try:
+        return pool.render_plot(df, code)
+    except SandboxError as e:
+        return f"{{\"error\":\"Could not generate valid plot code. Details: {e}\"}}"
@@ -0,0 +1,577 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+try:
+    from aiohttp import web
+except ImportError:  # pragma: no cover - the service needs aiohttp
+    web = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - Arrow responses need pyarrow
+    pa = None
+
+from agents.aggregates import get_cubes
+from agents.fact_table import get_order_lines
+from agents.graph_agent import arun_agent_chain, astream_agent_chain
+from agents.ingest import INGEST_INTERVAL, start_ingest_watcher
+from agents.lazy_result import PREVIEW_ROWS, LazyResult
+from agents.metrics import METRICS_PORT, metrics_text, start_metrics_server
+from agents.result_cache import ResultCache, normalize_question
+from agents.sandbox import sandbox_stats, start_sandbox
+from agents.shared_dataframe import get_stored_dataframe, result_store_stats, store_dataframe
+from agents.shared_llm import llm_stats
+from agents.shared_tables import attach_tables
+from agents.table_store import data_fingerprint, table_versions
+from agents.timing import collect_stages
+from agents.tools_registry import get_tools, preload_agents
+
+SERVICE_HOST = os.getenv("SERVICE_HOST", "0.0.0.0")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8000"))
+# Pipeline runs (questions, tool calls and plots) executing at once. Further
+# runs wait for a slot, at most SERVICE_MAX_QUEUE of them and for at most
+# SERVICE_QUEUE_TIMEOUT seconds; the others are turned away with a 503.
+SERVICE_MAX_CONCURRENT = int(os.getenv("SERVICE_MAX_CONCURRENT", "4"))
+SERVICE_MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", "32"))
+SERVICE_QUEUE_TIMEOUT = float(os.getenv("SERVICE_QUEUE_TIMEOUT", "30"))
+SERVICE_RETRY_AFTER = 2
+MAX_RESULTS = 512
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_TYPE = "application/x-ndjson"
+# Result frames handed out by the service share one namespace of the result
+# store; their ids are random, so one caller cannot guess another's.
+SERVICE_SESSION = "service"
+
+
+class Overloaded(Exception):
+    """No pipeline slot became free in time; answered with 503 and Retry-After."""
+
+
+class Limiter:
+    """Bounded concurrency with a bounded, time-limited queue in front of it."""
+
+    def __init__(self, max_concurrent: int = SERVICE_MAX_CONCURRENT, max_queue: int = SERVICE_MAX_QUEUE,
+                 timeout: float = SERVICE_QUEUE_TIMEOUT):
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.metrics = {"rejected": 0, "timeouts": 0}
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.metrics["rejected"] += 1
+            raise Overloaded(f"{self.waiting} requests are already waiting.")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise Overloaded(f"No slot became free within {self.timeout:g}s.")
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+
+class _Broadcast:
+    """The items of one async generator, replayed from the start to every subscriber."""
+
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def feed(self, items):
+        try:
+            async for item in items:
+                self.items.append(item)
+                self._notify()
+        finally:
+            self.finished = True
+            self._notify()
+
+    async def subscribe(self):
+        sent = 0
+        while True:
+            while sent < len(self.items):
+                yield self.items[sent]
+                sent += 1
+            if self.finished:
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first one runs, the
+    others await its result. The run is shielded, so it finishes for the
+    remaining callers even if the one that started it disconnects. Streams
+    are coalesced the same way, each caller receiving every item from the first.
+    """
+
+    def __init__(self):
+        self.metrics = {"runs": 0, "coalesced": 0}
+        self._inflight = {}
+        self._streams = {}
+
+    async def run(self, key, factory) -> tuple:
+        """Returns (result, whether it was shared from a run already in flight)."""
+        task = self._inflight.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.metrics["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            self.metrics["runs"] += 1
+        return await asyncio.shield(task), coalesced
+
+    def stream(self, key, factory) -> tuple:
+        """Returns (an async iterator over the items of `factory()`, whether it joined a stream in flight)."""
+        flight = self._streams.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.metrics["coalesced"] += 1
+        else:
+            flight = self._streams[key] = _Broadcast()
+            task = asyncio.ensure_future(flight.feed(factory()))
+            task.add_done_callback(lambda _: self._streams.pop(key, None))
+            self.metrics["runs"] += 1
+        return flight.subscribe(), coalesced
+
+
+def _frame_json(df: pd.DataFrame) -> dict:
+    return json.loads(df.to_json(orient="split", index=False, date_format="iso"))
+
+
+async def _prepend(first, rest):
+    yield first
+    async for item in rest:
+        yield item
+
+
+async def _in_thread(chunks):
+    """Iterates a blocking generator (e.g. Parquet-backed result chunks) off the event loop."""
+    done = object()
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+class QueryService:
+    """
+    The question pipeline behind an async HTTP API. Answers are JSON with a
+    first page of rows; full result tables stream as Arrow (or CSV) and charts
+    come back as PNG. At most `max_concurrent` pipeline runs execute at once,
+    and identical requests arriving while one is running share its result.
+    """
+
+    def __init__(self, tables: dict, cache: ResultCache = None, limiter: Limiter = None):
+        self.tables = tables
+        self.cache = cache
+        self.limiter = limiter or Limiter()
+        self.flights = SingleFlight()
+        self._results = OrderedDict()  # result_id -> {"question", "png" or "error"}
+
+    # Pipeline
+
+    async def ask(self, question: str, session_id: str = None, render_plot: bool = True) -> dict:
+        key = ("query", normalize_question(question), data_fingerprint(self.tables), render_plot)
+        record, coalesced = await self.flights.run(key, lambda: self._ask(question, session_id, render_plot))
+        return {**record, "coalesced": coalesced}
+
+    async def _ask(self, question: str, session_id: str, render_plot: bool) -> dict:
+        async with self.limiter.slot():
+            with collect_stages() as trace:
+                response = await arun_agent_chain(question, self.tables, cache=self.cache,
+                                                  render_plot=render_plot, session_id=session_id)
+        cached = any(span.name == "cache_lookup" and span.attrs.get("hit") for span in trace.spans)
+        record = await self._remember(question, response.get("data"), response.get("plot_image"))
+        record.update(
+            answer=response.get("answer"), summary=response.get("summary"),
+            show_data=bool(response.get("show_data")), plot=bool(response.get("plot")),
+            cached=cached, trace=trace.to_dict(),
+        )
+        return record
+
+    def stream(self, question: str, session_id: str = None, render_plot: bool = True) -> tuple:
+        """
+        The answer as events, each sent as soon as it is ready (see
+        astream_agent_chain): intent, data (with the first page of rows), summary
+        tokens, plot and done. Failures end the stream with an "error" event.
+        Returns (events, whether they are shared with a stream already running).
+        """
+        key = ("stream", normalize_question(question), data_fingerprint(self.tables), render_plot)
+        return self.flights.stream(key, lambda: self._stream(question, session_id, render_plot))
+
+    async def _stream(self, question: str, session_id: str, render_plot: bool):
+        result_id = None
+        try:
+            async with self.limiter.slot():
+                with collect_stages() as trace:
+                    async for event in astream_agent_chain(question, self.tables, cache=self.cache,
+                                                           render_plot=render_plot, session_id=session_id):
+                        kind = event["event"]
+                        if kind == "data":
+                            record = await self._remember(question, event["data"])
+                            result_id = record["result_id"]
+                            yield {"event": "data", "answer": event["answer"], **record}
+                        elif kind == "plot":
+                            yield self._plot_event(result_id, event["image"])
+                        elif kind == "done":
+                            response = event["response"]
+                            cached = any(span.name == "cache_lookup" and span.attrs.get("hit") for span in trace.spans)
+                            yield {"event": "done", "result_id": result_id, "answer": response.get("answer"),
+                                   "summary": response.get("summary"), "show_data": bool(response.get("show_data")),
+                                   "plot": bool(response.get("plot")), "cached": cached, "trace": trace.to_dict()}
+                        else:
+                            yield event
+        except Overloaded as e:
+            yield {"event": "error", "status": 503, "error": f"The service is busy. {e}"}
+        except Exception as e:
+            traceback.print_exc()
+            yield {"event": "error", "status": 500, "error": f"Error processing request: {e}"}
+
+    def _plot_event(self, result_id: str, image) -> dict:
+        """
+        The chart event: an error message inline, a PNG kept with the result for
+        GET /results/{id}/plot, or the PNG inline (base64) when there is no
+        result to keep it with, because it had no data or was already evicted.
+        """
+        if isinstance(image, str):
+            return {"event": "plot", "result_id": result_id, "error": image}
+        entry = self._results.get(result_id)
+        if entry is None:
+            return {"event": "plot", "result_id": result_id, "png": base64.b64encode(image.getvalue()).decode()}
+        entry["png"] = image.getvalue()
+        return {"event": "plot", "result_id": result_id}
+
+    async def run_tool(self, name: str, query: str, session_id: str = None) -> dict:
+        tools = {t.name: t for t in get_tools(self.tables, session_id)}
+        if name not in tools:
+            raise web.HTTPNotFound(text=json.dumps({"error": f"Unknown tool {name!r}."}), content_type="application/json")
+
+        async def call():
+            async with self.limiter.slot():
+                output = await tools[name].ainvoke({"query": query})
+            parsed = json.loads(output)
+            df = get_stored_dataframe(parsed["query_id"], session_id) if parsed.get("query_id") else None
+            record = await self._remember(query, df)
+            record["answer"] = parsed.get("answer")
+            return record
+
+        key = ("tool", name, normalize_question(query), data_fingerprint(self.tables))
+        record, coalesced = await self.flights.run(key, call)
+        return {**record, "coalesced": coalesced}
+
+    async def render_plot(self, df: pd.DataFrame, question: str, key):
+        """A chart of `df` for `question`: PNG bytes, or an error string. Requests with the same `key` are coalesced."""
+        from agents.plot_agent import agenerate_plot_from_llm, enrich_datetime_columns
+
+        async def draw():
+            async with self.limiter.slot():
+                image = await agenerate_plot_from_llm(enrich_datetime_columns(df), question)
+            return image if isinstance(image, str) else image.getvalue()
+
+        image, _ = await self.flights.run(key, draw)
+        return image
+
+    # Results
+
+    async def _remember(self, question: str, data, plot_image=None) -> dict:
+        """Keeps the result under a new id: its table in the result store, its chart here."""
+        result_id = uuid.uuid4().hex
+        entry = {"question": question}
+        if isinstance(plot_image, io.BytesIO):
+            entry["png"] = plot_image.getvalue()
+        elif isinstance(plot_image, str):
+            entry["error"] = plot_image
+        self._results[result_id] = entry
+        while len(self._results) > MAX_RESULTS:
+            self._results.popitem(last=False)
+
+        record = {"result_id": result_id, "rows": 0, "columns": [], "pages": 0, "page_size": PREVIEW_ROWS, "preview": None}
+        if data is not None:
+            record.update(await asyncio.to_thread(self._describe, result_id, data))
+        return record
+
+    @staticmethod
+    def _describe(result_id: str, data) -> dict:
+        """Stores the result table and returns its size and first page (reads Parquet-backed results, so off the loop)."""
+        data = data if isinstance(data, LazyResult) else LazyResult(data)
+        store_dataframe(result_id, data, SERVICE_SESSION)
+        return {"rows": len(data), "columns": [str(col) for col in data.columns], "pages": data.num_pages(),
+                "preview": _frame_json(data.page(0))}
+
+    def _data(self, result_id: str) -> LazyResult:
+        data = get_stored_dataframe(result_id, SERVICE_SESSION)
+        if data is None:
+            message = "This answer has no result table." if result_id in self._results else "Unknown or expired result."
+            raise web.HTTPNotFound(text=json.dumps({"error": message}), content_type="application/json")
+        return data
+
+    async def plot_for(self, result_id: str):
+        """The result's chart as PNG bytes (rendered on first request), or an error string."""
+        entry = self._results.get(result_id)
+        if entry is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": "Unknown or expired result."}), content_type="application/json")
+        if "png" not in entry and "error" not in entry:
+            frame = await asyncio.to_thread(self._data(result_id).to_frame)
+            image = await self.render_plot(frame, entry["question"], key=("plot", result_id))
+            entry["error" if isinstance(image, str) else "png"] = image
+        return entry.get("png") or entry["error"]
+
+    def stats(self) -> dict:
+        return {
+            "service": {"running": self.limiter.running, "waiting": self.limiter.waiting,
+                        **self.limiter.metrics, **self.flights.metrics},
+            "result_cache": self.cache.stats() if self.cache is not None else {},
+            "result_store": result_store_stats(),
+            "sandbox": sandbox_stats(),
+            "llm": llm_stats(),
+        }
+
+    # HTTP
+
+    async def handle_query(self, request):
+        body = await _json_body(request)
+        question = str(body.get("question") or "").strip()
+        if not question:
+            raise _bad_request("A non-empty `question` is required.")
+        record = await self.ask(question, body.get("session_id"), bool(body.get("plot", True)))
+
+        accept = request.headers.get("Accept", "")
+        if ARROW_TYPE in accept:
+            return await self._send_arrow(request, self._data(record["result_id"]))
+        if "image/png" in accept:
+            return _png_response(await self.plot_for(record["result_id"]))
+        if not body.get("debug"):
+            record = {k: v for k, v in record.items() if k != "trace"}
+        record["versions"] = table_versions(self.tables)
+        return web.json_response(record)
+
+    async def handle_stream(self, request):
+        """Streams the answer's events as newline-delimited JSON."""
+        body = await _json_body(request)
+        question = str(body.get("question") or "").strip()
+        if not question:
+            raise _bad_request("A non-empty `question` is required.")
+        events, coalesced = self.stream(question, body.get("session_id"), bool(body.get("plot", True)))
+        # Wait for the first event, so a full queue still gets a plain 503.
+        first = await anext(events)
+        if first["event"] == "error" and first["status"] == 503:
+            raise Overloaded(first["error"])
+        response = web.StreamResponse(headers={"Content-Type": NDJSON_TYPE})
+        await response.prepare(request)
+        async for event in _prepend(first, events):
+            if event["event"] == "done":
+                event = {**event, "coalesced": coalesced, "versions": table_versions(self.tables)}
+                if not body.get("debug"):
+                    event.pop("trace")
+            await response.write((json.dumps(event, default=str) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    async def handle_result(self, request):
+        data = self._data(request.match_info["result_id"])
+        fmt = request.query.get("format", "json")
+        page = _page_param(request)
+        if fmt == "csv":
+            response = web.StreamResponse(headers={"Content-Type": "text/csv",
+                                                   "Content-Disposition": "attachment; filename=result.csv"})
+            await response.prepare(request)
+            async for text in _in_thread(data.iter_csv()):
+                await response.write(text.encode())
+            await response.write_eof()
+            return response
+        if fmt == "arrow":
+            return await self._send_arrow(request, data, page)
+        frame = await asyncio.to_thread(data.page, page or 0)
+        return web.json_response({"rows": len(data), "page": page or 0, **_frame_json(frame)})
+
+    async def handle_plot(self, request):
+        return _png_response(await self.plot_for(request.match_info["result_id"]))
+
+    async def handle_tool(self, request):
+        body = await _json_body(request)
+        query = str(body.get("query") or "").strip()
+        if not query:
+            raise _bad_request("A non-empty `query` is required.")
+        return web.json_response(await self.run_tool(request.match_info["name"], query, body.get("session_id")))
+
+    async def handle_render(self, request):
+        """Draws the Arrow IPC stream posted as the body, for the `question` query parameter."""
+        if pa is None:
+            raise web.HTTPNotImplemented(text="pyarrow is required to read Arrow bodies.")
+        question = request.query.get("question", "")
+        body = await request.read()
+        try:
+            frame = pa.ipc.open_stream(body).read_pandas()
+        except (pa.ArrowInvalid, OSError) as e:
+            raise _bad_request(f"The body is not an Arrow IPC stream: {e}")
+        key = ("plot", hashlib.sha256(body).hexdigest(), question)
+        return _png_response(await self.render_plot(frame, question, key=key))
+
+    async def handle_health(self, request):
+        return web.json_response({"status": "ok", "versions": table_versions(self.tables),
+                                  "rows": {name: len(df) for name, df in self.tables.items() if df is not None}})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    async def handle_metrics(self, request):
+        return web.Response(text=metrics_text(), content_type="text/plain")
+
+    async def _send_arrow(self, request, data: LazyResult, page: int = None):
+        """Streams all of `data`, or one page of it, as an Arrow IPC stream, batch by batch."""
+        if pa is None:
+            raise web.HTTPNotImplemented(text="pyarrow is required for Arrow responses.")
+        chunks = data.iter_chunks() if page is None else iter([data.page(page)])
+        # The first batch is converted before the response starts, so a
+        # failure can still be reported, and an empty result still has a schema.
+        first = await asyncio.to_thread(next, chunks, None)
+        batch = pa.RecordBatch.from_pandas(first if first is not None else data.slice(0, 0), preserve_index=False)
+        response = web.StreamResponse(headers={"Content-Type": ARROW_TYPE})
+        await response.prepare(request)
+        buffer = io.BytesIO()
+        writer = pa.ipc.new_stream(buffer, batch.schema)
+        writer.write_batch(batch)
+        async for chunk in _in_thread(chunks):
+            await response.write(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk, schema=batch.schema, preserve_index=False))
+        writer.close()
+        await response.write(buffer.getvalue())
+        await response.write_eof()
+        return response
+
+    def build_app(self):
+        if web is None:
+            raise ImportError("aiohttp is required to run the query service.")
+        app = web.Application(middlewares=[_errors], client_max_size=256 * 1024 ** 2)
+        app.add_routes([
+            web.post("/query", self.handle_query),
+            web.post("/query/stream", self.handle_stream),
+            web.get("/results/{result_id}", self.handle_result),
+            web.get("/results/{result_id}/plot", self.handle_plot),
+            web.post("/tools/{name}", self.handle_tool),
+            web.post("/plot", self.handle_render),
+            web.get("/healthz", self.handle_health),
+            web.get("/stats", self.handle_stats),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        return app
+
+
+def _bad_request(message: str):
+    return web.HTTPBadRequest(text=json.dumps({"error": message}), content_type="application/json")
+
+
+def _page_param(request):
+    """The `page` query parameter as a non-negative int, or None when absent."""
+    page = request.query.get("page")
+    if page is None:
+        return None
+    try:
+        page = int(page)
+    except ValueError:
+        raise _bad_request(f"`page` must be a non-negative integer, not {page!r}.")
+    if page < 0:
+        raise _bad_request(f"`page` must be a non-negative integer, not {page}.")
+    return page
+
+
+async def _json_body(request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise _bad_request("The body must be a JSON object.")
+    if not isinstance(body, dict):
+        raise _bad_request("The body must be a JSON object.")
+    return body
+
+
+def _png_response(image):
+    if isinstance(image, str):
+        return web.json_response({"error": image}, status=422)
+    return web.Response(body=image, content_type="image/png")
+
+
+if web is not None:
+    @web.middleware
+    async def _errors(request, handler):
+        try:
+            return await handler(request)
+        except web.HTTPException:
+            raise
+        except Overloaded as e:
+            return web.json_response({"error": f"The service is busy. {e}"}, status=503,
+                                     headers={"Retry-After": str(SERVICE_RETRY_AFTER)})
+        except Exception as e:
+            traceback.print_exc()
+            return web.json_response({"error": f"Error processing request: {e}"}, status=500)
+
+
+def create_service() -> QueryService:
+    """
+    Attaches the tables and starts what the pipeline runs next to: the
+    aggregate views, the order-line fact table, the sandbox pool, the delta
+    watcher (with INGEST_INTERVAL) and the metrics endpoint (with METRICS_PORT).
+    """
+    tables = attach_tables()
+    get_cubes(tables)
+    get_order_lines(tables)
+    start_sandbox()
+    if INGEST_INTERVAL:
+        start_ingest_watcher()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    # Import the agent and plotting modules ahead of the first question.
+    threading.Thread(target=preload_agents, daemon=True).start()
+    return QueryService(tables, ResultCache())
+
+
+def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, sock=None):
+    """Runs the service until interrupted; with `sock`, on that listening socket instead of host:port."""
+    app = create_service().build_app()
+    if sock is not None:
+        # Started from a background thread (see service_client.start_local_service).
+        web.run_app(app, sock=sock, handle_signals=False, print=None)
+    else:
+        web.run_app(app, host=host, port=port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless HTTP API for the e-commerce question pipeline.")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args()
+    serve(args.host, args.port)
@@ -0,0 +1,147 @@
+import base64
+import io
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - pages fall back to JSON
+    pa = None
+
+# Where the query service (python -m agents.service) listens. Empty: the app
+# starts one in its own process instead (see start_local_service).
+QA_SERVICE_URL = os.getenv("QA_SERVICE_URL", "").rstrip("/")
+SERVICE_TIMEOUT = float(os.getenv("SERVICE_TIMEOUT", "180"))
+
+ARROW_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class ServiceError(Exception):
+    """An error response from the query service; `retry_after` is set when it was busy (503)."""
+
+    def __init__(self, status: int, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class QAServiceClient:
+    """
+    Talks to the query service over HTTP with the standard library only, so a
+    UI process needs none of the pipeline's dependencies.
+    """
+
+    def __init__(self, base_url: str = QA_SERVICE_URL, timeout: float = SERVICE_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, method: str, path: str, body=None, accept: str = "application/json", params: dict = None):
+        url = self.base_url + path
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        data, headers = None, {"Accept": accept}
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            try:
+                message = json.loads(payload)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = payload.decode(errors="replace") or e.reason
+            retry_after = e.headers.get("Retry-After")
+            raise ServiceError(e.code, message, float(retry_after) if retry_after else None) from None
+
+    def _request(self, method: str, path: str, body=None, accept: str = "application/json", params: dict = None):
+        with self._open(method, path, body, accept, params) as response:
+            return response.headers.get("Content-Type", ""), response.read()
+
+    def _json(self, method: str, path: str, body=None, params: dict = None) -> dict:
+        return json.loads(self._request(method, path, body, params=params)[1])
+
+    def ask(self, question: str, session_id: str = None, plot: bool = True, debug: bool = False) -> dict:
+        """
+        The answer record: answer, summary, show_data, plot, result_id, rows,
+        pages and the first page as `preview`; with `debug`, the stage `trace`.
+        """
+        record = self._json("POST", "/query", {"question": question, "session_id": session_id,
+                                                "plot": plot, "debug": debug})
+        preview = record.get("preview")
+        record["preview"] = pd.DataFrame(preview["data"], columns=preview["columns"]) if preview else None
+        return record
+
+    def stream(self, question: str, session_id: str = None, plot: bool = True, debug: bool = False):
+        """
+        Yields the answer's events as the service sends them: "intent", "data"
+        (with the first page of rows as a `preview` DataFrame), "token" (summary
+        text), "plot" (with the chart as `image` or `error` when the service sent
+        it inline, otherwise fetch it with `plot(result_id)`) and "done".
+        An "error" event is raised as ServiceError.
+        """
+        body = {"question": question, "session_id": session_id, "plot": plot, "debug": debug}
+        with self._open("POST", "/query/stream", body, accept="application/x-ndjson") as response:
+            for line in response:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["event"] == "error":
+                    raise ServiceError(event["status"], event["error"])
+                if event["event"] == "data":
+                    preview = event.get("preview")
+                    event["preview"] = pd.DataFrame(preview["data"], columns=preview["columns"]) if preview else None
+                if event["event"] == "plot" and "png" in event:
+                    event["image"] = io.BytesIO(base64.b64decode(event.pop("png")))
+                yield event
+
+    def page(self, result_id: str, page: int = 0) -> pd.DataFrame:
+        """One page of a result's rows; as Arrow when pyarrow is installed, so dtypes survive."""
+        params = {"page": page, "format": "arrow" if pa is not None else "json"}
+        content_type, payload = self._request("GET", f"/results/{result_id}", accept=ARROW_TYPE, params=params)
+        if content_type.startswith(ARROW_TYPE):
+            return pa.ipc.open_stream(payload).read_pandas()
+        parsed = json.loads(payload)
+        return pd.DataFrame(parsed["data"], columns=parsed["columns"])
+
+    def plot(self, result_id: str):
+        """The result's chart as a PNG buffer, or the error message when it could not be drawn."""
+        try:
+            return io.BytesIO(self._request("GET", f"/results/{result_id}/plot", accept="image/png")[1])
+        except ServiceError as e:
+            if e.status == 422:
+                return str(e)
+            raise
+
+    def csv(self, result_id: str) -> bytes:
+        return self._request("GET", f"/results/{result_id}", accept="text/csv", params={"format": "csv"})[1]
+
+    def health(self) -> dict:
+        return self._json("GET", "/healthz")
+
+    def stats(self) -> dict:
+        return self._json("GET", "/stats")
+
+
+def start_local_service(host: str = "127.0.0.1", port: int = 0) -> str:
+    """
+    Runs the query service on a daemon thread of this process (on a free port
+    by default) and returns its URL, for running the app without a separate
+    service. The pipeline modules are only imported here.
+    """
+    from agents.service import serve
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    threading.Thread(target=serve, kwargs={"sock": sock}, daemon=True, name="query-service").start()
+    return f"http://{host}:{sock.getsockname()[1]}"
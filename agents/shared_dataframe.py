@@ -1,17 +1,138 @@
 import pandas as pd
+import os
 import re
+import threading
+import time
+from collections import OrderedDict
 
-_stored_dataframes = {}
+from agents.lazy_result import LazyResult
 
-def store_dataframe(query_id: str, df: pd.DataFrame):
+RESULT_STORE_MAX_MB = float(os.getenv("RESULT_STORE_MAX_MB", "256"))
+RESULT_STORE_TTL_SECONDS = float(os.getenv("RESULT_STORE_TTL_SECONDS", "3600"))
+RESULT_STORE_SPILL_DIR = os.getenv("RESULT_STORE_SPILL_DIR")
+
+DEFAULT_SESSION = "default"
+
+
+class ResultStore:
+    """
+    Holds the result frames produced by tool calls until run_agent_chain picks
+    them up. Frames are namespaced per session, bounded by a byte budget with
+    least-recently-used eviction, and expire after `ttl_seconds`. With a
+    `spill_dir`, evicted frames are written to Parquet and read back lazily
+    instead of being dropped. Frames may be DataFrames or LazyResults.
+    """
+
+    def __init__(self, max_bytes: float = RESULT_STORE_MAX_MB * 1e6, ttl_seconds: float = RESULT_STORE_TTL_SECONDS,
+                 spill_dir: str = RESULT_STORE_SPILL_DIR):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.bytes_held = 0
+        self.metrics = {"stores": 0, "hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "spills": 0, "spill_hits": 0}
+        self._entries = OrderedDict()  # (session, query_id) -> (df, nbytes, stored_at)
+        self._spilled = {}             # (session, query_id) -> (path, stored_at)
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key) -> str:
+        session, query_id = key
+        session = re.sub(r'\W+', '_', session)
+        return os.path.join(self.spill_dir, f"{session}__{query_id[:150]}.parquet")
+
+    def _evict(self, key):
+        df, nbytes, stored_at = self._entries.pop(key)
+        self.bytes_held -= nbytes
+        self.metrics["evictions"] += 1
+        if not self.spill_dir:
+            return
+        try:
+            path = self._spill_path(key)
+            (df if isinstance(df, LazyResult) else LazyResult(df)).to_parquet(path)
+            self._spilled[key] = (path, stored_at)
+            self.metrics["spills"] += 1
+        except Exception as e:
+            print(f"Could not spill result frame {key[1]} to disk. Error: {e}")
+
+    def _drop_spilled(self, key):
+        path, _ = self._spilled.pop(key)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _expire(self, now: float):
+        for key in [k for k, (_, _, stored_at) in self._entries.items() if now - stored_at > self.ttl_seconds]:
+            _, nbytes, _ = self._entries.pop(key)
+            self.bytes_held -= nbytes
+            self.metrics["expirations"] += 1
+        for key in [k for k, (_, stored_at) in self._spilled.items() if now - stored_at > self.ttl_seconds]:
+            self._drop_spilled(key)
+            self.metrics["expirations"] += 1
+
+    def put(self, query_id: str, df, session_id: str = None):
+        key = (session_id or DEFAULT_SESSION, query_id)
+        nbytes = (df if isinstance(df, LazyResult) else LazyResult(df)).nbytes
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self.bytes_held -= self._entries.pop(key)[1]
+            if key in self._spilled:
+                self._drop_spilled(key)
+            self._entries[key] = (df, nbytes, now)
+            self.bytes_held += nbytes
+            self.metrics["stores"] += 1
+            # Never evict the frame just stored: the caller is about to read it back.
+            while self.bytes_held > self.max_bytes and len(self._entries) > 1:
+                self._evict(next(iter(self._entries)))
+
+    def get(self, query_id: str, session_id: str = None):
+        key = (session_id or DEFAULT_SESSION, query_id)
+        with self._lock:
+            self._expire(time.time())
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return self._entries[key][0]
+            if key in self._spilled:
+                path, _ = self._spilled[key]
+                try:
+                    df = LazyResult.from_parquet(path)
+                    self.metrics["spill_hits"] += 1
+                    return df
+                except (OSError, ValueError) as e:
+                    print(f"Could not reload spilled result frame {query_id}. Error: {e}")
+                    self._drop_spilled(key)
+            self.metrics["misses"] += 1
+            return None
+
+    def clear_session(self, session_id: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == session_id]:
+                self.bytes_held -= self._entries.pop(key)[1]
+            for key in [k for k in self._spilled if k[0] == session_id]:
+                self._drop_spilled(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.metrics, "bytes_held": self.bytes_held, "entries": len(self._entries), "spilled": len(self._spilled)}
+
+
+_store = ResultStore()
+
+def store_dataframe(query_id: str, df, session_id: str = None):
     """Store a dataframe for later retrieval."""
-    global _stored_dataframes
-    _stored_dataframes[query_id] = df
+    _store.put(query_id, df, session_id)
 
-def get_stored_dataframe(query_id: str) -> pd.DataFrame:
+def get_stored_dataframe(query_id: str, session_id: str = None):
     """Retrieve a stored dataframe."""
-    global _stored_dataframes
-    return _stored_dataframes.get(query_id)
+    return _store.get(query_id, session_id)
+
+def result_store_stats() -> dict:
+    """Bytes held, entry counts, evictions and spills of the shared result store."""
+    return _store.stats()
 
 def make_query_id(prefix: str, query: str) -> str:
     """Generate a stable, clean ID for a query (alphanumeric + underscores)."""
@@ -1,22 +1,42 @@
-import os
-from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
+import threading
 
-load_dotenv()
 
-llm = AzureChatOpenAI(
-    openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-    openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    temperature=0,
-    max_tokens=2000,
-    openai_api_type="azure"
-)
+class _SharedLLM:
+    """
+    The LLM client every agent imports as `llm`. Importing it is free: the
+    langchain chat-model machinery (agents/llm_client.py) is loaded and the
+    ManagedChatModel built on the first attribute access, e.g. `llm.invoke`.
+    """
 
-__all__ = ["llm"]
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
 
+    def _get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from agents.llm_client import ManagedChatModel
 
+                    self._client = ManagedChatModel()
+        return self._client
 
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
 
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            super().__setattr__(name, value)
+        else:
+            setattr(self._get(), name, value)
 
+
+llm = _SharedLLM()
+
+
+def llm_stats() -> dict:
+    """Calls, errors, hedges, concurrency, tokens and latency percentiles of the shared LLM client."""
+    return llm.stats()
+
+
+__all__ = ["llm", "llm_stats"]
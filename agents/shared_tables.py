@@ -0,0 +1,96 @@
+import contextvars
+import re
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from agents.aggregates import CUBE_SPECS
+from agents.fact_table import FACT_SOURCES
+from agents.table_store import DATA_DIR, STORE_DIR, load_tables
+
+_attached = {}
+_attach_lock = threading.Lock()
+
+# The tables read by the code run for the current request (see track_reads).
+_reads = contextvars.ContextVar("table_reads", default=None)
+
+
+def use_copy_on_write():
+    """
+    Turns on pandas copy-on-write for this process. The shared tables depend on
+    it: a shallow view shares its column buffers until one side writes to a
+    column, and only that column is then copied, so every session reads the
+    same mapped tables without defensive `.copy()` calls while code that
+    mutates a view stays private. It is process-wide, and under it chained
+    assignment (`df["a"][mask] = v`) no longer writes through, so it is turned
+    on here, where the shared tables are handed out, rather than on import.
+    """
+    if not pd.get_option("mode.copy_on_write"):
+        pd.set_option("mode.copy_on_write", True)
+
+
+def attach_tables(data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> dict:
+    """
+    Returns the process-wide tables dict, mapping the on-disk store on first use.
+    All workers on a host map the same files, so the bulk of the data lives once
+    in the OS page cache however many workers are running.
+    """
+    use_copy_on_write()
+    key = (data_dir, store_dir)
+    with _attach_lock:
+        if key not in _attached:
+            _attached[key] = load_tables(data_dir, store_dir)
+        return _attached[key]
+
+
+def detach_tables():
+    """Forget the attached tables so the next attach_tables() maps the store again."""
+    with _attach_lock:
+        _attached.clear()
+
+
+def replace_tables(tables: dict, updated: dict):
+    """Swaps new versions of the tables into an attached tables dict, in one step, for every session holding it."""
+    with _attach_lock:
+        tables.update(updated)
+
+
+def table_views(tables: dict) -> dict:
+    """Per-request shallow views of the shared tables; writes to a view never reach the originals."""
+    use_copy_on_write()
+    return {name: df.copy(deep=False) for name, df in tables.items() if df is not None}
+
+
+def tables_read(code: str, tables: dict) -> set:
+    """The tables code (pandas or SQL) reads, directly or through order_lines and the aggregate views."""
+    names = set(re.findall(r"[A-Za-z_]\w*", code))
+    read = {name for name in tables if name in names or name.upper() in names}
+    if names & {"order_lines", "ORDER_LINES", "find_order_lines"}:
+        read |= FACT_SOURCES
+    for view, spec in CUBE_SPECS.items():
+        if view in names:
+            read |= {spec["source"]} | ({"orders"} if "prepare" in spec else set())
+    return read
+
+
+def note_reads(names: set):
+    """Records tables read on behalf of the current request, if track_reads() is collecting them."""
+    reads = _reads.get()
+    if reads is not None:
+        reads.update(names)
+
+
+@contextmanager
+def track_reads():
+    """
+    Collects the names of the tables read by the code run inside the block,
+    including asyncio tasks and worker threads started from it, so a cached
+    answer can be tied to the versions of exactly those tables.
+    """
+    reads = set()
+    token = _reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _reads.reset(token)
@@ -0,0 +1,185 @@
+import os
+import re
+import threading
+
+import pandas as pd
+from langchain.schema import SystemMessage, HumanMessage
+
+from agents.shared_llm import llm
+from agents.code_cache import code_cache, schema_hash
+from agents.lazy_result import LazyResult
+from agents.prompts import cached_block, record_usage, track_prompt
+from agents.shared_tables import note_reads, tables_read
+from agents.timing import stage
+
+try:
+    import duckdb
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - duckdb is optional
+    duckdb = pa = None
+
+# "pandas" (LLM-written pandas code, the default) or "sql" (LLM-written SQL run
+# by DuckDB). QUERY_ENGINE sets the default; QUERY_ENGINE_<AGENT>, e.g.
+# QUERY_ENGINE_PAYMENT=sql, overrides it for one agent.
+AGENT_ENGINES = {}
+SQL_THREADS = int(os.getenv("SQL_THREADS", str(os.cpu_count() or 1)))
+
+_READ_ONLY_SQL = re.compile(r"^\s*(with|select)\b", re.IGNORECASE)
+
+# One DuckDB database per data version, with every relation converted to Arrow
+# once. A connection is not safe to share between threads, so each statement
+# runs on its own cursor with the Arrow tables registered on it; the lock only
+# guards swapping the catalog when the data version changes.
+_catalog = {"key": None, "con": None, "arrow": None}
+_catalog_lock = threading.Lock()
+
+
+def engine_for(agent: str) -> str:
+    mode = AGENT_ENGINES.get(agent) or os.getenv(f"QUERY_ENGINE_{agent.upper()}") or os.getenv("QUERY_ENGINE", "pandas")
+    if mode == "sql" and duckdb is None:
+        return "pandas"
+    return mode
+
+
+def set_engine(agent: str, mode: str):
+    """Selects the query engine ("pandas" or "sql") for one agent at runtime."""
+    AGENT_ENGINES[agent] = mode
+
+
+def _schema_lines(relations: dict) -> str:
+    return "\n".join(
+        f"{name}({', '.join(f'{col} {dtype}' for col, dtype in df.dtypes.astype(str).items())})"
+        for name, df in relations.items()
+    )
+
+
+def sql_relations(tables: dict, cubes, fact) -> dict:
+    """The tables, aggregate views and order-line fact table, by the names the SQL prompt uses."""
+    relations = {name: df for name, df in tables.items() if df is not None}
+    relations.update(cubes.views())
+    if fact is not None:
+        relations["order_lines"] = fact.frame
+    return relations
+
+
+def _relations_key(relations: dict) -> tuple:
+    # Loaded tables carry their source checksum; derived frames (views, the fact
+    # table) are long-lived objects rebuilt per data version, so identity works.
+    return tuple(sorted((name, df.attrs.get("checksum") or id(df)) for name, df in relations.items()))
+
+
+def _cursor(relations: dict):
+    """A new cursor on the current data version's database, with every relation registered on it."""
+    key = _relations_key(relations)
+    with _catalog_lock:
+        if _catalog["key"] != key:
+            con = duckdb.connect()
+            con.execute(f"SET threads = {SQL_THREADS}")
+            con.execute("SET enable_external_access = false")
+            # Arrow tables, not the DataFrames: DuckDB would otherwise rebuild an
+            # ENUM from every large categorical's dictionary on each scan.
+            arrow = {name: pa.Table.from_pandas(df, preserve_index=False) for name, df in relations.items()}
+            _catalog.update(key=key, con=con, arrow=arrow)
+        con, arrow = _catalog["con"], _catalog["arrow"]
+    cursor = con.cursor()
+    for name, table in arrow.items():
+        cursor.register(name, table)
+    return cursor
+
+
+def _single_statement(sql: str) -> str:
+    """`sql` without one trailing `;`; raises ValueError unless it is exactly one SELECT/WITH statement."""
+    sql = sql.strip()
+    if sql.endswith(";"):
+        sql = sql[:-1]
+    if not _READ_ONLY_SQL.match(sql) or len(duckdb.extract_statements(sql)) != 1:
+        raise ValueError("Only a single SELECT/WITH statement may be executed.")
+    return sql
+
+
+def _sql_failure(error: Exception) -> bool:
+    """Whether the statement itself is at fault (not read-only, or invalid for these relations)."""
+    if isinstance(error, ValueError):
+        return True
+    return duckdb is not None and isinstance(error, (duckdb.ParserException, duckdb.BinderException,
+                                                     duckdb.CatalogException, duckdb.ConversionException))
+
+
+def run_sql(sql: str, relations: dict) -> pd.DataFrame:
+    """
+    Runs one read-only statement over the given DataFrames on its own cursor of
+    an in-process DuckDB database, so statements from concurrent requests run in
+    parallel. DuckDB pushes filters and projections into the scans, runs
+    multi-threaded and materializes only the result as a DataFrame.
+    """
+    sql = _single_statement(sql)
+    note_reads(tables_read(sql, relations))
+    with stage("exec", engine="sql") as span:
+        cursor = _cursor(relations)
+        try:
+            df = cursor.execute(sql).df()
+        finally:
+            cursor.close()
+        span.set(rows_out=len(df))
+        return df
+
+
+# Rules first and the schema next (re-rendered only when a column changes, not
+# when rows are appended), so requests from every agent share one stable
+# prompt prefix; only the last line names the domain.
+SQL_PROMPT = """
+You are a data analyst for an e-commerce dataset. You query the data with DuckDB SQL.
+
+CRITICAL INSTRUCTION: If the question asks for a plot, graph, chart or visualization, return an aggregated result ready for plotting (e.g. one category column and one value column). Otherwise return the detailed rows requested.
+
+RULES:
+1. Write exactly one SELECT (or WITH ... SELECT) statement; never modify data.
+2. Select only the columns you need and filter as early as possible.
+3. Return only the SQL, no explanations.
+
+`order_lines` is pre-joined: one row per order item with its order, product, customer and per-order payment totals; use it instead of joining those tables yourself. The `*_by_*` views are precomputed aggregates; prefer them whenever they answer the question.
+The following tables and views are available, with their columns and pandas dtypes:
+"""
+
+
+def _sql_messages(domain: str, user_input: str, relations: dict) -> list:
+    schema = cached_block(schema_hash(relations), "sql-schema", lambda: _schema_lines(relations))
+    system_prompt = f"{SQL_PROMPT}\n{schema}\n\nYou specialize in e-commerce {domain}.\n"
+    return [SystemMessage(content=system_prompt), HumanMessage(content=f"Question: {user_input}")]
+
+
+def handle_sql_query(agent: str, domain: str, user_input: str, relations: dict):
+    """
+    SQL counterpart of the handle_*_query functions: asks the LLM for one DuckDB
+    SELECT over `relations` and runs it. Returns (answer, df), or None when the
+    generation or execution fails so the caller can fall back to pandas.
+    """
+    messages = _sql_messages(domain, user_input, relations)
+    cache_key = code_cache.make_key(f"{agent}-sql", user_input, relations, messages[0].content)
+    cached = code_cache.lookup(cache_key)
+    if cached and cached["status"] == "failed":
+        return None
+
+    sql = None
+    try:
+        if cached:
+            sql = cached["code"]
+        else:
+            track_prompt(f"{agent}-sql", messages)
+            with stage("codegen"):
+                response = llm.invoke(messages)
+            record_usage(f"{agent}-sql", response)
+            sql = response.content.strip().replace("```sql", "").replace("```", "").strip().rstrip(";")
+        df_result = run_sql(sql, relations)
+        if not cached:
+            code_cache.store(cache_key, sql)
+    except Exception as e:
+        print(f"SQL engine failed for {agent} query, falling back to pandas. Error: {e}")
+        if sql is not None and _sql_failure(e):
+            code_cache.store_failure(cache_key, sql, e)
+        return None
+
+    if df_result.shape == (1, 1):
+        return str(df_result.iat[0, 0]), None
+    df_result = LazyResult.from_result(df_result)
+    return f"Found {len(df_result)} records matching your {agent} query.", df_result
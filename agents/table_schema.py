@@ -0,0 +1,230 @@
+import pandas as pd
+
+# Explicit, compact dtypes for every source CSV so pandas never has to infer them.
+# Columns missing from a file are simply skipped when the schema is applied.
+# Low-cardinality strings are categoricals, counts are int32 and physical
+# dimensions are float32; money stays float64 so sums keep their cents.
+TABLE_SCHEMAS = {
+    "customers": {
+        "file": "customers.csv",
+        "dtypes": {
+            "customer_id": "object",
+            "customer_zip_code_prefix": "int32",
+            "customer_city": "category",
+            "customer_state": "category",
+        },
+        "parse_dates": [],
+    },
+    "orders": {
+        "file": "orders.csv",
+        "dtypes": {
+            "order_id": "object",
+            "customer_id": "object",
+            "order_status": "category",
+        },
+        "parse_dates": [
+            "order_purchase_timestamp",
+            "order_approved_at",
+            "order_delivered_timestamp",
+            "order_estimated_delivery_date",
+        ],
+        "time_features": ["order_purchase_timestamp"],
+        "durations": {"delivery_days": ["order_purchase_timestamp", "order_delivered_timestamp"]},
+    },
+    "order_items": {
+        "file": "order_items.csv",
+        "dtypes": {
+            "order_id": "object",
+            "order_item_id": "int32",
+            "product_id": "object",
+            "seller_id": "category",
+            "price": "float64",
+            "shipping_charges": "float64",
+        },
+        "parse_dates": [],
+    },
+    "payments": {
+        "file": "payments.csv",
+        "dtypes": {
+            "order_id": "object",
+            "payment_sequential": "int32",
+            "payment_type": "category",
+            "payment_installments": "int32",
+            "payment_value": "float64",
+        },
+        "parse_dates": [],
+    },
+    "products": {
+        "file": "products.csv",
+        "dtypes": {
+            "product_id": "object",
+            "product_category_name": "category",
+            "product_weight_g": "float32",
+            "product_length_cm": "float32",
+            "product_height_cm": "float32",
+            "product_width_cm": "float32",
+        },
+        "parse_dates": [],
+    },
+}
+
+# ID columns shared between tables. They are encoded as one categorical dtype
+# per key across all tables, so every ID string is stored once and joins
+# compare integer codes instead of strings.
+KEY_COLUMNS = ["order_id", "customer_id", "product_id"]
+
+# Calendar parts derived once at load time for each "time_features" column,
+# named `<column><suffix>`. Weeks are ISO weeks, days of week run 0 (Monday)
+# to 6 and dates are midnight timestamps.
+TIME_FEATURE_SUFFIXES = ("_year", "_month", "_week", "_dayofweek", "_date")
+
+
+def _small_int(values: pd.Series, dtype: str) -> pd.Series:
+    """`values` as a compact integer dtype, nullable only when there are gaps."""
+    return values.astype(dtype.capitalize() if values.isna().any() else dtype)
+
+
+def time_features(times: pd.Series) -> dict:
+    """The TIME_FEATURE_SUFFIXES columns of one datetime column, keyed by name."""
+    name = times.name
+    return {
+        f"{name}_year": _small_int(times.dt.year, "int16"),
+        f"{name}_month": _small_int(times.dt.month, "int8"),
+        f"{name}_week": _small_int(times.dt.isocalendar().week.astype("float32"), "int8"),
+        f"{name}_dayofweek": _small_int(times.dt.dayofweek, "int8"),
+        f"{name}_date": times.dt.normalize(),
+    }
+
+
+def add_derived_columns(name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Adds a table's calendar features and durations (in float32 days) as declared in TABLE_SCHEMAS."""
+    schema = TABLE_SCHEMAS[name]
+    derived = {}
+    for col in schema.get("time_features", []):
+        if col in df.columns:
+            derived.update(time_features(df[col]))
+    for new_col, (start, end) in schema.get("durations", {}).items():
+        if start in df.columns and end in df.columns:
+            derived[new_col] = ((df[end] - df[start]) / pd.Timedelta(days=1)).astype("float32")
+    return df.assign(**derived) if derived else df
+
+
+def read_table_csv(name: str, path: str) -> pd.DataFrame:
+    """Read one source CSV with the explicit dtypes and derived columns declared in TABLE_SCHEMAS."""
+    schema = TABLE_SCHEMAS[name]
+    header = pd.read_csv(path, nrows=0).columns
+    raw_names = {col.strip(): col for col in header}
+
+    dtypes = {raw_names[col]: dtype for col, dtype in schema["dtypes"].items() if col in raw_names}
+    parse_dates = [raw_names[col] for col in schema["parse_dates"] if col in raw_names]
+
+    df = pd.read_csv(path, dtype=dtypes, parse_dates=parse_dates)
+    if df.empty:
+        # A header-only file (e.g. an empty delta) leaves the date columns untyped.
+        df = df.astype(dict.fromkeys(parse_dates, "datetime64[ns]"))
+    df.columns = df.columns.str.strip()
+    return add_derived_columns(name, df)
+
+
+def _extends(dtype, base: pd.CategoricalDtype) -> bool:
+    return isinstance(dtype, pd.CategoricalDtype) and dtype.categories[:len(base.categories)].equals(base.categories)
+
+
+def extend_categories(dtype: pd.CategoricalDtype, values) -> pd.CategoricalDtype:
+    """`dtype` with the unseen `values` appended, so codes of the existing categories stay valid."""
+    seen = pd.Index(pd.Series(values).dropna().astype("object").unique())
+    fresh = seen.difference(dtype.categories, sort=False)
+    if fresh.empty:
+        return dtype
+    return pd.CategoricalDtype(dtype.categories.append(fresh), ordered=dtype.ordered)
+
+
+def recode(col: pd.Series, dtype: pd.CategoricalDtype) -> pd.Series:
+    """`col` as categorical `dtype`; reuses the codes when dtype only extends the column's categories."""
+    if isinstance(col.dtype, pd.CategoricalDtype) and _extends(dtype, col.dtype):
+        return pd.Series(pd.Categorical.from_codes(col.cat.codes, dtype=dtype), index=col.index, name=col.name)
+    return col.astype(dtype)
+
+
+def align_categoricals(first: pd.DataFrame, second: pd.DataFrame) -> tuple:
+    """
+    Gives the categorical columns of `first` (e.g. loaded rows) and `second`
+    (rows appended to them) one dtype each, so concatenating the two keeps them
+    categorical: the dtype of `second` when it extends that of `first`,
+    otherwise the categories of `first` extended with the new values.
+    """
+    for col in first.columns.intersection(second.columns):
+        dtype, other = first[col].dtype, second[col].dtype
+        if not isinstance(dtype, pd.CategoricalDtype) or dtype == other:
+            continue
+        target = other if _extends(other, dtype) else extend_categories(dtype, second[col])
+        if target is not dtype:
+            first = first.assign(**{col: recode(first[col], target)})
+        if target is not other:
+            second = second.assign(**{col: recode(second[col], target)})
+    return first, second
+
+
+def _shared_dtype(columns: list) -> pd.CategoricalDtype:
+    """One dtype covering all `columns`: the longest of their categories when the others are its prefixes."""
+    dtypes = [col.dtype for col in columns]
+    if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+        longest = max(dtypes, key=lambda dtype: len(dtype.categories))
+        if all(_extends(longest, dtype) for dtype in dtypes):
+            return longest
+    values = pd.concat([col.astype("object") for col in columns], ignore_index=True)
+    return pd.CategoricalDtype(pd.Index(values.dropna().unique()))
+
+
+def intern_keys(tables: dict) -> dict:
+    """
+    Re-encode every KEY_COLUMNS column as a categorical shared by all tables
+    holding it. Tables appended to since the others were written (see
+    agents.ingest) only extend the shared categories, so their codes are reused.
+    """
+    for key in KEY_COLUMNS:
+        holders = [name for name, df in tables.items() if key in df.columns]
+        if not holders:
+            continue
+
+        columns = [tables[name][key] for name in holders]
+        shared = _shared_dtype(columns)
+        for name, col in zip(holders, columns):
+            tables[name][key] = recode(col, shared)
+    return tables
+
+
+def table_memory(df: pd.DataFrame, shared: set = frozenset()) -> int:
+    """Deep memory of a frame in bytes, not counting the categories of columns in `shared`."""
+    total = int(df.index.memory_usage())
+    for col in df.columns:
+        if col in shared and isinstance(df[col].dtype, pd.CategoricalDtype):
+            total += int(df[col].cat.codes.memory_usage(index=False))
+        else:
+            total += int(df[col].memory_usage(index=False, deep=True))
+    return total
+
+
+def memory_report(before: dict, after: dict) -> pd.DataFrame:
+    """
+    Compares the memory held by two versions of the tables dict. Shared key
+    dictionaries in `after` are reported once, on their own row.
+    """
+    rows = []
+    for name in after:
+        old = table_memory(before[name]) if name in before else 0
+        new = table_memory(after[name], set(KEY_COLUMNS))
+        rows.append({"table": name, "before_mb": old / 1e6, "after_mb": new / 1e6})
+
+    shared_bytes = 0
+    for key in KEY_COLUMNS:
+        holder = next((df for df in after.values() if key in df.columns), None)
+        if holder is not None and isinstance(holder[key].dtype, pd.CategoricalDtype):
+            shared_bytes += int(holder[key].cat.categories.memory_usage(deep=True))
+    rows.append({"table": "shared key dictionaries", "before_mb": 0.0, "after_mb": shared_bytes / 1e6})
+
+    report = pd.DataFrame(rows)
+    total = report[["before_mb", "after_mb"]].sum()
+    report.loc[len(report)] = {"table": "total", "before_mb": total["before_mb"], "after_mb": total["after_mb"]}
+    report["saved_pct"] = (1 - report["after_mb"] / report["before_mb"].where(report["before_mb"] > 0)) * 100
+    return report.round(2)
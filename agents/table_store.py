@@ -0,0 +1,357 @@
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import warnings
+
+import pandas as pd
+
+from agents.table_schema import (
+    KEY_COLUMNS, TABLE_SCHEMAS, extend_categories, intern_keys, memory_report, read_table_csv, recode,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = feather = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+DATA_DIR = "data"
+# Every app worker on a host should point at the same store directory so they
+# all map the same files and share their pages through the OS page cache.
+STORE_DIR = os.getenv("TABLE_STORE_DIR", os.path.join(DATA_DIR, ".store"))
+MANIFEST_FILE = "manifest.json"
+STORE_FORMAT_VERSION = 1
+
+
+def file_checksum(path: str) -> str:
+    """Return the sha256 hex digest of a file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schema_checksum() -> str:
+    """Hash of the table schemas, so a schema change also forces a rebuild."""
+    schema = {"tables": TABLE_SCHEMAS, "keys": KEY_COLUMNS}
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+def _read_manifest(store_dir: str) -> dict:
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path: str, write):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def _build_lock(store_dir: str):
+    """Exclusive lock so concurrently starting workers don't all rebuild the store."""
+    os.makedirs(store_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(store_dir, ".lock"), "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _map_table(path: str) -> pd.DataFrame:
+    """
+    Memory-maps one Arrow file. Numeric, datetime and categorical-code columns
+    stay read-only views over the mapped pages instead of being copied.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _source_entry(path: str, previous: dict = None) -> dict:
+    """Describe a source CSV; the checksum is reused when size and mtime are unchanged."""
+    stat = os.stat(path)
+    entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous.get(k) == v for k, v in entry.items()) and previous.get("sha256"):
+        entry["sha256"] = previous["sha256"]
+    else:
+        entry["sha256"] = file_checksum(path)
+    return entry
+
+
+def store_is_fresh(data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> bool:
+    """True when every table in the store was built from the current CSVs and schema."""
+    manifest = _read_manifest(store_dir)
+    if manifest.get("format_version") != STORE_FORMAT_VERSION or manifest.get("schema") != schema_checksum():
+        return False
+
+    built = manifest.get("tables", {})
+    for name, schema in TABLE_SCHEMAS.items():
+        entry = built.get(name)
+        if not entry or not os.path.exists(os.path.join(store_dir, entry["file"])):
+            return False
+        current = _source_entry(os.path.join(data_dir, schema["file"]), entry["source"])
+        if current["sha256"] != entry["source"]["sha256"]:
+            return False
+    return True
+
+
+def build_store(data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> dict:
+    """
+    Converts every source CSV into an uncompressed Feather (Arrow IPC) file with
+    explicit dtypes and shared key encodings, and records the source checksums
+    in a manifest.
+    """
+    if feather is None:
+        raise ImportError("pyarrow is required to build the columnar table store.")
+
+    os.makedirs(store_dir, exist_ok=True)
+    previous = _read_manifest(store_dir).get("tables", {})
+    sources, frames = {}, {}
+    for name, schema in TABLE_SCHEMAS.items():
+        source_path = os.path.join(data_dir, schema["file"])
+        sources[name] = _source_entry(source_path, previous.get(name, {}).get("source"))
+        frames[name] = read_table_csv(name, source_path)
+    intern_keys(frames)
+
+    tables = {}
+    for name, df in frames.items():
+        file_name = f"{name}.arrow"
+        _write_atomic(
+            os.path.join(store_dir, file_name),
+            lambda tmp: feather.write_feather(df, tmp, compression="uncompressed"),
+        )
+        tables[name] = {"file": file_name, "rows": len(df), "source": sources[name]}
+
+    manifest = {"format_version": STORE_FORMAT_VERSION, "schema": schema_checksum(), "tables": tables}
+
+    def write_manifest(tmp):
+        with open(tmp, "w") as fh:
+            json.dump(manifest, fh, indent=2)
+
+    _write_atomic(os.path.join(store_dir, MANIFEST_FILE), write_manifest)
+    return manifest
+
+
+def load_tables(data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> dict:
+    """
+    Loads all tables from the columnar store, rebuilding it first if any source
+    CSV changed. Falls back to typed CSV parsing when pyarrow is not installed.
+    """
+    if feather is None:
+        warnings.warn("pyarrow is not installed; reading the tables from CSV instead of the columnar store.", RuntimeWarning, stacklevel=2)
+        tables = {}
+        for name, schema in TABLE_SCHEMAS.items():
+            path = os.path.join(data_dir, schema["file"])
+            tables[name] = read_table_csv(name, path)
+            tables[name].attrs["checksum"] = tables[name].attrs["base"] = file_checksum(path)
+        return intern_keys(tables)
+
+    if not store_is_fresh(data_dir, store_dir):
+        with _build_lock(store_dir):
+            # Another worker may have finished the rebuild while we waited.
+            if not store_is_fresh(data_dir, store_dir):
+                build_store(data_dir, store_dir)
+
+    manifest = _read_manifest(store_dir)
+    tables = {}
+    for name, entry in manifest["tables"].items():
+        tables[name] = _map_entry(store_dir, entry)
+    # Each Arrow file carries its own copy of the key dictionaries; re-point the
+    # columns at a single shared categorical dtype per key.
+    return intern_keys(tables)
+
+
+def _map_entry(store_dir: str, entry: dict) -> pd.DataFrame:
+    df = _map_table(os.path.join(store_dir, entry["file"]))
+    # "checksum" identifies the rows (source CSV plus appended deltas), "base"
+    # the source CSV alone and "version" counts the appends since it was built.
+    df.attrs.update(
+        checksum=entry.get("checksum") or entry["source"]["sha256"],
+        base=entry["source"]["sha256"],
+        version=entry.get("version", 0),
+    )
+    return df
+
+
+def append_to_store(deltas: dict, data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> dict:
+    """
+    Appends delta CSVs ({table: [paths]}, read with the table's schema) to their
+    tables in the store. Only the Arrow files of the tables that changed are
+    rewritten, and each of them gets the next version and a checksum chained
+    from its deltas. Categories (including the shared key dictionaries) are only
+    ever extended, so codes in the other tables stay valid. Deltas already
+    recorded in the manifest, repeated in `deltas` or empty are skipped. Returns
+    the rows appended per table.
+    """
+    if feather is None:
+        raise ImportError("pyarrow is required to append to the columnar table store.")
+
+    with _build_lock(store_dir):
+        if not store_is_fresh(data_dir, store_dir):
+            build_store(data_dir, store_dir)
+        manifest = _read_manifest(store_dir)
+        entries = manifest["tables"]
+        tables = intern_keys({name: _map_entry(store_dir, entry) for name, entry in entries.items()})
+
+        new_rows, applied = {}, {}
+        for name, paths in deltas.items():
+            done = {delta["sha256"] for delta in entries[name].get("deltas", [])}
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                checksum = file_checksum(path)
+                if checksum in done:
+                    continue
+                rows = read_table_csv(name, path)
+                missing = tables[name].columns.difference(rows.columns)
+                if not missing.empty:
+                    raise ValueError(f"Delta {path} lacks the {name} columns {', '.join(missing)}.")
+                done.add(checksum)
+                # An empty delta would only bump the version and invalidate every cache.
+                if rows.empty:
+                    continue
+                new_rows.setdefault(name, []).append(rows[tables[name].columns])
+                applied.setdefault(name, []).append({"file": os.path.basename(path), "sha256": checksum, "rows": len(rows)})
+        if not new_rows:
+            return {}
+        new_rows = {name: pd.concat(frames, ignore_index=True) for name, frames in new_rows.items()}
+
+        # Categories are extended with the delta values; the key dictionaries are
+        # shared between tables, so each collects the values of every delta.
+        keys = {}
+        for name, rows in new_rows.items():
+            for col in KEY_COLUMNS:
+                if col in rows.columns and isinstance(tables[name][col].dtype, pd.CategoricalDtype):
+                    keys[col] = extend_categories(keys.get(col, tables[name][col].dtype), rows[col])
+
+        for name, rows in new_rows.items():
+            old = tables[name]
+            for col, dtype in old.dtypes.items():
+                if not isinstance(dtype, pd.CategoricalDtype):
+                    continue
+                extended = keys[col] if col in keys else extend_categories(dtype, rows[col])
+                if extended is not dtype:
+                    old = old.assign(**{col: recode(old[col], extended)})
+                rows[col] = recode(rows[col], extended)
+            df = pd.concat([old, rows], ignore_index=True)
+            _write_atomic(
+                os.path.join(store_dir, entries[name]["file"]),
+                lambda tmp: feather.write_feather(df, tmp, compression="uncompressed"),
+            )
+            entry = entries[name]
+            chain = entry.get("checksum") or entry["source"]["sha256"]
+            for delta in applied[name]:
+                chain = hashlib.sha256(f"{chain}:{delta['sha256']}".encode()).hexdigest()
+            entry.update(rows=len(df), version=entry.get("version", 0) + 1, checksum=chain,
+                         deltas=entry.get("deltas", []) + applied[name])
+
+        def write_manifest(tmp):
+            with open(tmp, "w") as fh:
+                json.dump(manifest, fh, indent=2)
+
+        _write_atomic(os.path.join(store_dir, MANIFEST_FILE), write_manifest)
+        return {name: len(rows) for name, rows in new_rows.items()}
+
+
+def map_appended(tables: dict, store_dir: str = STORE_DIR):
+    """
+    Remaps the tables whose store entry was appended to since `tables` was
+    loaded. Returns (the updated tables dict, {table: appended rows}); the
+    tables are new frames, `tables` itself is left untouched. Returns None when a
+    table was rebuilt from a changed CSV instead, which needs a full load_tables().
+    """
+    entries = _read_manifest(store_dir).get("tables", {})
+    changed = {}
+    for name, df in tables.items():
+        entry = entries.get(name)
+        if df is None or entry is None or (entry.get("checksum") or entry["source"]["sha256"]) == df.attrs.get("checksum"):
+            continue
+        if entry["source"]["sha256"] != df.attrs.get("base") or entry.get("version", 0) <= df.attrs.get("version", 0):
+            return None
+        changed[name] = entry
+    if not changed:
+        return tables, {}
+
+    updated = {name: df.copy(deep=False) if df is not None else None for name, df in tables.items()}
+    for name, entry in changed.items():
+        updated[name] = _map_entry(store_dir, entry)
+        if len(updated[name]) < len(tables[name]):
+            return None
+    intern_keys({name: df for name, df in updated.items() if df is not None})
+    return updated, {name: updated[name].iloc[len(tables[name]):] for name in changed}
+
+
+def _table_marker(df: pd.DataFrame, attr: str = "checksum") -> str:
+    return df.attrs.get(attr) or df.attrs.get("checksum") or f"{len(df)}:{','.join(map(str, df.columns))}"
+
+
+def data_fingerprint(tables: dict) -> str:
+    """
+    Identifies the data version behind a tables dict. Uses the checksums
+    recorded at load time, falling back to each table's shape and columns.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(tables):
+        df = tables[name]
+        if df is None:
+            continue
+        digest.update(f"{name}={_table_marker(df)};".encode())
+    return digest.hexdigest()[:16]
+
+
+def base_fingerprint(tables: dict) -> str:
+    """Like data_fingerprint, but ignores rows appended since the tables were built from their CSVs."""
+    digest = hashlib.sha256()
+    for name in sorted(tables):
+        df = tables[name]
+        if df is None:
+            continue
+        digest.update(f"{name}={_table_marker(df, 'base')};".encode())
+    return digest.hexdigest()[:16]
+
+
+def table_checksums(tables: dict, names=None) -> dict:
+    """The checksum of each table (or of each of `names`), which changes whenever rows are appended to it."""
+    return {
+        name: _table_marker(df) for name, df in tables.items()
+        if df is not None and (names is None or name in names)
+    }
+
+
+def table_versions(tables: dict) -> dict:
+    """How many times rows were appended to each table since it was built from its CSV."""
+    return {name: df.attrs.get("version", 0) for name, df in tables.items() if df is not None}
+
+
+if __name__ == "__main__":
+    force = "--force" in sys.argv[1:]
+    if force or not store_is_fresh():
+        result = build_store()
+        for name, entry in result["tables"].items():
+            print(f"{name}: {entry['rows']} rows -> {os.path.join(STORE_DIR, entry['file'])}")
+    else:
+        print(f"Table store in {STORE_DIR} is up to date.")
+
+    if "--report" in sys.argv[1:]:
+        default_tables = {
+            name: pd.read_csv(os.path.join(DATA_DIR, schema["file"]))
+            for name, schema in TABLE_SCHEMAS.items()
+        }
+        print(memory_report(default_tables, load_tables()).to_string(index=False))
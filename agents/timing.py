@@ -0,0 +1,127 @@
+import contextvars
+import itertools
+import time
+import uuid
+from contextlib import contextmanager
+
+# The trace being collected for the current request and its innermost open
+# span. With no trace (the default) stage() is a no-op, so the instrumented
+# chain costs nothing unless a trace is collected or exported.
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """One timed stage of a request: its parent, offset and duration in seconds, and attributes."""
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "duration", "attrs")
+
+    def __init__(self, name: str, span_id: int, parent_id, start: float, attrs: dict):
+        self.name, self.span_id, self.parent_id = name, span_id, parent_id
+        self.start, self.duration, self.attrs = start, None, attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start_ms": round(self.start * 1000, 3), "duration_ms": round((self.duration or 0.0) * 1000, 3),
+                **self.attrs}
+
+
+class _NoSpan:
+    """What stage() yields when nothing is being traced. It is falsy, so costly attributes can be skipped."""
+
+    def __bool__(self):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counts):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace:
+    """The finished spans of one request, e.g. one question through the chain."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.time()
+        self.spans = []  # appended as spans finish; list.append is safe across threads
+        self._origin = time.perf_counter()
+        self._ids = itertools.count(1)
+
+    def totals(self) -> dict:
+        """Seconds spent per stage name, summed over repeated stages."""
+        totals = {}
+        for span in list(self.spans):
+            totals[span.name] = totals.get(span.name, 0.0) + (span.duration or 0.0)
+        return totals
+
+    def to_dict(self) -> dict:
+        spans = sorted(self.spans, key=lambda span: span.start)
+        return {"trace_id": self.trace_id, "started": self.started, "spans": [span.to_dict() for span in spans]}
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """
+    Times the enclosed block as span `name` of the trace being collected, if
+    any, and yields it so the block can attach attributes (`span.set(...)`)
+    or counts (`span.add(...)`). Errors are recorded on the span and re-raised.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield NO_SPAN
+        return
+    parent = _span.get()
+    span = Span(name, next(trace._ids), parent.span_id if parent else None, time.perf_counter() - trace._origin, attrs)
+    token = _span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set(error=type(e).__name__)
+        raise
+    finally:
+        span.duration = time.perf_counter() - trace._origin - span.start
+        _span.reset(token)
+        trace.spans.append(span)
+
+
+async def timed(name: str, awaitable, **attrs):
+    """Awaits `awaitable` as stage `name`, e.g. inside asyncio.gather."""
+    with stage(name, **attrs):
+        return await awaitable
+
+
+def annotate(**counts):
+    """Adds counts (e.g. LLM tokens) to the innermost open span, if any."""
+    span = _span.get()
+    if span is not None:
+        span.add(**counts)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def collect_stages():
+    """
+    Collects the spans of everything run inside the block, including asyncio
+    tasks and worker threads started from it (they inherit the context).
+    """
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
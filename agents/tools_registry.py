@@ -1,87 +1,65 @@
-import pandas as pd
+import importlib
 import json
 from langchain_core.tools import tool
 
-from agents.customer_agent import handle_customer_query
-from agents.order_agent import handle_order_query
-from agents.payment_agent import handle_payment_query
-from agents.product_agent import handle_product_query
-from agents.logistics_agent import handle_logistics_query
 from agents.shared_dataframe import store_dataframe, make_query_id
+from agents.timing import stage
 
-def get_tools(tables: dict):
-    """Return a list of data-retrieval tools for the agent."""
+# Each agent module (with its pandas, SQL and sandbox machinery) is imported
+# on its tool's first call rather than when the tools are built.
+# agent -> the description its tool is offered to the tool-calling LLM with.
+AGENTS = {
+    "customer": "Handle customer-related queries including demographics, locations, behavior analysis.\n"
+                "Use for questions about customers, states, cities, or customer analysis.",
+    "order": "Handle order-related queries including status, trends, revenue, and counts.\n"
+             "Use for questions about orders, status, dates, values, or revenue.",
+    "payment": "Handle payment-related queries including methods, values, and analysis.\n"
+               "Use for questions about payments, types, amounts, or payment trends.",
+    "product": "Handle product-related queries including categories, analysis, and popular products.\n"
+               "Use for questions about products, categories, sales, or product performance.",
+    "logistics": "Handle logistics and delivery queries including delivery times and fulfillment.\n"
+                 "Use for questions about delivery, shipping, logistics, or order fulfillment.",
+}
 
-    @tool
-    def customer_query_tool(query: str) -> str:
-        """
-        Handle customer-related queries including demographics, locations, behavior analysis.
-        Use for questions about customers, states, cities, or customer analysis.
-        """
-        answer, df = handle_customer_query(query, tables)
-        query_id = None
-        if isinstance(df, pd.DataFrame) and not df.empty:
-            query_id = make_query_id("customer", query)
-            store_dataframe(query_id, df)
-        return json.dumps({"answer": answer, "query_id": query_id})
-
-    @tool
-    def order_query_tool(query: str) -> str:
-        """
-        Handle order-related queries including status, trends, revenue, and counts.
-        Use for questions about orders, status, dates, values, or revenue.
-        """
-        answer, df = handle_order_query(query, tables)
-        query_id = None
-        if isinstance(df, pd.DataFrame) and not df.empty:
-            query_id = make_query_id("order", query)
-            store_dataframe(query_id, df)
-        return json.dumps({"answer": answer, "query_id": query_id})
+class AgentError(Exception):
+    """Raised by an agent handler that could not answer; its tool reports the message with "error": true."""
 
-    @tool
-    def payment_query_tool(query: str) -> str:
-        """
-        Handle payment-related queries including methods, values, and analysis.
-        Use for questions about payments, types, amounts, or payment trends.
-        """
-        answer, df = handle_payment_query(query, tables)
-        query_id = None
-        if isinstance(df, pd.DataFrame) and not df.empty:
-            query_id = make_query_id("payment", query)
-            store_dataframe(query_id, df)
-        return json.dumps({"answer": answer, "query_id": query_id})
+def _handler(agent: str):
+    return getattr(importlib.import_module(f"agents.{agent}_agent"), f"handle_{agent}_query")
 
-    @tool
-    def product_query_tool(query: str) -> str:
-        """
-        Handle product-related queries including categories, analysis, and popular products.
-        Use for questions about products, categories, sales, or product performance.
-        """
-        answer, df = handle_product_query(query, tables)
-        query_id = None
-        if isinstance(df, pd.DataFrame) and not df.empty:
-            query_id = make_query_id("product", query)
-            store_dataframe(query_id, df)
-        return json.dumps({"answer": answer, "query_id": query_id})
+def _query(agent: str, query: str, tables: dict):
+    """
+    Runs handle_<agent>_query as a traced stage, recording the rows and bytes
+    of its result frame. Returns (answer, df, whether the agent failed).
+    """
+    with stage(f"{agent}_query") as span:
+        try:
+            answer, df = _handler(agent)(query, tables)
+        except AgentError as e:
+            span.set(error=True)
+            return str(e), None, True
+        if df is not None:
+            span.set(rows_out=len(df), result_bytes=df.nbytes)
+        return answer, df, False
 
-    @tool
-    def logistics_query_tool(query: str) -> str:
-        """
+def preload_agents():
+    """Imports the agent, plotting and agent-executor modules ahead of the first question, e.g. from a background thread."""
+    for agent in AGENTS:
+        _handler(agent)
+    for module in ("agents.llm_client", "agents.plot_agent", "matplotlib.figure", "langchain.agents"):
+        importlib.import_module(module)
 
-        Handle logistics and delivery queries including delivery times and fulfillment.
-        Use for questions about delivery, shipping, logistics, or order fulfillment.
-        """
-        answer, df = handle_logistics_query(query, tables)
+def _make_tool(agent: str, description: str, tables: dict, session_id: str):
+    def query_tool(query: str) -> str:
+        answer, df, failed = _query(agent, query, tables)
         query_id = None
-        if isinstance(df, pd.DataFrame) and not df.empty:
-            query_id = make_query_id("logistics", query)
-            store_dataframe(query_id, df)
-        return json.dumps({"answer": answer, "query_id": query_id})
+        if df is not None and not df.empty:
+            query_id = make_query_id(agent, query)
+            store_dataframe(query_id, df, session_id)
+        return json.dumps({"answer": answer, "query_id": query_id, "error": failed})
+
+    return tool(f"{agent}_query_tool", description=description)(query_tool)
 
-    return [
-        customer_query_tool,
-        order_query_tool,
-        payment_query_tool,
-        product_query_tool,
-        logistics_query_tool,
-    ]
\ No newline at end of file
+def get_tools(tables: dict, session_id: str = None):
+    """Return a list of data-retrieval tools for the agent. Result frames are stored under `session_id`."""
+    return [_make_tool(agent, description, tables, session_id) for agent, description in AGENTS.items()]
@@ -1,12 +1,15 @@
+import io
 import os
-import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
-import io
 import traceback
+import uuid
+
+import pandas as pd
+
+from agents.service_client import QA_SERVICE_URL, QAServiceClient, ServiceError, start_local_service
 
-from agents.graph_agent import run_agent_chain
-from agents.plot_agent import generate_plot_from_llm
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "0") == "1"
 
 st.set_page_config(page_title="E-Commerce QA", layout="wide")
 
@@ -22,75 +25,160 @@ st.markdown("""
 
 load_dotenv()
 
-@st.cache_data
-def load_data():
-    """Loads all e-commerce data from CSV files."""
-    customers = pd.read_csv("data/customers.csv")
-    order_items = pd.read_csv("data/order_items.csv")
-    orders = pd.read_csv("data/orders.csv", parse_dates=['order_purchase_timestamp', 'order_approved_at', 'order_delivered_timestamp'])
-    payments = pd.read_csv("data/payments.csv")
-    products = pd.read_csv("data/products.csv")
-    for df in [customers, order_items, orders, payments, products]:
-        df.columns = df.columns.str.strip()
-    return {"customers": customers, "orders": orders, "order_items": order_items, "payments": payments, "products": products}
-
-def enrich_datetime_columns(df):
-    """Adds year, month, etc., columns for plotting."""
-    if not isinstance(df, pd.DataFrame): return df
-    df = df.copy()
-    for col in df.select_dtypes(include=["datetime64[ns]"]).columns:
-        df[f"{col}_year"] = df[col].dt.year
-        df[f"{col}_month"] = df[col].dt.month
-        df[f"{col}_date"] = df[col].dt.date
-    return df
+@st.cache_resource
+def get_client():
+    """
+    The query service client. The page is a thin client: tables, caches, the
+    sandbox and the LLM all live in the service at QA_SERVICE_URL, or, without
+    one, in a service started on a background thread of this process.
+    """
+    return QAServiceClient(QA_SERVICE_URL or start_local_service())
+
+def show_stage_breakdown(trace):
+    """Debug panel: every traced stage of the current question with its duration and attributes."""
+    spans = trace["spans"]
+    with st.expander("Stage breakdown", expanded=True):
+        if not spans:
+            st.write("No stages were recorded.")
+            return
+        frame = pd.DataFrame(spans)
+        names = dict(zip(frame["span_id"], frame["name"]))
+        frame.insert(1, "parent", frame["parent_id"].map(names))
+        st.dataframe(frame.drop(columns=["span_id", "parent_id"]), use_container_width=True)
+        st.bar_chart(frame[frame["name"] != "question"].groupby("name")["duration_ms"].sum())
+
+def show_table(client, data):
+    """The data table: the first page straight from the stream, later pages fetched on demand."""
+    rows, page_size, pages = data["rows"], data["page_size"], data["pages"]
+    st.markdown("### Data Table")
+    st.markdown(f"**Total rows found: {rows}**")
+    page = 0
+    if pages > 1:
+        page = st.number_input("Page", min_value=1, max_value=pages, value=1, key="result_page") - 1
+        st.markdown(f"_Showing rows {page * page_size + 1}-{min((page + 1) * page_size, rows)}_")
+    st.dataframe(data["preview"] if page == 0 else client.page(data["result_id"], page), use_container_width=True)
+    if st.checkbox("Prepare CSV download", key="prepare_csv"):
+        st.download_button("Download CSV", client.csv(data["result_id"]), file_name="result.csv", mime="text/csv")
+
+def show_chart(client, event):
+    """Shows the chart of a plot event and returns it (PNG bytes or the error message) for reruns."""
+    st.markdown("### Chart")
+    plot_result = event.get("error") or event.get("image") or client.plot(event["result_id"])
+    if isinstance(plot_result, str):
+        st.warning(f"Plot generation failed: {plot_result}")
+        return plot_result
+    png = plot_result.getvalue()
+    st.image(png, use_container_width=True)
+    return png
+
+def show_result(client, intent, data, answer_slot, chart_slot, table_slot):
+    """The answer or the data table, once both the display intent and the data are known. Returns whether to plot."""
+    has_frame = data["preview"] is not None
+    show_plot = intent["show_plot"] and has_frame
+    show_data = intent["show_data"] and has_frame
+    if not show_data and not show_plot:
+        chart_slot.empty()
+        with answer_slot.container():
+            st.markdown("### Answer")
+            st.success(data["answer"])
+    if show_plot and not data["rows"]:
+        chart_slot.warning("Could not generate a plot as no data was found.")
+    if show_data and data["rows"]:
+        with table_slot.container():
+            show_table(client, data)
+    return show_plot
+
+def show_summary(summary_slot, summary):
+    with summary_slot.container():
+        st.markdown("### Summary")
+        st.info(summary)
+
+def show_saved_answer(client, saved, show_debug):
+    """
+    Redraws the answer kept from the last stream on a rerun (e.g. a page
+    change); only the table page requested is fetched from the service.
+    """
+    answer_slot, chart_slot, table_slot, summary_slot = st.empty(), st.empty(), st.empty(), st.empty()
+    if saved["intent"] is not None and saved["data"] is not None:
+        show_result(client, saved["intent"], saved["data"], answer_slot, chart_slot, table_slot)
+    chart = saved["chart"]
+    if chart is not None:
+        with chart_slot.container():
+            show_chart(client, {"error": chart} if isinstance(chart, str) else {"image": io.BytesIO(chart)})
+    if saved["summary"]:
+        show_summary(summary_slot, saved["summary"])
+    if show_debug and saved["done"] is not None and saved["done"].get("trace"):
+        show_stage_breakdown(saved["done"]["trace"])
 
 st.title("E-Commerce Data QA System")
 st.markdown("Ask a question about orders, revenue, delivery, or customer behavior:")
 
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 question = st.text_input("Ask Your Question", key="user_question").strip()
-tables = load_data()
+client = get_client()
+show_debug = st.sidebar.checkbox("Show stage breakdown", value=DEBUG_PANEL)
+try:
+    versions = client.health()["versions"]
+    st.sidebar.caption("Table versions: " + ", ".join(f"{name} v{version}" for name, version in versions.items()))
+except (OSError, ServiceError) as e:
+    st.sidebar.caption(f"Query service unavailable: {e}")
 
+saved = st.session_state.get("answer")
 if question:
-    with st.spinner("Thinking..."):
-        try:
-            result_dict = run_agent_chain(question, tables)
-
-            answer = result_dict.get("answer")
-            data = result_dict.get("data")
-            summary = result_dict.get("summary")
-            show_plot = result_dict.get("plot", False)
-            show_data = result_dict.get("show_data", False)
-
-            is_simple_answer = not show_data and not show_plot
-
-            if is_simple_answer:
-                st.markdown("### Answer")
-                st.success(answer)
-
-            if show_plot:
-                if isinstance(data, pd.DataFrame) and not data.empty:
-                    st.markdown("### Chart")
-                    enriched_data = enrich_datetime_columns(data)
-                    plot_result = generate_plot_from_llm(enriched_data, question)
-                    if isinstance(plot_result, io.BytesIO):
-                        st.image(plot_result, use_container_width=True)
-                    else:
-                        st.warning(f"Plot generation failed: {plot_result}")
-                else:
-                    st.warning("Could not generate a plot as no data was found.")
-
-            if show_data:
-                if isinstance(data, pd.DataFrame) and not data.empty:
-                    st.markdown("### Data Table")
-                    st.markdown(f"**Total rows found: {len(data)}**")
-                    if len(data) > 50:
-                        st.markdown("_Showing top 50 rows_")
-                    st.dataframe(data.head(50), use_container_width=True)
-            
-            if summary:
-                st.markdown("### Summary")
-                st.info(summary)
-
-        except Exception as e:
-            st.error("An unexpected error occurred during execution.")
-            st.code(traceback.format_exc())
\ No newline at end of file
+    replay = saved is not None and saved["question"] == question and saved["debug"] == show_debug
+    try:
+        if replay:
+            show_saved_answer(client, saved, show_debug)
+        else:
+            # Each part is rendered into its slot as soon as the service streams it:
+            # the answer or table once data is retrieved, the summary token by token,
+            # and the chart when it is drawn, so nothing waits for the slowest LLM call.
+            # The finished answer is kept in the session, so reruns (e.g. paging through
+            # the table) redraw it instead of asking the question again.
+            answer_slot, chart_slot, table_slot, summary_slot = st.empty(), st.empty(), st.empty(), st.empty()
+            intent, data, chart, summary, done = None, None, None, "", None
+            show_plot = False
+            with st.spinner("Thinking..."):
+                for event in client.stream(question, session_id=st.session_state.session_id, debug=show_debug):
+                    kind = event["event"]
+                    if kind == "intent":
+                        intent = event
+                        if intent["show_plot"]:
+                            chart_slot.caption("Drawing the chart...")
+                    elif kind == "data":
+                        data = event
+                    elif kind == "token":
+                        summary += event["text"]
+                        show_summary(summary_slot, summary)
+                    elif kind == "plot":
+                        with chart_slot.container():
+                            chart = show_chart(client, event)
+                    elif kind == "done":
+                        done = event
+
+                    if kind in ("intent", "data") and intent is not None and data is not None:
+                        show_plot = show_result(client, intent, data, answer_slot, chart_slot, table_slot)
+
+            # A cached answer whose chart was not kept is drawn now.
+            if show_plot and data["rows"] and chart is None:
+                with chart_slot.container():
+                    chart = show_chart(client, {"result_id": data["result_id"]})
+            if show_debug and done is not None and done.get("trace"):
+                show_stage_breakdown(done["trace"])
+            st.session_state.answer = {"question": question, "debug": show_debug, "intent": intent, "data": data,
+                                       "chart": chart, "summary": summary, "done": done}
+
+    except ServiceError as e:
+        if replay and e.status == 404:
+            # The service no longer holds the kept result; ask again.
+            del st.session_state["answer"]
+            st.rerun()
+        elif e.status == 503:
+            st.warning(f"The service is busy right now; please retry in a few seconds. ({e})")
+        else:
+            st.error(f"The query service returned an error: {e}")
+    except Exception as e:
+        st.error("An unexpected error occurred during execution.")
+        st.code(traceback.format_exc())
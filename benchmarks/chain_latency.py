@@ -0,0 +1,75 @@
+"""
+Latency harness for the sync and async agent chains.
+
+Every LLM call is served by FakeChatModel with a fixed, configurable latency,
+so the run needs no network and shows how much of the chain overlaps:
+
+    python -m benchmarks.chain_latency --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+# Keep generated-code cache entries out of the working tree.
+os.environ.setdefault("CODE_CACHE_DIR", tempfile.mkdtemp(prefix="code-cache-"))
+
+import numpy as np
+import pandas as pd
+
+import agents.graph_agent
+import agents.plot_agent
+from agents.code_cache import code_cache
+from agents.fake_llm import FakeChatModel, scripted_reply
+from agents.shared_llm import llm as shared_llm, llm_stats
+
+
+def sample_tables(rows: int = 2000) -> dict:
+    rng = np.random.default_rng(0)
+    orders = pd.DataFrame({
+        "order_id": [f"o{i}" for i in range(rows)],
+        "customer_id": [f"c{i % 500}" for i in range(rows)],
+        "order_status": pd.Categorical(rng.choice(["delivered", "shipped", "canceled"], rows)),
+        "order_purchase_timestamp": pd.Timestamp("2017-01-01") + pd.to_timedelta(rng.integers(0, 365, rows), unit="D"),
+    })
+    customers = pd.DataFrame({"customer_id": [f"c{i}" for i in range(500)], "customer_state": "SP"})
+    return {"orders": orders, "customers": customers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per fake LLM call")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    llm = FakeChatModel(responder=scripted_reply, latency=args.latency)
+    shared_llm.use(llm)
+    tables = sample_tables()
+    question = "plot the number of orders by status"
+
+    def timed(label, fn):
+        durations = []
+        for _ in range(args.runs):
+            code_cache.clear()
+            llm.calls = 0
+            start = time.perf_counter()
+            result = fn()
+            durations.append(time.perf_counter() - start)
+        print(f"{label:>6}: {np.median(durations):.2f}s median over {args.runs} runs, "
+              f"{llm.calls} LLM calls, rows={len(result['data']) if result['data'] is not None else 0}")
+        return np.median(durations)
+
+    def sync_chain():
+        result = agents.graph_agent.run_agent_chain(question, tables)
+        agents.plot_agent.generate_plot_from_llm(agents.plot_agent.enrich_datetime_columns(result["data"].to_frame()), question)
+        return result
+
+    sync_time = timed("sync", sync_chain)
+    async_time = timed("async", lambda: asyncio.run(agents.graph_agent.arun_agent_chain(question, tables, render_plot=True)))
+    print(f"speed-up: {sync_time / async_time:.2f}x (fake LLM latency {args.latency}s per call)")
+    print(f"LLM client: {llm_stats()}")
+
+
+if __name__ == "__main__":
+    main()
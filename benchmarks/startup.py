@@ -0,0 +1,86 @@
+"""
+Cold-start import time of the modules app.py loads before its first render.
+
+Runs `python -X importtime` on the `agents` imports of app.py in a fresh
+interpreter, prints the total and the slowest modules, and fails when the
+total exceeds the budget or a module that should load lazily is imported:
+
+    python -m benchmarks.startup --budget-ms 2000
+
+With `--service`, measures the query service (agents.service) instead, which
+is what loads the pipeline now that app.py is a thin client.
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded on first use or by tools_registry.preload_agents(), never at startup.
+LAZY_MODULES = ["matplotlib", "seaborn", "langchain.agents", "langchain_openai", "agents.plot_agent", "agents.llm_client"]
+
+
+def app_imports(path: str = os.path.join(ROOT, "app.py")) -> list:
+    """The top-level `agents` modules imported by app.py."""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and (node.module or "").startswith("agents"):
+            modules.append(node.module)
+        elif isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names if alias.name.startswith("agents"))
+    return list(dict.fromkeys(modules))
+
+
+def import_times(modules: list) -> tuple:
+    """
+    Cumulative import time in microseconds per module, and the total of the
+    modules imported directly (not by another module), from a fresh interpreter.
+    """
+    code = "; ".join(f"import {name}" for name in modules)
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")]))}
+    run = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True)
+    if run.returncode != 0:
+        raise SystemExit(run.stderr)
+    times, total = {}, 0
+    for line in run.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+            if not name.startswith("  "):
+                total += int(cumulative)
+    return times, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=2000, help="fail above this total import time")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    parser.add_argument("--service", action="store_true", help="measure agents.service instead of app.py")
+    args = parser.parse_args()
+
+    modules = ["agents.service"] if args.service else app_imports()
+    times, total_us = import_times(modules)
+    total_ms = total_us / 1000
+
+    print(f"imports: {', '.join(modules)}")
+    print(f"total: {total_ms:.0f}ms (budget {args.budget_ms:.0f}ms)")
+    for name, us in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{us / 1000:>8.0f}ms  {name}")
+
+    eager = [name for name in LAZY_MODULES if name in times]
+    if eager:
+        print(f"FAIL: imported at startup but meant to load lazily: {', '.join(eager)}")
+    if total_ms > args.budget_ms:
+        print(f"FAIL: startup imports took {total_ms:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+    sys.exit(1 if eager or total_ms > args.budget_ms else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+End-to-end benchmark of the agent chain over a corpus of representative questions.
+
+Every LLM call is answered offline: by default with the replies scripted in the
+corpus (benchmarks/questions.json), or with `--replay FILE` from a recording
+made earlier with `--record FILE` (e.g. against the live backend, `--llm live`).
+Each question runs the async chain the app uses, with plots rendered and the
+code and plot caches cleared, and every stage is timed separately. The report
+gives p50/p95 per stage and per question, and peak traced memory, and is
+compared against a stored baseline:
+
+    python -m benchmarks.suite --runs 5
+    python -m benchmarks.suite --save-baseline
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Offline, in-process and with caches that do not touch the working tree.
+os.environ.setdefault("CODE_CACHE_DIR", tempfile.mkdtemp(prefix="code-cache-"))
+os.environ.setdefault("PLOT_CACHE_DIR", tempfile.mkdtemp(prefix="plot-cache-"))
+os.environ.setdefault("SANDBOX_WORKERS", "0")
+
+import numpy as np
+import pandas as pd
+from langchain_core.messages import AIMessage, ToolMessage
+
+from agents.code_cache import code_cache
+from agents.fake_llm import FakeChatModel, ReplayChatModel
+from agents.graph_agent import arun_agent_chain
+from agents.plot_cache import plot_cache
+from agents.shared_llm import llm as shared_llm, llm_stats
+from agents.table_schema import TABLE_SCHEMAS, add_derived_columns, intern_keys
+from agents.table_store import load_tables
+from agents.timing import collect_stages
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(BENCH_DIR, "questions.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+# Reported stages. "tool_routing" is the local router plus whatever part of
+# retrieval is not code generation or execution (the tool-choice LLM calls
+# when the router is not confident, tool and result-store overhead).
+REPORT_STAGES = ["intent", "tool_routing", "codegen", "exec", "summary", "plot_codegen", "plot_render", "total"]
+
+
+def sample_tables(orders: int = 20000, seed: int = 0) -> dict:
+    """A synthetic dataset shaped like the source CSVs, loaded the way table_store loads them."""
+    rng = np.random.default_rng(seed)
+    states = np.array(["SP", "RJ", "MG", "RS", "PR", "BA", "SC", "PE", "GO", "AM"])
+    n_customers, n_products = orders // 2, max(orders // 10, 10)
+    purchase = pd.Timestamp("2017-01-01") + pd.to_timedelta(rng.integers(0, 730 * 24 * 60, orders), unit="min")
+    delivered = purchase + pd.to_timedelta(rng.gamma(3, 4, orders), unit="D")
+    status = rng.choice(["delivered", "shipped", "canceled", "processing"], orders, p=[0.9, 0.05, 0.03, 0.02])
+    lines = orders + orders // 5
+    line_orders = np.concatenate([np.arange(orders), rng.integers(0, orders, lines - orders)])
+    raw = {
+        "customers": pd.DataFrame({
+            "customer_id": [f"c{i}" for i in range(n_customers)],
+            "customer_zip_code_prefix": rng.integers(1000, 99999, n_customers),
+            "customer_city": [f"city {i}" for i in rng.integers(0, 400, n_customers)],
+            "customer_state": rng.choice(states, n_customers, p=np.linspace(10, 1, len(states)) / 55),
+        }),
+        "orders": pd.DataFrame({
+            "order_id": [f"o{i}" for i in range(orders)],
+            "customer_id": [f"c{i}" for i in rng.integers(0, n_customers, orders)],
+            "order_status": status,
+            "order_purchase_timestamp": purchase,
+            "order_approved_at": purchase + pd.Timedelta(hours=2),
+            "order_delivered_timestamp": pd.Series(delivered).where(status == "delivered"),
+            "order_estimated_delivery_date": (purchase + pd.Timedelta(days=20)).normalize(),
+        }),
+        "order_items": pd.DataFrame({
+            "order_id": [f"o{i}" for i in line_orders],
+            "order_item_id": np.ones(lines, dtype=int),
+            "product_id": [f"p{i}" for i in rng.integers(0, n_products, lines)],
+            "seller_id": [f"s{i}" for i in rng.integers(0, 300, lines)],
+            "price": rng.lognormal(4, 0.8, lines).round(2),
+            "shipping_charges": rng.gamma(2, 10, lines).round(2),
+        }),
+        "payments": pd.DataFrame({
+            "order_id": [f"o{i}" for i in range(orders)],
+            "payment_sequential": np.ones(orders, dtype=int),
+            "payment_type": rng.choice(["credit_card", "wallet", "voucher", "debit_card"], orders, p=[0.74, 0.19, 0.05, 0.02]),
+            "payment_installments": rng.integers(1, 10, orders),
+            "payment_value": rng.lognormal(4.5, 0.8, orders).round(2),
+        }),
+        "products": pd.DataFrame({
+            "product_id": [f"p{i}" for i in range(n_products)],
+            "product_category_name": [f"category {i}" for i in rng.integers(0, 70, n_products)],
+            "product_weight_g": rng.gamma(2, 800, n_products),
+            "product_length_cm": rng.uniform(10, 100, n_products),
+            "product_height_cm": rng.uniform(2, 60, n_products),
+            "product_width_cm": rng.uniform(10, 80, n_products),
+        }),
+    }
+    tables = {}
+    for name, df in raw.items():
+        df = df.astype(TABLE_SCHEMAS[name]["dtypes"])
+        tables[name] = add_derived_columns(name, df)
+    return intern_keys(tables)
+
+
+def load_corpus(path: str = CORPUS_PATH) -> list:
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def corpus_responder(corpus: list):
+    """Answers every prompt of the chain with the reply the corpus scripts for the question it is about."""
+    by_length = sorted(corpus, key=lambda entry: -len(entry["question"]))
+
+    def entry_for(messages):
+        # The question is in the last message that mentions one; system prompts
+        # may also quote other corpus questions as examples.
+        for message in reversed(messages):
+            text = str(message.content)
+            entry = next((entry for entry in by_length if entry["question"] in text), None)
+            if entry is not None:
+                return entry
+        raise KeyError("Prompt does not mention any corpus question.")
+
+    def respond(messages):
+        first = str(messages[0].content)
+        entry = entry_for(messages)
+        if "intent classifier" in first:
+            return json.dumps({"show_data": entry["show_data"], "show_plot": entry["show_plot"]})
+        if "data retrieval assistant" in first:
+            if isinstance(messages[-1], ToolMessage):
+                return AIMessage(content=messages[-1].content)
+            return AIMessage(content="", tool_calls=[{"name": entry["tool"], "args": {"query": entry["question"]}, "id": "call_0"}])
+        if "DuckDB SQL" in first:
+            return entry.get("sql", "SELECT 1")
+        if "pandas code" in first:
+            return entry["code"]
+        if "visualization expert" in first or "Python data analyst" in first:
+            return entry.get("plot_code", "sns.barplot(data=df, x=df.columns[0], y=df.columns[1])")
+        return entry["summary"]
+
+    return respond
+
+
+def run_question(question: str, tables: dict) -> dict:
+    """Seconds per reported stage for one cold run of the async chain (code and plot caches cleared)."""
+    code_cache.clear()
+    plot_cache.clear()
+    with collect_stages() as timings:
+        start = time.perf_counter()
+        response = asyncio.run(arun_agent_chain(question, tables, render_plot=True))
+        total = time.perf_counter() - start
+    if str(response.get("answer", "")).startswith(("Error processing", "Could not find an answer")):
+        print(f"  warning: {question!r} answered {response['answer']!r}")
+    raw = timings.totals()
+    stages = {name: raw.get(name, 0.0) for name in ("intent", "codegen", "exec", "summary", "plot_codegen", "plot_render")}
+    inside = raw.get("codegen", 0.0) + raw.get("exec", 0.0)
+    stages["tool_routing"] = raw.get("routing", 0.0) + max(raw.get("retrieve", 0.0) - inside, 0.0)
+    stages["total"] = total
+    return stages
+
+
+def peak_memory(question: str, tables: dict) -> float:
+    """Peak memory (MB) traced by tracemalloc during one cold run."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run_question(question, tables)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def percentiles(values: list) -> dict:
+    ms = np.asarray(values) * 1000
+    return {"p50_ms": round(float(np.percentile(ms, 50)), 2), "p95_ms": round(float(np.percentile(ms, 95)), 2)}
+
+
+def run_suite(corpus: list, tables: dict, runs: int, memory: bool = True) -> dict:
+    samples = {name: [] for name in REPORT_STAGES}
+    questions = {}
+    for entry in corpus:
+        question = entry["question"]
+        run_question(question, tables)  # warm-up: imports, prompt blocks, first-call setup
+        totals = []
+        for _ in range(runs):
+            stages = run_question(question, tables)
+            for name in REPORT_STAGES:
+                samples[name].append(stages[name])
+            totals.append(stages["total"])
+        questions[question] = percentiles(totals)
+        if memory:
+            questions[question]["peak_mb"] = round(peak_memory(question, tables), 2)
+        print(f"  {questions[question]['p50_ms']:>9.1f}ms p50  {question}")
+    report = {"stages": {name: percentiles(values) for name, values in samples.items()}, "questions": questions}
+    if memory:
+        report["peak_mb"] = max(q["peak_mb"] for q in questions.values())
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """
+    Regressions of `report` against `baseline`: stage p95s, question p50s (a
+    few runs make per-question p95s noisy) and peak memory more than
+    `tolerance` worse.
+    """
+    regressions = []
+
+    def check(label, current, base, floor, unit):
+        if base is not None and current > base * (1 + tolerance) and current - base > floor:
+            regressions.append(f"{label}: {current:.1f}{unit} vs baseline {base:.1f}{unit}")
+
+    for name, stats in report["stages"].items():
+        check(f"{name} p95", stats["p95_ms"], baseline.get("stages", {}).get(name, {}).get("p95_ms"), min_delta_ms, "ms")
+    for question, stats in report["questions"].items():
+        base = baseline.get("questions", {}).get(question, {})
+        check(f"{question!r} p50", stats["p50_ms"], base.get("p50_ms"), min_delta_ms, "ms")
+        if "peak_mb" in stats:
+            check(f"{question!r} peak memory", stats["peak_mb"], base.get("peak_mb"), 1.0, "MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per question, after one warm-up")
+    parser.add_argument("--rows", type=int, default=20000, help="orders in the synthetic dataset")
+    parser.add_argument("--data", action="store_true", help="use the tables in data/ instead of synthetic ones")
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--llm", choices=["corpus", "live"], default="corpus",
+                        help="corpus: scripted offline replies; live: the LLM_BACKEND client")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per scripted LLM call")
+    parser.add_argument("--replay", metavar="FILE", help="serve replies recorded with --record instead")
+    parser.add_argument("--record", metavar="FILE", help="record every prompt and reply to FILE")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown before flagging, as a fraction")
+    parser.add_argument("--min-delta-ms", type=float, default=20.0, help="ignore slowdowns smaller than this")
+    parser.add_argument("--json", metavar="FILE", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if args.replay:
+        shared_llm.use(ReplayChatModel(path=args.replay, latency=args.latency))
+    elif args.llm == "corpus":
+        shared_llm.use(FakeChatModel(responder=corpus_responder(corpus), latency=args.latency))
+    if args.record:
+        shared_llm.record_file = args.record
+    tables = load_tables() if args.data else sample_tables(args.rows)
+
+    print(f"{len(corpus)} questions, {args.runs} runs each, {sum(len(df) for df in tables.values())} table rows")
+    report = run_suite(corpus, tables, args.runs, memory=not args.no_memory)
+
+    print(f"\n{'stage':<14}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, stats in report["stages"].items():
+        print(f"{name:<14}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}")
+    if "peak_mb" in report:
+        print(f"peak traced memory: {report['peak_mb']:.1f}MB")
+    print(f"LLM client: {llm_stats()}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline to create one.")
+        return
+    with open(args.baseline) as fh:
+        regressions = compare(report, json.load(fh), args.tolerance, args.min_delta_ms)
+    if regressions:
+        print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+CUSTOMERS = 12
+PRODUCTS = 8
+STATES = ["SP", "RJ", "MG"]
+CATEGORIES = ["toys", "watches_gifts", "bed_bath_table"]
+
+
+def order_frames(first: int = 0, count: int = 40, seed: int = 0) -> dict:
+    """orders, order_items and payments rows for the orders first..first+count-1, like the source CSVs."""
+    rng = np.random.default_rng(seed + first)
+    ids = [f"o{i:04d}" for i in range(first, first + count)]
+    purchased = pd.Timestamp("2018-01-01") + pd.to_timedelta(np.arange(first, first + count) * 29, unit="h")
+    status = rng.choice(["delivered", "delivered", "shipped", "canceled"], count)
+    delivered = pd.Series(purchased + pd.to_timedelta(rng.integers(2, 20, count), unit="D")).where(status == "delivered")
+    orders = pd.DataFrame({
+        "order_id": ids,
+        "customer_id": [f"c{i % CUSTOMERS:03d}" for i in range(first, first + count)],
+        "order_status": status,
+        "order_purchase_timestamp": purchased,
+        "order_approved_at": purchased + pd.Timedelta(hours=2),
+        "order_delivered_timestamp": delivered,
+        "order_estimated_delivery_date": (purchased + pd.Timedelta(days=21)).normalize(),
+    })
+    lines = rng.integers(1, 4, count)
+    items = pd.DataFrame({
+        "order_id": np.repeat(ids, lines),
+        "order_item_id": np.concatenate([np.arange(1, n + 1) for n in lines]),
+        "product_id": [f"p{i:03d}" for i in rng.integers(0, PRODUCTS, lines.sum())],
+        "seller_id": [f"S{i:03d}" for i in rng.integers(0, 5, lines.sum())],
+        "price": rng.uniform(10, 300, lines.sum()).round(2),
+        "shipping_charges": rng.uniform(5, 40, lines.sum()).round(2),
+    })
+    # Shuffle so the lines of an order are not adjacent, as in the real data.
+    items = items.sample(frac=1, random_state=seed + first).reset_index(drop=True)
+    payments = pd.DataFrame({
+        "order_id": ids,
+        "payment_sequential": 1,
+        "payment_type": rng.choice(["credit_card", "boleto", "voucher"], count),
+        "payment_installments": rng.integers(1, 10, count),
+        "payment_value": rng.uniform(20, 500, count).round(2),
+    })
+    return {"orders": orders, "order_items": items, "payments": payments}
+
+
+def sample_frames(orders: int = 40) -> dict:
+    """A small, deterministic copy of the five source tables."""
+    customers = pd.DataFrame({
+        "customer_id": [f"c{i:03d}" for i in range(CUSTOMERS)],
+        "customer_zip_code_prefix": [10000 + i for i in range(CUSTOMERS)],
+        "customer_city": [f"city {i % 5}" for i in range(CUSTOMERS)],
+        "customer_state": [STATES[i % len(STATES)] for i in range(CUSTOMERS)],
+    })
+    products = pd.DataFrame({
+        "product_id": [f"p{i:03d}" for i in range(PRODUCTS)],
+        "product_category_name": [CATEGORIES[i % len(CATEGORIES)] for i in range(PRODUCTS)],
+        "product_weight_g": [100.0 * (i + 1) for i in range(PRODUCTS)],
+        "product_length_cm": 20.0,
+        "product_height_cm": 10.0,
+        "product_width_cm": 15.0,
+    })
+    return {"customers": customers, "products": products, **order_frames(0, orders)}
+
+
+def write_csvs(frames: dict, directory, suffix: str = "") -> dict:
+    """Writes each frame to `<directory>/<name><suffix>.csv`; returns the paths by table."""
+    paths = {}
+    for name, df in frames.items():
+        paths[name] = str(directory / f"{name}{suffix}.csv")
+        df.to_csv(paths[name], index=False)
+    return paths
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A directory holding the sample source CSVs."""
+    directory = tmp_path / "data"
+    directory.mkdir()
+    write_csvs(sample_frames(), directory)
+    return directory
+
+
+@pytest.fixture
+def copy_on_write():
+    """Restores pandas' process-wide copy-on-write option, which handing out table views turns on."""
+    with pd.option_context("mode.copy_on_write", pd.get_option("mode.copy_on_write")):
+        yield
+
+
+@pytest.fixture
+def attached(copy_on_write):
+    """Detaches the process-wide tables afterwards."""
+    from agents.shared_tables import detach_tables
+
+    yield
+    detach_tables()
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from agents.aggregates import AggregateCubes
+from agents.table_store import append_to_store, load_tables, map_appended
+
+from conftest import order_frames, write_csvs
+
+
+def _append(data_dir, tmp_path, frames: dict):
+    """Appends `frames` as deltas; returns (tables before, tables after, appended rows)."""
+    data, store_dir = str(data_dir), str(data_dir / ".store")
+    tables = load_tables(data, store_dir)
+    paths = write_csvs(frames, tmp_path, "-delta")
+    append_to_store({name: [path] for name, path in paths.items()}, data, store_dir)
+    updated, changes = map_appended(tables, store_dir)
+    return tables, updated, changes
+
+
+def _assert_same_views(cubes: AggregateCubes, rebuilt: AggregateCubes):
+    assert cubes.views().keys() == rebuilt.views().keys()
+    for name, view in rebuilt.views().items():
+        pd.testing.assert_frame_equal(cubes.views()[name], view, check_categorical=False, obj=name)
+
+
+def test_appended_rows_match_a_full_rebuild(data_dir, tmp_path):
+    delta = order_frames(40, 10)
+    # A payment type and an order status the cubes have not seen yet.
+    delta["payments"].loc[0, "payment_type"] = "debit_card"
+    delta["orders"].loc[1, "order_status"] = "unavailable"
+    tables, updated, changes = _append(data_dir, tmp_path, delta)
+
+    _assert_same_views(AggregateCubes(tables).appended(updated, changes), AggregateCubes(updated))
+
+
+def test_payments_ahead_of_their_order_are_counted_once_it_arrives(data_dir, tmp_path):
+    delta = order_frames(40, 6)
+    tables, updated, changes = _append(data_dir, tmp_path, {"payments": delta["payments"]})
+    early = AggregateCubes(tables).appended(updated, changes)
+    assert early.views()["payments_by_month"]["payment_count"].sum() == 40
+
+    _, latest, changes = _append(data_dir, tmp_path, {"orders": delta["orders"]})
+    _assert_same_views(early.appended(latest, changes), AggregateCubes(latest))
+    assert early.appended(latest, changes).views()["payments_by_month"]["payment_count"].sum() == 46
+
+
+def test_update_leaves_the_original_cubes_alone(data_dir, tmp_path):
+    tables, updated, changes = _append(data_dir, tmp_path, {"payments": order_frames(40, 5)["payments"]})
+    cubes = AggregateCubes(tables)
+    before = cubes.views()["payments_by_type"].copy()
+
+    cubes.appended(updated, changes)
+    pd.testing.assert_frame_equal(cubes.views()["payments_by_type"], before)
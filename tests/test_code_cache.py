@@ -0,0 +1,30 @@
+import pandas as pd
+
+from agents import code_cache as code_cache_module
+from agents.code_cache import CodeCache
+
+TABLES = {"orders": pd.DataFrame({"order_id": ["a"], "order_status": ["delivered"]})}
+
+
+def test_key_changes_with_prompt(tmp_path):
+    cache = CodeCache(cache_dir=str(tmp_path))
+    key = cache.make_key("order", "How many orders?", TABLES, "prompt v1")
+    assert key == cache.make_key("order", "how many orders", TABLES, "prompt v1")
+    assert key != cache.make_key("order", "How many orders?", TABLES, "prompt v2")
+
+
+def test_key_changes_with_rewriter_version(tmp_path, monkeypatch):
+    cache = CodeCache(cache_dir=str(tmp_path))
+    key = cache.make_key("order", "How many orders?", TABLES, "prompt")
+    monkeypatch.setattr(code_cache_module, "REWRITER_VERSION", -1)
+    assert key != cache.make_key("order", "How many orders?", TABLES, "prompt")
+
+
+def test_memory_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(code_cache_module, "MAX_MEMORY_ENTRIES", 3)
+    cache = CodeCache(cache_dir=str(tmp_path))
+    for i in range(5):
+        cache.compile(f"result = {i}")
+        cache.store(f"key{i}", f"result = {i}")
+    assert len(cache._compiled) == 3 and len(cache._entries) == 3
+    assert cache.lookup("key0")["code"] == "result = 0"
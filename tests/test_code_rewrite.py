@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from agents.code_rewrite import CodeBudgetError, CodeRewriter
+from agents.fact_table import FactTable
+from agents.timing import collect_stages, stage
+
+
+@pytest.fixture
+def frames():
+    orders = pd.DataFrame({
+        "order_id": ["a", "b", "c", "d"],
+        "customer_id": ["x", "y", "x", "z"],
+        "order_status": ["delivered", "canceled", "delivered", "shipped"],
+        "ts": pd.to_datetime(["2017-01-05", "2017-03-01", "2017-02-10", "2017-01-20"]),
+    })
+    order_items = pd.DataFrame({
+        "order_id": ["a", "a", "c", "d", "d"],
+        "product_id": ["p1", "p2", "p1", "p3", "p3"],
+        "price": [10.0, 25.5, 7.0, 99.0, 1.5],
+    })
+    return {"orders": orders, "order_items": order_items}
+
+
+def run(code: str, frames: dict):
+    namespace = {"pd": pd, "np": np, **{name: df.copy() for name, df in frames.items()}}
+    exec(code, namespace)
+    result = namespace["result"]
+    return result.reset_index(drop=True) if isinstance(result, (pd.DataFrame, pd.Series)) else result
+
+
+def rewrite(code: str, frames: dict, budget: float = 30):
+    rewriter = CodeRewriter(frames, budget=budget)
+    return rewriter.rewrite(code), rewriter.rewrites
+
+
+def assert_equivalent(code: str, frames: dict, rewritten: bool):
+    new_code, rewrites = rewrite(code, frames)
+    assert bool(rewrites) == rewritten, rewrites
+    before, after = run(code, frames), run(new_code, frames)
+    if isinstance(before, pd.DataFrame):
+        pd.testing.assert_frame_equal(before, after)
+    elif isinstance(before, pd.Series):
+        pd.testing.assert_series_equal(before, after, check_names=False)
+    else:
+        assert before == after
+
+
+@pytest.mark.parametrize("mask", [
+    'm["order_status"] == "delivered"',
+    '(m["order_status"] != "canceled") & (m["ts"].dt.month == 1)',
+    'm["order_status"].isin(["delivered", "shipped"])',
+    'm["ts"].between("2017-01-01", "2017-01-31")',
+    'm["order_status"].str.startswith("deliv")',
+])
+def test_rowwise_filter_is_pushed_below_merge(frames, mask):
+    code = f'm = orders.merge(order_items, on="order_id")\nresult = m[{mask}]'
+    assert_equivalent(code, frames, rewritten=True)
+
+
+@pytest.mark.parametrize("mask", [
+    'm["ts"] == m["ts"].max()',
+    'm["price"] > m["price"].mean()',
+    'm["price"].rank() <= 2',
+    '~m["order_id"].duplicated()',
+    'm["price"] > m.groupby("order_id")["price"].transform("mean")',
+    'm["order_id"].isin(m["order_id"].head(1))',
+    'm["price"].shift(1) > 5',
+])
+def test_filter_reading_other_rows_stays_after_merge(frames, mask):
+    code = f'm = orders.merge(order_items, on="order_id")\nresult = m[{mask}]'
+    assert_equivalent(code, frames, rewritten=False)
+
+
+def test_latest_order_without_items_keeps_its_answer(frames):
+    # The latest order (b) has no items: filtering orders first would pick b and then drop it in the join.
+    code = 'm = orders.merge(order_items, on="order_id")\nresult = m[m["ts"] == m["ts"].max()]'
+    assert_equivalent(code, frames, rewritten=False)
+    assert len(run(code, frames)) == 1
+
+
+def test_left_join_filter_on_right_side_is_not_pushed(frames):
+    code = 'm = orders.merge(order_items, on="order_id", how="left")\nresult = m[m["price"] > 5]'
+    assert_equivalent(code, frames, rewritten=False)
+
+
+def test_merged_frame_used_again_is_not_rewritten(frames):
+    code = ('m = orders.merge(order_items, on="order_id")\nf = m[m["price"] > 5]\n'
+            'result = len(f) + len(m)')
+    assert_equivalent(code, frames, rewritten=False)
+
+
+def test_rowwise_apply_is_vectorized(frames):
+    code = 'result = order_items.apply(lambda row: row["price"] * 2 + 1, axis=1)'
+    assert_equivalent(code, frames, rewritten=True)
+
+
+def test_code_over_budget_is_rejected(frames):
+    code = "total = 0\nfor _, row in order_items.iterrows():\n    total += row['price']\nresult = total"
+    with pytest.raises(CodeBudgetError):
+        rewrite(code, frames, budget=0)
+    assert rewrite(code, frames)[0] == code
+
+
+def test_order_lines_reuse_keeps_merge_row_order_after_an_append(frames):
+    fact = FactTable(frames)
+    new_item = pd.DataFrame({"order_id": ["a"], "product_id": ["p4"], "price": [3.0]})
+    tables = {**frames, "order_items": pd.concat([frames["order_items"], new_item], ignore_index=True)}
+    fact = fact.appended(tables, {"order_items": new_item})
+    assert fact.source_order
+
+    code = 'result = order_items.merge(orders, on="order_id")'
+    rewriter = CodeRewriter({**tables, "order_lines": fact.frame}, fact)
+    new_code = rewriter.rewrite(code)
+    assert rewriter.rewrites
+    before = run(code, tables)
+    after = run(new_code, {**tables, "order_lines": fact.frame})
+    pd.testing.assert_frame_equal(before, after)
+
+
+def test_rewrites_are_annotated_on_the_current_stage(frames):
+    code = 'result = order_items.apply(lambda row: row["price"] * 2 + 1, axis=1)'
+    with collect_stages() as trace, stage("exec"):
+        rewrite(code, frames)
+    assert trace.spans[0].attrs["rewrites"] == 1
+    assert "estimated_seconds" in trace.spans[0].attrs
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from agents.fact_table import FactTable
+from agents.table_store import append_to_store, load_tables, map_appended
+
+from conftest import order_frames, write_csvs
+
+
+def _append(data_dir, tmp_path, frames: dict, suffix: str = "-delta"):
+    data, store_dir = str(data_dir), str(data_dir / ".store")
+    tables = load_tables(data, store_dir)
+    paths = write_csvs(frames, tmp_path, suffix)
+    append_to_store({name: [path] for name, path in paths.items()}, data, store_dir)
+    updated, changes = map_appended(tables, store_dir)
+    return tables, updated, changes
+
+
+def _assert_rebuilt(fact: FactTable, tables: dict):
+    rebuilt = FactTable(tables)
+    pd.testing.assert_frame_equal(fact.frame, rebuilt.frame, check_categorical=False)
+    assert fact.source_order
+    for key, index in rebuilt.indexes.items():
+        assert {str(k): v.tolist() for k, v in fact.indexes[key].items()} == {str(k): v.tolist() for k, v in index.items()}
+
+
+def test_new_orders_match_a_full_rebuild(data_dir, tmp_path):
+    tables, updated, changes = _append(data_dir, tmp_path, order_frames(40, 8))
+    _assert_rebuilt(FactTable(tables).appended(updated, changes), updated)
+
+
+def test_lines_and_payments_for_existing_orders_match_a_full_rebuild(data_dir, tmp_path):
+    existing = order_frames(0, 40)
+    extra_lines = existing["order_items"].head(3).assign(order_item_id=9, price=1.0)
+    extra_payment = existing["payments"].tail(2).assign(payment_sequential=2, payment_value=5.0)
+    tables, updated, changes = _append(data_dir, tmp_path, {"order_items": extra_lines, "payments": extra_payment})
+
+    fact = FactTable(tables).appended(updated, changes)
+    _assert_rebuilt(fact, updated)
+    # Untouched orders keep their lines exactly where they were.
+    touched = set(extra_lines["order_id"]) | set(extra_payment["order_id"])
+    before = FactTable(tables).frame
+    kept = ~before["order_id"].astype(str).isin(touched).to_numpy()
+    assert (fact.frame["price"].to_numpy()[: len(before)][kept] == before["price"].to_numpy()[kept]).all()
+
+
+def test_lines_ahead_of_their_order_are_joined_once_it_arrives(data_dir, tmp_path):
+    delta = order_frames(40, 5)
+    tables, updated, changes = _append(data_dir, tmp_path, {"order_items": delta["order_items"]})
+    early = FactTable(tables).appended(updated, changes)
+    assert early.frame.tail(len(delta["order_items"]))["order_status"].isna().all()
+
+    _, latest, changes = _append(data_dir, tmp_path, {"orders": delta["orders"], "payments": delta["payments"]}, "-late")
+    fact = early.appended(latest, changes)
+    _assert_rebuilt(fact, latest)
+    assert fact.frame["order_status"].notna().all()
+    assert np.array_equal(fact.lookup("order_id", "o0041").index, FactTable(latest).lookup("order_id", "o0041").index)
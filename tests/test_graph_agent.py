@@ -0,0 +1,61 @@
+import asyncio
+import json
+import threading
+
+from agents import graph_agent
+from agents.fake_llm import FakeChatModel
+from agents.graph_agent import _parse_tool_output, _store
+
+
+class RecordingCache:
+    def __init__(self):
+        self.puts = []
+
+    def get(self, question, fingerprint, checksums=None):
+        return None
+
+    def put(self, question, fingerprint, result, depends_on=None):
+        self.puts.append((question, threading.current_thread()))
+        return "key"
+
+    def put_plot(self, key, image):
+        pass
+
+
+def tool_output(answer, error=False):
+    return json.dumps({"answer": answer, "query_id": None, "error": error})
+
+
+def test_failed_tool_output_is_flagged():
+    assert _parse_tool_output(tool_output("There are 99441 orders.")) == (None, "There are 99441 orders.", False)
+    assert _parse_tool_output(tool_output("No result generated from the query.", error=True))[2]
+    assert _parse_tool_output("Could not find an answer.")[2]
+
+
+def test_only_successful_answers_are_cached():
+    cache = RecordingCache()
+    response = {"answer": "Orders data not available."}
+    _store("q", response, True, cache, "fp", {"orders": "c"}, set())
+    assert cache.puts == [] and "cache_key" not in response
+
+    _store("q", response, False, cache, "fp", {"orders": "c"}, {"orders"})
+    assert response["cache_key"] == "key"
+
+
+def test_async_chain_writes_the_cache_off_the_event_loop(monkeypatch):
+    cache = RecordingCache()
+
+    async def retrieve(question, tables, route, session_id=None):
+        return tool_output("There are 99441 orders.")
+
+    monkeypatch.setattr(graph_agent, "_aretrieve", retrieve)
+    monkeypatch.setattr(graph_agent, "llm", FakeChatModel(responder=lambda messages: "There are 99441 orders."))
+    monkeypatch.setattr(graph_agent, "base_fingerprint", lambda tables: "fp")
+    monkeypatch.setattr(graph_agent, "table_checksums", lambda tables: {"orders": "c"})
+
+    async def ask():
+        return threading.current_thread(), await graph_agent.arun_agent_chain("how many orders are there", {}, cache=cache)
+
+    loop_thread, response = asyncio.run(ask())
+    assert response["cache_key"] == "key"
+    assert cache.puts and cache.puts[0][1] is not loop_thread
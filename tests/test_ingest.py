@@ -0,0 +1,98 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from agents import aggregates, fact_table
+from agents.ingest import refresh_tables
+from agents.shared_tables import attach_tables
+from agents.table_store import MANIFEST_FILE, append_to_store, data_fingerprint, load_tables, map_appended
+
+from conftest import order_frames, sample_frames, write_csvs
+
+
+@pytest.fixture
+def store(data_dir):
+    store_dir = str(data_dir / ".store")
+    load_tables(str(data_dir), store_dir)
+    return str(data_dir), store_dir
+
+
+def _versions(store_dir: str) -> dict:
+    with open(os.path.join(store_dir, MANIFEST_FILE)) as fh:
+        return {name: entry.get("version", 0) for name, entry in json.load(fh)["tables"].items()}
+
+
+def test_map_appended_returns_only_the_new_rows(store, tmp_path):
+    data, store_dir = store
+    tables = load_tables(data, store_dir)
+    delta = order_frames(40, 5)["orders"]
+    path = write_csvs({"orders": delta}, tmp_path, "-delta")["orders"]
+
+    assert append_to_store({"orders": [path]}, data, store_dir) == {"orders": 5}
+    updated, changes = map_appended(tables, store_dir)
+    assert list(changes) == ["orders"]
+    assert changes["orders"]["order_id"].astype(str).tolist() == delta["order_id"].tolist()
+    assert len(updated["orders"]) == len(tables["orders"]) + 5
+    # The tables passed in are left alone, and keys stay shared with the other tables.
+    assert len(tables["orders"]) == 40
+    assert updated["orders"]["customer_id"].dtype == updated["customers"]["customer_id"].dtype
+
+
+def test_delta_with_extra_and_reordered_columns_is_aligned(store, tmp_path):
+    data, store_dir = store
+    delta = order_frames(40, 3)["payments"]
+    drifted = delta[delta.columns[::-1]].assign(source="import")
+    path = write_csvs({"payments": drifted}, tmp_path, "-delta")["payments"]
+
+    assert append_to_store({"payments": [path]}, data, store_dir) == {"payments": 3}
+    payments = load_tables(data, store_dir)["payments"]
+    assert "source" not in payments.columns
+    assert payments.tail(3)["payment_value"].tolist() == delta["payment_value"].tolist()
+
+
+def test_delta_missing_a_column_is_rejected_and_nothing_is_written(store, tmp_path):
+    data, store_dir = store
+    delta = order_frames(40, 3)["order_items"].drop(columns="price")
+    path = write_csvs({"order_items": delta}, tmp_path, "-delta")["order_items"]
+    before = _versions(store_dir)
+
+    with pytest.raises(ValueError, match="price"):
+        append_to_store({"order_items": [path]}, data, store_dir)
+    assert _versions(store_dir) == before
+
+
+def test_empty_delta_leaves_the_version_alone(store, tmp_path):
+    data, store_dir = store
+    tables = load_tables(data, store_dir)
+    path = write_csvs({"orders": order_frames(40, 1)["orders"].iloc[:0]}, tmp_path, "-empty")["orders"]
+
+    assert append_to_store({"orders": [path]}, data, store_dir) == {}
+    assert map_appended(tables, store_dir) == (tables, {})
+
+
+def test_duplicate_deltas_are_applied_once(store, tmp_path):
+    data, store_dir = store
+    delta = {"orders": order_frames(40, 4)["orders"]}
+    first = write_csvs(delta, tmp_path, "-1")["orders"]
+    second = write_csvs(delta, tmp_path, "-2")["orders"]
+
+    assert append_to_store({"orders": [first, second]}, data, store_dir) == {"orders": 4}
+    assert append_to_store({"orders": [first]}, data, store_dir) == {}
+    assert len(load_tables(data, store_dir)["orders"]) == 44
+
+
+def test_full_reload_builds_cubes_and_order_lines_before_the_swap(store, data_dir, attached):
+    data, store_dir = store
+    tables = attach_tables(data, store_dir)
+    aggregates.get_cubes(tables)
+    write_csvs({"products": sample_frames()["products"].assign(product_weight_g=1.0)}, data_dir)
+    load_tables(data, store_dir)  # another worker rebuilds the store from the changed CSV
+
+    refresh_tables(data, store_dir)
+    fingerprint = data_fingerprint(tables)
+    assert (tables["products"]["product_weight_g"] == 1.0).all()
+    assert list(aggregates._cubes) == [fingerprint]
+    assert list(fact_table._facts) == [fingerprint]
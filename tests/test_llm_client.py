@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import HumanMessage
+
+from agents.fake_llm import FakeChatModel
+from agents.llm_client import ManagedChatModel
+
+
+class Provider:
+    """Counts the requests in flight at the fake provider."""
+
+    def __init__(self):
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+
+class SlowModel(FakeChatModel):
+    provider: Provider
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.provider.enter()
+        try:
+            return super()._generate(messages, stop, run_manager, **kwargs)
+        finally:
+            self.provider.leave()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.provider.enter()
+        try:
+            return await super()._agenerate(messages, stop, run_manager, **kwargs)
+        finally:
+            self.provider.leave()
+
+
+def managed(provider, latency=0.1):
+    llm = ManagedChatModel(max_concurrency=2, hedge_after=0.01)
+    llm.use(SlowModel(responder=lambda messages: "ok", latency=latency, provider=provider))
+    return llm
+
+
+def test_hedged_calls_stay_within_the_concurrency_bound():
+    provider = Provider()
+    llm = managed(provider)
+    with ThreadPoolExecutor(6) as pool:
+        replies = list(pool.map(lambda i: llm.invoke([HumanMessage(content=str(i))]).content, range(12)))
+    time.sleep(0.2)
+    assert replies == ["ok"] * 12
+    assert provider.peak <= 2
+    assert provider.active == 0
+
+
+def test_a_lone_call_is_still_hedged():
+    provider = Provider()
+    llm = managed(provider)
+    assert llm.invoke([HumanMessage(content="q")]).content == "ok"
+    assert llm.stats()["hedged"] == 1
+
+
+def test_async_hedged_calls_stay_within_the_concurrency_bound():
+    provider = Provider()
+    llm = managed(provider)
+
+    async def ask_all():
+        return await asyncio.gather(*(llm.ainvoke([HumanMessage(content=str(i))]) for i in range(12)))
+
+    replies = asyncio.run(ask_all())
+    assert [reply.content for reply in replies] == ["ok"] * 12
+    assert provider.peak <= 2
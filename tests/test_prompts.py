@@ -0,0 +1,51 @@
+import threading
+import time
+
+from agents import prompts
+from agents.prompts import PromptAssembler
+
+
+class SlowTiktoken:
+    """Stands in for tiktoken whose encoding download has not finished."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def get_encoding(self, name):
+        self.release.wait(5)
+        return type("Encoding", (), {"encode": staticmethod(lambda text: text.split())})()
+
+
+def wait_for_encoder(assembler):
+    deadline = time.monotonic() + 5
+    while assembler._encoder is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_tokens_are_estimated_while_the_encoding_loads(monkeypatch):
+    slow = SlowTiktoken()
+    monkeypatch.setattr(prompts, "tiktoken", slow)
+    assembler = PromptAssembler()
+    text = "one two three four five six seven eight"
+
+    started = time.monotonic()
+    assert assembler.count_tokens(text) == len(text) // 4
+    assert assembler.block("fp", "common", lambda: text) == (text, len(text) // 4)
+    assert time.monotonic() - started < 1
+
+    slow.release.set()
+    wait_for_encoder(assembler)
+    assert assembler.count_tokens(text) == 8
+    assert assembler.block("fp", "common", lambda: "not rebuilt") == (text, 8)
+
+
+def test_unavailable_encoding_keeps_estimating(monkeypatch):
+    class Offline:
+        def get_encoding(self, name):
+            raise OSError("Name resolution failed")
+
+    monkeypatch.setattr(prompts, "tiktoken", Offline())
+    assembler = PromptAssembler()
+    assert assembler.count_tokens("x" * 40) == 10
+    time.sleep(0.1)
+    assert assembler._encoder is None and assembler.count_tokens("x" * 40) == 10
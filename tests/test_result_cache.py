@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+from agents.result_cache import ResultCache
+
+FINGERPRINT = "base-v1"
+CHECKSUMS = {"orders": "o1", "payments": "p1", "customers": "c1"}
+
+
+def _result(answer: str = "42 orders", data=None) -> dict:
+    return {"intent": "order", "answer": answer, "summary": "", "data": data}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(cache_dir=str(tmp_path / "results"))
+
+
+def test_entry_survives_changes_to_tables_it_did_not_read(cache):
+    cache.put("how many orders?", FINGERPRINT, _result(), depends_on={"orders": "o1"})
+
+    hit = cache.get("How many orders", FINGERPRINT, {**CHECKSUMS, "payments": "p2", "customers": "c2"})
+    assert hit is not None and hit["answer"] == "42 orders"
+    assert cache.metrics["invalidations"] == 0
+
+
+def test_entry_is_dropped_when_a_table_it_read_changes(cache, tmp_path):
+    key = cache.put("how many orders?", FINGERPRINT, _result(), depends_on={"orders": "o1", "payments": "p1"})
+
+    assert cache.get("how many orders?", FINGERPRINT, {**CHECKSUMS, "payments": "p2"}) is None
+    assert cache.metrics["invalidations"] == 1
+    assert not (tmp_path / "results" / key).exists()
+    # Gone for good, even when asked with the old checksums again.
+    assert cache.get("how many orders?", FINGERPRINT, CHECKSUMS) is None
+
+
+def test_entry_without_dependencies_is_invalidated_by_any_checksum_check(cache):
+    cache.put("how many orders?", FINGERPRINT, _result())
+
+    assert cache.get("how many orders?", FINGERPRINT) is not None
+    assert cache.get("how many orders?", FINGERPRINT, CHECKSUMS) is None
+    assert cache.metrics["invalidations"] == 1
+
+
+def test_dependencies_and_data_survive_a_restart(cache, tmp_path):
+    pytest.importorskip("pyarrow")
+    frame = pd.DataFrame({"order_status": ["delivered", "canceled"], "orders": [40, 2]})
+    cache.put("orders by status", FINGERPRINT, _result("2 statuses", frame), depends_on={"orders": "o1"})
+
+    reopened = ResultCache(cache_dir=str(tmp_path / "results"))
+    hit = reopened.get("orders by status", FINGERPRINT, {**CHECKSUMS, "payments": "p9"})
+    assert hit["data"].to_frame().equals(frame)
+    assert reopened.get("orders by status", FINGERPRINT, {**CHECKSUMS, "orders": "o2"}) is None
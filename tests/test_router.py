@@ -0,0 +1,29 @@
+from agents.router import QuestionRouter, evaluate_router, load_labeled_questions
+
+# Leave-one-out floors on agents/router_questions.json. A change to the router,
+# its keywords or the labeled set that drops below one needs a look before merging.
+FLOORS = {
+    "tool_accuracy": 0.90,
+    "intent_accuracy": 0.95,
+    "coverage": 0.85,
+    "fast_path_tool_accuracy": 0.95,
+    "fast_path_intent_accuracy": 0.95,
+}
+
+
+def test_router_accuracy_stays_above_the_floor():
+    report = evaluate_router()
+    below = {name: round(report[name], 3) for name, floor in FLOORS.items() if report[name] < floor}
+    assert not below, f"below the floor: {below}; confusion: {report['confusion']}"
+
+
+def test_routes_tool_and_intent():
+    router = QuestionRouter(load_labeled_questions())
+
+    route = router.route("plot the number of orders per month")
+    assert route.tool == "order_query_tool" and route.tool_confident
+    assert route.show_plot
+
+    route = router.route("how many customers live in SP")
+    assert route.tool == "customer_query_tool"
+    assert (route.show_data, route.show_plot) == (False, False)
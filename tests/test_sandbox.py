@@ -0,0 +1,41 @@
+import gc
+import os
+
+import pandas as pd
+
+from agents import sandbox
+from agents.lazy_result import LazyResult
+from agents.sandbox import SandboxError, SandboxTimeout, SandboxUnavailable, code_failure
+
+
+def test_only_a_busy_pool_is_transient():
+    assert code_failure(SandboxTimeout("Generated code exceeded the 30s time limit."))
+    assert code_failure(SandboxError("Generated code crashed its worker (exit code -9)."))
+    assert code_failure(KeyError("order_date"))
+    assert not code_failure(SandboxUnavailable("All sandbox workers are busy."))
+
+
+def test_long_results_come_back_as_a_lazily_read_parquet_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(sandbox, "SANDBOX_INLINE_ROWS", 10)
+    path = str(tmp_path / "result.parquet")
+    frame = pd.DataFrame({"state": ["SP", "RJ"] * 10, "orders": range(20)}).set_index("state")
+
+    assert sandbox._encode_result(frame.head(5), path)[0] == "frame"
+    reply = sandbox._encode_result(frame, path)
+    assert reply == ("parquet", path)
+
+    lazy = LazyResult.from_result(sandbox._parquet_result(path))
+    assert lazy.nbytes == 0
+    assert list(lazy.columns) == ["category", "value"]
+    assert lazy.page(1, size=8)["value"].tolist() == list(range(8, 16))
+    del lazy
+    gc.collect()
+    assert not os.path.exists(path)
+
+
+def test_result_bytes_count_only_the_codes_of_shared_keys():
+    keys = pd.CategoricalDtype([f"customer-{i}" for i in range(10_000)])
+    frame = pd.DataFrame({"customer_id": pd.Series(["customer-1", "customer-2"], dtype=keys), "orders": [3, 4]})
+
+    assert LazyResult(frame).nbytes < 1_000
+    assert LazyResult(frame.set_index("customer_id")["orders"], index_as_column=True).nbytes < 1_000
@@ -0,0 +1,70 @@
+import asyncio
+import base64
+import io
+
+import pandas as pd
+
+from agents import service
+from agents.service import QueryService
+
+PNG = b"\x89PNG fake"
+
+
+def stream_events(monkeypatch, events, max_results=service.MAX_RESULTS):
+    async def fake_chain(question, tables, **kwargs):
+        for event in events:
+            yield event
+
+    monkeypatch.setattr(service, "astream_agent_chain", fake_chain)
+    monkeypatch.setattr(service, "MAX_RESULTS", max_results)
+    svc = QueryService({})
+    monkeypatch.setattr(service, "data_fingerprint", lambda tables: "fp")
+
+    async def collect():
+        events, _ = svc.stream("How many orders?", None, True)
+        return [event async for event in events]
+
+    return svc, asyncio.run(collect())
+
+
+def test_plot_is_kept_with_its_result(monkeypatch):
+    svc, events = stream_events(monkeypatch, [
+        {"event": "data", "answer": "1 order", "data": pd.DataFrame({"n": [1]})},
+        {"event": "plot", "image": io.BytesIO(PNG)},
+    ])
+    plot = events[-1]
+    assert plot == {"event": "plot", "result_id": events[0]["result_id"]}
+    assert svc._results[plot["result_id"]]["png"] == PNG
+
+
+def test_plot_without_a_kept_result_is_sent_inline(monkeypatch):
+    _, events = stream_events(monkeypatch, [
+        {"event": "data", "answer": "1 order", "data": pd.DataFrame({"n": [1]})},
+        {"event": "plot", "image": io.BytesIO(PNG)},
+    ], max_results=0)
+    assert base64.b64decode(events[-1]["png"]) == PNG
+
+    _, events = stream_events(monkeypatch, [{"event": "plot", "image": io.BytesIO(PNG)}])
+    assert base64.b64decode(events[-1]["png"]) == PNG
+
+
+def test_plot_error_is_sent_inline(monkeypatch):
+    _, events = stream_events(monkeypatch, [{"event": "plot", "image": "Plot generation failed"}])
+    assert events[-1]["error"] == "Plot generation failed"
+
+
+def test_result_page_must_be_a_non_negative_integer():
+    from aiohttp.test_utils import TestClient, TestServer
+
+    svc = QueryService({})
+
+    async def fetch_pages():
+        record = await svc._remember("q", pd.DataFrame({"n": range(3)}))
+        async with TestClient(TestServer(svc.build_app())) as client:
+            statuses = []
+            for page in ("0", "abc", "-1", "1.5"):
+                response = await client.get(f"/results/{record['result_id']}", params={"page": page})
+                statuses.append(response.status)
+            return statuses
+
+    assert asyncio.run(fetch_pages()) == [200, 400, 400, 400]
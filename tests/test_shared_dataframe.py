@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+
+from agents import shared_dataframe
+from agents.lazy_result import LazyResult
+from agents.shared_dataframe import ResultStore
+
+
+def _frame(rows: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({"value": range(rows)}, dtype="int64")  # 8 bytes a row, plus the index
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_dataframe.time, "time", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_frames_are_evicted_past_the_budget():
+    store = ResultStore(max_bytes=20_000, ttl_seconds=60)
+    for query_id in ("a", "b"):
+        store.put(query_id, _frame())
+    assert store.get("a") is not None  # "b" is now the least recently used
+
+    store.put("c", _frame())
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.stats()["evictions"] == 1
+    assert store.bytes_held <= store.max_bytes
+
+
+def test_a_frame_larger_than_the_budget_is_still_returned():
+    store = ResultStore(max_bytes=1_000, ttl_seconds=60)
+    store.put("a", _frame())
+    store.put("big", _frame(10_000))
+    assert store.get("big") is not None
+    assert store.get("a") is None
+
+
+def test_frames_expire_after_the_ttl(clock):
+    store = ResultStore(max_bytes=1e9, ttl_seconds=60)
+    store.put("a", _frame())
+    clock[0] += 30
+    store.put("b", _frame())
+
+    clock[0] += 45
+    assert store.get("a") is None
+    assert store.get("b") is not None
+    assert store.stats()["expirations"] == 1
+    assert store.bytes_held == LazyResult(_frame()).nbytes
+
+
+def test_sessions_are_kept_apart_and_cleared_alone():
+    store = ResultStore(max_bytes=1e9, ttl_seconds=60)
+    store.put("q", _frame(10), session_id="alice")
+    store.put("q", _frame(20), session_id="bob")
+    assert len(store.get("q", session_id="alice")) == 10
+    assert store.get("q") is None
+
+    store.clear_session("alice")
+    assert store.get("q", session_id="alice") is None
+    assert len(store.get("q", session_id="bob")) == 20
+    assert store.bytes_held == LazyResult(_frame(20)).nbytes
+
+
+def test_evicted_frames_spill_to_parquet_and_read_back_lazily(tmp_path, clock):
+    pytest.importorskip("pyarrow")
+    store = ResultStore(max_bytes=20_000, ttl_seconds=60, spill_dir=str(tmp_path))
+    store.put("a", _frame())
+    store.put("b", _frame())
+    store.put("c", _frame())
+
+    spilled = store.get("a")
+    assert isinstance(spilled, LazyResult) and spilled.nbytes == 0
+    assert spilled.to_frame()["value"].tolist() == list(range(1000))
+    assert store.stats()["spill_hits"] == 1
+
+    clock[0] += 61
+    assert store.get("a") is None
+    assert list(tmp_path.iterdir()) == []
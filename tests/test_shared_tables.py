@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+import pandas as pd
+
+from agents.shared_tables import table_views
+
+
+def test_import_leaves_pandas_options_alone():
+    code = "import pandas as pd, agents.shared_tables; print(pd.get_option('mode.copy_on_write'))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "False"
+
+
+def test_writes_to_views_do_not_reach_shared_tables(copy_on_write):
+    shared = {"orders": pd.DataFrame({"order_id": ["a", "b"], "price": [1.0, 2.0]})}
+    views = table_views(shared)
+    assert pd.get_option("mode.copy_on_write")
+
+    views["orders"].loc[views["orders"]["order_id"] == "a", "price"] = 99.0
+    views["orders"]["price"] *= 2
+    views["orders"]["extra"] = 1
+    assert shared["orders"]["price"].tolist() == [1.0, 2.0]
+    assert list(shared["orders"].columns) == ["order_id", "price"]
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("duckdb")
+
+from agents.sql_engine import run_sql
+
+
+@pytest.fixture
+def relations():
+    return {"customers": pd.DataFrame({"customer_id": ["x", "y", "z"], "city": ["a;b", "sao paulo", "a;b"]})}
+
+
+def test_semicolons_inside_a_statement_are_allowed(relations):
+    df = run_sql("SELECT customer_id FROM customers WHERE city = 'a;b' ORDER BY customer_id;", relations)
+    assert df["customer_id"].tolist() == ["x", "z"]
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1; SELECT 2",
+    "SELECT 1; DROP TABLE customers",
+    "DELETE FROM customers",
+])
+def test_only_one_select_runs(relations, sql):
+    with pytest.raises(ValueError):
+        run_sql(sql, relations)
+
+
+def test_concurrent_statements_each_get_their_answer(relations):
+    with ThreadPoolExecutor(8) as pool:
+        counts = list(pool.map(lambda i: run_sql(f"SELECT count(*) + {i} AS n FROM customers", relations)["n"][0],
+                               range(32)))
+    assert counts == [3 + i for i in range(32)]
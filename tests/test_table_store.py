@@ -0,0 +1,13 @@
+import pytest
+
+from agents import table_store
+
+
+def test_csv_fallback_warns_instead_of_printing(data_dir, monkeypatch, capsys):
+    monkeypatch.setattr(table_store, "feather", None)
+
+    with pytest.warns(RuntimeWarning, match="pyarrow is not installed"):
+        tables = table_store.load_tables(str(data_dir), str(data_dir / ".store"))
+    assert len(tables["orders"]) == 40
+    assert tables["orders"]["order_id"].dtype == tables["payments"]["order_id"].dtype
+    assert capsys.readouterr().out == ""